@@ -0,0 +1,58 @@
+# app/api/adherence.py
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import date
+
+from app.db.database import get_db
+from app.services.adherence import get_adherence, default_range, user_timezone, PERIODS
+from app.services.timezone import get_current_time_in_timezone
+
+router = APIRouter()
+
+# --- Pydantic 模型 ---
+class AdherenceBucket(BaseModel):
+    period_start: date
+    scheduled: int
+    taken: int
+    rate: Optional[float] = None
+
+class AdherenceResponse(BaseModel):
+    user_id: str
+    period: str
+    start: date
+    end: date
+    scheduled: int
+    taken: int
+    rate: Optional[float] = None
+    buckets: List[AdherenceBucket]
+
+# --- API 端點 ---
+
+@router.get("/{user_id}", response_model=AdherenceResponse)
+def get_user_adherence(
+    user_id: str,
+    period: str = "day",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    medication_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    查詢使用者的服藥遵從度 (依日/週/月分組)。
+    未指定 start/end 時依使用者時區的今天：day = 最近 7 天、week = 最近 4 週、month = 最近 3 個月。
+    """
+    if period not in PERIODS:
+        raise HTTPException(status_code=400, detail=f"period 必須是 {', '.join(PERIODS)} 其中之一")
+
+    if start is None or end is None:
+        today = get_current_time_in_timezone(user_timezone(db, user_id)).date()
+        default_start, default_end = default_range(period, end or today)
+        start = start or default_start
+        end = end or default_end
+    if start > end:
+        raise HTTPException(status_code=400, detail="start 不可晚於 end")
+
+    return get_adherence(db, user_id, start, end, period=period, medication_id=medication_id)
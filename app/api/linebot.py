@@ -1,27 +1,33 @@
-from fastapi import APIRouter, Request, Header
-from linebot import LineBotApi, WebhookParser
-from linebot.models import MessageEvent, TextMessage, TextSendMessage
-from configparser import ConfigParser
+import json
+import logging
 
-router = APIRouter()
+from fastapi import APIRouter, Request, Header, HTTPException
+
+from app.services.line_webhook import line_webhook, verify_signature
+from app.utils.config import get_settings
 
-# 統一讀取 config.ini
-config = ConfigParser()
-config.read('./app/config/config.ini')
-CHANNEL_SECRET = config.get('LINE', 'channel_secret')
-CHANNEL_ACCESS_TOKEN = config.get('LINE', 'channel_access_token')
+logger = logging.getLogger(__name__)
 
-line_bot_api = LineBotApi(CHANNEL_ACCESS_TOKEN)
-parser = WebhookParser(CHANNEL_SECRET)
+router = APIRouter()
 
-@router.post("/callback")
+@router.post("/callback", response_model=str)
 async def callback(request: Request, x_line_signature: str = Header(None)):
+    """
+    LINE webhook 入口：驗證簽章後把事件交給背景 worker，立即回應 200。
+    回覆訊息由 app/services/line_webhook.py 的 worker 非同步送出。
+    """
+    channel_secret = get_settings().line.channel_secret
+    if not channel_secret:
+        raise HTTPException(status_code=503, detail="未設定 [LINE] channel_secret")
+
     body = await request.body()
-    events = parser.parse(body.decode('utf-8'), x_line_signature)
-    for event in events:
-        if isinstance(event, MessageEvent) and isinstance(event.message, TextMessage):
-            line_bot_api.reply_message(
-                event.reply_token,
-                TextSendMessage(text="您好，這是用藥管理及藥物警戒系統。請使用下方圖文選單操作。")
-            )
+    if not verify_signature(body, x_line_signature, channel_secret):
+        logger.warning("LINE webhook 簽章驗證失敗")
+        raise HTTPException(status_code=400, detail="Invalid signature")
+    try:
+        events = json.loads(body).get("events", [])
+    except (ValueError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid request body")
+
+    line_webhook.submit(events)
     return "OK"
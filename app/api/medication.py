@@ -1,29 +1,24 @@
 # medication.py (修正版 - 解決 JSON 序列化問題)
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update, delete, select
 from pydantic import BaseModel, validator
 from typing import List, Optional
 from datetime import date
 import logging
-import json
 
-from app.db.database import get_db
-from app.models.medication import Medication
+from app.db.database import get_async_db, same_shard
+from app.models.medication import Medication, MEDICATION_STATUSES
+from app.services.adherence import remove_medication_rollups, reassign_medication_rollups
+from app.services.cache import response_cache, mark_changed, dumps, to_model, NS_MEDICATIONS
+from app.services.speculative import speculative_analyzer
+from app.utils.logging_config import log_payload
 
-# 設定日誌記錄
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [MEDICATION_API] - %(message)s')
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# --- 自訂 JSON 編碼器，用來處理 date 物件 ---
-class DateTimeEncoder(json.JSONEncoder):
-    """自訂 JSON 編碼器，能夠處理 date 和 datetime 物件"""
-    def default(self, obj):
-        if isinstance(obj, date):
-            return obj.isoformat()
-        return super().default(obj)
-
 # --- Pydantic 模型 (Schemas) ---
 class MedicationBase(BaseModel):
     user_id: str
@@ -57,35 +52,131 @@ class MedicationUpdate(MedicationBase):
 
 class MedicationResponse(MedicationBase):
     id: int
+    version: Optional[int] = None
+
+# --- 批次操作用的 Schemas ---
+class MedicationSelector(BaseModel):
+    """
+    批次操作的選取條件。一律限定在單一使用者底下，
+    並且必須至少指定 ids 或一個篩選欄位，避免誤改/誤刪使用者的全部藥物。
+    """
+    user_id: str
+    ids: Optional[List[int]] = None
+    status: Optional[str] = None
+    name: Optional[str] = None
+    end_date_before: Optional[date] = None
+
+    def has_criteria(self) -> bool:
+        return any(v is not None for v in (self.ids, self.status, self.name, self.end_date_before))
+
+class MedicationBulkUpdate(MedicationSelector):
+    changes: MedicationUpdate
+
+class MedicationStatusTransition(MedicationSelector):
+    to_status: str
+
+class MedicationBulkResult(BaseModel):
+    affected: int
+    medications: List[MedicationResponse]
+
+class MedicationBulkDeleteResult(BaseModel):
+    affected: int
+    deleted_ids: List[int]
+
+class DeleteResult(BaseModel):
+    ok: bool
+
+# --- 批次操作輔助函式 ---
+def _selector_conditions(selector: MedicationSelector) -> list:
+    """將選取條件轉換為 WHERE 子句 (user_id 一定會帶上，可走 ix_medications_user_id 索引)"""
+    if not selector.has_criteria():
+        raise HTTPException(status_code=400, detail="批次操作必須指定 ids 或至少一個篩選條件。")
+    conditions = [Medication.user_id == selector.user_id]
+    if selector.ids is not None:
+        conditions.append(Medication.id.in_(selector.ids))
+    if selector.status is not None:
+        conditions.append(Medication.status == selector.status)
+    if selector.name is not None:
+        conditions.append(Medication.name == selector.name)
+    if selector.end_date_before is not None:
+        conditions.append(Medication.end_date < selector.end_date_before)
+    return conditions
+
+async def _bulk_update(db: AsyncSession, user_id: str, conditions: list, values: dict) -> List[Medication]:
+    """
+    以單一 UPDATE 敘述更新所有符合條件的藥物並遞增 version，在同一個交易內回傳更新後的資料列。
+    SQLite 3.35 以上使用 RETURNING；較舊的版本則先取出 id 再更新。
+    """
+    values = dict(values, version=Medication.version + 1)
+    try:
+        if getattr(db.bind.dialect, "update_returning", False):
+            stmt = (
+                update(Medication)
+                .where(*conditions)
+                .values(**values)
+                .returning(Medication)
+                .execution_options(synchronize_session=False)
+            )
+            medications = list((await db.scalars(stmt)).all())
+        else:
+            ids = list((await db.scalars(select(Medication.id).where(*conditions))).all())
+            if ids:
+                await db.execute(
+                    update(Medication)
+                    .where(Medication.id.in_(ids))
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+            medications = list((await db.scalars(
+                select(Medication).where(Medication.id.in_(ids)).execution_options(populate_existing=True)
+            )).all())
+        await mark_changed(db, NS_MEDICATIONS, [user_id])
+        await db.commit()
+        response_cache.invalidate(NS_MEDICATIONS, [user_id])
+        speculative_analyzer.schedule([user_id])
+        return medications
+    except Exception as e:
+        logger.error(f"批次更新藥物時發生錯誤: {e}", exc_info=True)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"伺服器內部發生嚴重錯誤: {str(e)}")
+
+async def _cached_medication_list(db: AsyncSession, user_id: str) -> Response:
+    """使用者的藥物清單 (讀取快取；未命中時查詢並快取序列化後的結果)"""
+    await response_cache.sync(db)
+    payload = response_cache.get(NS_MEDICATIONS, user_id)
+    if payload is None:
+        generation = response_cache.generation()
+        meds = (await db.scalars(select(Medication).where(Medication.user_id == user_id))).all()
+        payload = dumps([to_model(MedicationResponse, med) for med in meds])
+        response_cache.set(NS_MEDICATIONS, user_id, payload, generation=generation)
+    return Response(content=payload, media_type="application/json")
 
 # --- API 端點 (Endpoints) ---
 
 @router.get("/", response_model=List[MedicationResponse])
-def list_medications(user_id: str, db: Session = Depends(get_db)):
-    meds = db.query(Medication).filter(Medication.user_id == user_id).all()
-    return meds
+async def list_medications(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    return await _cached_medication_list(db, user_id)
 
 # 修正批次新增藥物的端點
 @router.post("/", response_model=List[MedicationResponse], status_code=201)
-def create_medications_in_batch(
+async def create_medications_in_batch(
     medications_to_create: List[MedicationCreate],
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    logging.info("--- 成功進入 `create_medications_in_batch` 函式 ---")
+    logger.debug("--- 成功進入 `create_medications_in_batch` 函式 ---")
     
     try:
-        # 修正：使用自訂的 DateTimeEncoder 來處理日期物件
-        received_data = [med.dict() for med in medications_to_create]
-        logging.info(f"收到批次藥物資料: {json.dumps(received_data, indent=2, ensure_ascii=False, cls=DateTimeEncoder)}")
+        # 請求內文只抽樣記錄，並限制長度 (見 app/utils/logging_config.py)
+        log_payload(logger, "收到批次藥物資料", [med.dict() for med in medications_to_create])
 
         created_medications_db = []
         
         for med_data in medications_to_create:
-            logging.info(f"正在處理藥物: {med_data.name} (使用者 ID: {med_data.user_id})")
+            logger.debug(f"正在處理藥物: {med_data.name} (使用者 ID: {med_data.user_id})")
             
             # 檢查 user_id
             if not med_data.user_id:
-                logging.error("儲存失敗：有一筆藥物資料缺少 'user_id'。")
+                logger.error("儲存失敗：有一筆藥物資料缺少 'user_id'。")
                 raise HTTPException(status_code=400, detail="所有藥物紀錄都必須包含使用者 ID (user_id)。")
 
             # 建立資料庫物件
@@ -94,51 +185,140 @@ def create_medications_in_batch(
             created_medications_db.append(db_med)
         
         # 一次性提交所有變更
-        db.commit()
+        user_ids = [med.user_id for med in created_medications_db]
+        await mark_changed(db, NS_MEDICATIONS, user_ids)
+        await db.commit()
+        response_cache.invalidate(NS_MEDICATIONS, user_ids)
+        # 使用者接著通常會打開交互作用分頁，先在背景開始分析
+        speculative_analyzer.schedule(user_ids)
         
         # 刷新每個物件以獲取資料庫生成的 ID
         for med in created_medications_db:
-            db.refresh(med)
+            await db.refresh(med)
             
-        logging.info(f"資料庫操作完成，成功建立 {len(created_medications_db)} 筆藥物紀錄。")
+        logger.info(f"資料庫操作完成，成功建立 {len(created_medications_db)} 筆藥物紀錄。")
         return created_medications_db
 
     except HTTPException as e:
         # 重新拋出 HTTP 異常
-        db.rollback()
+        await db.rollback()
         raise e
     except Exception as e:
         # 捕捉其他未預期的錯誤
-        logging.error(f"在批次建立藥物時發生嚴重錯誤: {e}", exc_info=True)
-        db.rollback()
+        logger.error(f"在批次建立藥物時發生嚴重錯誤: {e}", exc_info=True)
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"伺服器內部發生嚴重錯誤: {str(e)}")
 
-@router.put("/{med_id}", response_model=MedicationResponse)
-def update_medication(med_id: int, update_data: MedicationUpdate, db: Session = Depends(get_db)):
-    med = db.query(Medication).filter(Medication.id == med_id).first()
-    if not med:
+@router.patch("/bulk", response_model=MedicationBulkResult)
+async def bulk_update_medications(request: MedicationBulkUpdate, db: AsyncSession = Depends(get_async_db)):
+    """依 id 清單或篩選條件批次更新藥物 (單一 UPDATE、單一交易)"""
+    conditions = _selector_conditions(request)
+    # 批次更新不允許把藥物搬到其他使用者名下
+    changes = request.changes.dict(exclude_unset=True, exclude={"user_id"})
+    if not changes:
+        raise HTTPException(status_code=400, detail="沒有需要更新的欄位。")
+    if "status" in changes and changes["status"] not in MEDICATION_STATUSES:
+        raise HTTPException(status_code=400, detail=f"不支援的用藥狀態: {changes['status']}")
+
+    medications = await _bulk_update(db, request.user_id, conditions, changes)
+    logger.info(f"批次更新使用者 {request.user_id} 的 {len(medications)} 筆藥物紀錄。")
+    return {"affected": len(medications), "medications": medications}
+
+@router.post("/bulk/status", response_model=MedicationBulkResult)
+async def bulk_transition_status(request: MedicationStatusTransition, db: AsyncSession = Depends(get_async_db)):
+    """
+    批次轉換用藥狀態，例如整個療程 進行中 → 已停藥。
+    選取條件中的 status 視為轉換前的狀態，只有目前狀態相符的藥物會被更新。
+    """
+    if request.to_status not in MEDICATION_STATUSES:
+        raise HTTPException(status_code=400, detail=f"不支援的用藥狀態: {request.to_status}")
+    conditions = _selector_conditions(request)
+    conditions.append(Medication.status != request.to_status)
+
+    medications = await _bulk_update(db, request.user_id, conditions, {"status": request.to_status})
+    logger.info(f"使用者 {request.user_id} 的 {len(medications)} 筆藥物狀態已轉為「{request.to_status}」。")
+    return {"affected": len(medications), "medications": medications}
+
+@router.post("/bulk/delete", response_model=MedicationBulkDeleteResult)
+async def bulk_delete_medications(request: MedicationSelector, db: AsyncSession = Depends(get_async_db)):
+    """依 id 清單或篩選條件批次刪除藥物 (單一 DELETE、單一交易)"""
+    conditions = _selector_conditions(request)
+    try:
+        if getattr(db.bind.dialect, "delete_returning", False):
+            stmt = (
+                delete(Medication)
+                .where(*conditions)
+                .returning(Medication.id)
+                .execution_options(synchronize_session=False)
+            )
+            deleted_ids = list((await db.scalars(stmt)).all())
+        else:
+            deleted_ids = list((await db.scalars(select(Medication.id).where(*conditions))).all())
+            if deleted_ids:
+                await db.execute(
+                    delete(Medication)
+                    .where(Medication.id.in_(deleted_ids))
+                    .execution_options(synchronize_session=False)
+                )
+        # 遵從度彙總不與 medications 關聯查詢，刪除的藥物要一併刪除彙總
+        await db.run_sync(lambda session: remove_medication_rollups(session, deleted_ids))
+        await mark_changed(db, NS_MEDICATIONS, [request.user_id])
+        await db.commit()
+        response_cache.invalidate(NS_MEDICATIONS, [request.user_id])
+        speculative_analyzer.schedule([request.user_id])
+    except Exception as e:
+        logger.error(f"批次刪除藥物時發生錯誤: {e}", exc_info=True)
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=f"伺服器內部發生嚴重錯誤: {str(e)}")
+
+    logger.info(f"批次刪除使用者 {request.user_id} 的 {len(deleted_ids)} 筆藥物紀錄。")
+    return {"affected": len(deleted_ids), "deleted_ids": deleted_ids}
+
+async def _get_owned(db: AsyncSession, med_id: int, user_id: Optional[str]) -> Medication:
+    """user_id (查詢參數) 有指定時必須是藥物的擁有者"""
+    med = await db.get(Medication, med_id)
+    if not med or (user_id is not None and med.user_id != user_id):
         raise HTTPException(status_code=404, detail="Medication not found")
+    return med
+
+@router.put("/{med_id}", response_model=MedicationResponse)
+async def update_medication(med_id: int, update_data: MedicationUpdate, user_id: Optional[str] = None,
+                            db: AsyncSession = Depends(get_async_db)):
+    med = await _get_owned(db, med_id, user_id)
     
+    # user_id 可能被修改，新舊使用者的清單都要失效
+    user_ids = [med.user_id]
     update_dict = update_data.dict(exclude_unset=True)
+    if update_dict.get("user_id") and not same_shard(med.user_id, update_dict["user_id"]):
+        raise HTTPException(status_code=400, detail="無法將藥物移轉給位於其他資料分片的使用者。")
     for key, value in update_dict.items():
         setattr(med, key, value)
+    med.version = (med.version or 0) + 1
+    user_ids.append(med.user_id)
+    if med.user_id != user_ids[0]:
+        # 遵從度彙總記在擁有者名下，改依新擁有者重新計算
+        await db.run_sync(lambda session: reassign_medication_rollups(session, med_id, med.user_id))
         
-    db.commit()
-    db.refresh(med)
+    await mark_changed(db, NS_MEDICATIONS, user_ids)
+    await db.commit()
+    response_cache.invalidate(NS_MEDICATIONS, user_ids)
+    speculative_analyzer.schedule(user_ids)
+    await db.refresh(med)
     return med
 
-@router.delete("/{med_id}")
-def delete_medication(med_id: int, db: Session = Depends(get_db)):
-    med = db.query(Medication).filter(Medication.id == med_id).first()
-    if not med:
-        raise HTTPException(status_code=404, detail="Medication not found")
-    db.delete(med)
-    db.commit()
+@router.delete("/{med_id}", response_model=DeleteResult)
+async def delete_medication(med_id: int, user_id: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    med = await _get_owned(db, med_id, user_id)
+    await db.delete(med)
+    await db.run_sync(lambda session: remove_medication_rollups(session, [med_id]))
+    await mark_changed(db, NS_MEDICATIONS, [med.user_id])
+    await db.commit()
+    response_cache.invalidate(NS_MEDICATIONS, [med.user_id])
+    speculative_analyzer.schedule([med.user_id])
     return {"ok": True}
 
 # 新增：根據 user_id 查詢藥物的端點
 @router.get("/user/{user_id}", response_model=List[MedicationResponse])
-def list_medications_by_user_id(user_id: str, db: Session = Depends(get_db)):
+async def list_medications_by_user_id(user_id: str, db: AsyncSession = Depends(get_async_db)):
     """根據使用者 ID 查詢該使用者的所有藥物紀錄"""
-    meds = db.query(Medication).filter(Medication.user_id == user_id).all()
-    return meds
\ No newline at end of file
+    return await _cached_medication_list(db, user_id)
\ No newline at end of file
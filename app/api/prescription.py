@@ -4,16 +4,40 @@ import json
 import re
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException # 修改點：匯入 Form
 from app.services.germini_service import call_gemini_vision
+from app.services.bulkhead import ai_bulkhead, BulkheadFull
+from app.services.admission import recognize_admission
+from app.utils.logging_config import log_payload
 from datetime import date
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+from pydantic import BaseModel
 
 # 設定日誌，方便追蹤問題
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+class RecognizedMedication(BaseModel):
+    name: str
+    effect: Optional[str] = None
+    dose: Optional[str] = None
+    frequency: Optional[str] = None
+    remind_times: Any = None  # AI 推斷的提醒時間，格式由提示詞決定，原樣交給前端
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    status: str
+
+class RecognizeResponse(BaseModel):
+    medications: List[RecognizedMedication]
+
+def _as_text(value: Any) -> Optional[str]:
+    """Gemini 偶爾回傳數字或陣列 (例如 "dose": 2)，統一轉成字串以符合回應模型；null 維持 None"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
 def _parse_gemini_response(response: dict) -> List[Dict[str, Any]]:
     """
     解析並清理 Gemini API 的回應，並將其轉換為前端需求的格式。
@@ -34,44 +58,50 @@ def _parse_gemini_response(response: dict) -> List[Dict[str, Any]]:
         data = json.loads(json_str)
 
         if "medications" not in data or not isinstance(data["medications"], list):
-            logger.warning(f"Gemini 回應中缺少 'medications' 陣列或格式不符。回應: {data}")
+            log_payload(logger, "Gemini 回應中缺少 'medications' 陣列或格式不符。回應", data,
+                        level=logging.WARNING, sample=False)
             return []
 
         # --- (新增) 驗證與格式化每個藥物物件 ---
         validated_medications = []
         for med in data["medications"]:
+            if not isinstance(med, dict):
+                log_payload(logger, "捨棄一筆格式不符的藥物紀錄", med, level=logging.WARNING, sample=False)
+                continue
             # 使用 .get() 提供預設值，避免因缺少鍵而崩潰
             validated_med = {
-                "name": med.get("name", ""),
-                "effect": med.get("effect", ""),
-                "dose": med.get("dose", ""),
-                "frequency": med.get("frequency", ""),
+                "name": _as_text(med.get("name")) or "",
+                "effect": _as_text(med.get("effect", "")),
+                "dose": _as_text(med.get("dose", "")),
+                "frequency": _as_text(med.get("frequency", "")),
                 "remind_times": med.get("remind_times", []), # 預設為空陣列
-                "start_date": med.get("start_date", date.today().isoformat()),
-                "end_date": med.get("end_date", ""),
+                "start_date": _as_text(med.get("start_date", date.today().isoformat())),
+                "end_date": _as_text(med.get("end_date", "")),
                 "status": "進行中" # 提供預設狀態，方便前端使用
             }
             # 基本驗證：至少藥物名稱不能為空
             if validated_med["name"]:
                 validated_medications.append(validated_med)
             else:
-                logger.warning(f"捨棄一筆無效的藥物紀錄 (缺少名稱): {med}")
+                log_payload(logger, "捨棄一筆無效的藥物紀錄 (缺少名稱)", med, level=logging.WARNING, sample=False)
         
         logger.info(f"成功解析並驗證了 {len(validated_medications)} 筆藥物紀錄。")
         return validated_medications
 
     except (KeyError, IndexError) as e:
-        logger.error(f"解析 Gemini 回應時發生索引或鍵錯誤: {e}\n原始回應: {response}")
+        logger.error(f"解析 Gemini 回應時發生索引或鍵錯誤: {e}")
+        log_payload(logger, "原始回應", response, level=logging.ERROR, sample=False)
         raise HTTPException(status_code=500, detail="解析藥單辨識結果失敗：回應結構不符預期。")
     except json.JSONDecodeError as e:
-        logger.error(f"解析 Gemini 回應時發生 JSON 解碼錯誤: {e}\n無效的 JSON 字串: '{json_str}'")
+        logger.error(f"解析 Gemini 回應時發生 JSON 解碼錯誤: {e}")
+        log_payload(logger, "無效的 JSON 字串", json_str, level=logging.ERROR, sample=False)
         raise HTTPException(status_code=500, detail="解析藥單辨識結果失敗：回應的並非有效的 JSON 格式。")
     except Exception as e:
         logger.error(f"解析 Gemini 回應時發生未預期錯誤: {e}")
         raise HTTPException(status_code=500, detail=f"解析藥單辨識結果時發生未知錯誤。")
 
 
-@router.post("/recognize", summary="上傳並辨識處方箋圖片 (v2)", tags=["處方箋 (Prescription)"])
+@router.post("/recognize", response_model=RecognizeResponse, summary="上傳並辨識處方箋圖片 (v2)", tags=["處方箋 (Prescription)"])
 async def upload_prescription(
     # --- 修改點 1: 將 Header 改為 Form，並使用更簡潔的變數名稱 ---
     file: UploadFile = File(..., description="使用者上傳的藥單圖片檔"),
@@ -93,12 +123,18 @@ async def upload_prescription(
     if not file.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="上傳的檔案必須是圖片格式。")
 
+    # 單一使用者的呼叫頻率限制 (超過時回傳 429 + Retry-After)
+    priority = await recognize_admission.admit(user_id)
+
     image_bytes = await file.read()
 
     try:
         # 呼叫 Gemini 服務
         # --- 修改點 3: 更新傳遞給 gemini 服務的變數名稱 ---
-        gemini_response = call_gemini_vision(
+        # 同步的 Gemini 呼叫交給 AI 隔艙的執行緒池，避免阻塞事件迴圈
+        gemini_response = await ai_bulkhead.run_prioritized(
+            priority,
+            call_gemini_vision,
             image_bytes=image_bytes, 
             user_timezone=user_timezone # 使用新的變數名稱 user_timezone
         )
@@ -112,6 +148,9 @@ async def upload_prescription(
     except HTTPException as e:
         # 如果是我們已知的 HTTP 錯誤，直接重新拋出
         raise e
+    except BulkheadFull:
+        # AI 隔艙已滿，交由全域處理器回傳 503 + Retry-After
+        raise
     except Exception as e:
         logger.error(f"處方箋辨識 API (upload) 發生未預期錯誤: {e}", exc_info=True)
         # 對於其他所有未預期的錯誤，回傳通用的 503 服務異常
@@ -0,0 +1,358 @@
+# app/api/records.py
+"""
+使用者紀錄的串流匯出與批次匯入。
+
+匯出：GET /api/records/{user_id}/export?kinds=medications,reminders,alerts&format=ndjson
+- 以 server-side cursor (yield_per) 逐批讀取、逐批輸出，記憶體用量與紀錄數量無關。
+- ndjson 每行一筆，帶 "type" 欄位；csv 一次只能匯出一種紀錄。
+
+匯入：POST /api/records/{user_id}/import?format=ndjson (或 format=csv&kind=medications)
+- 邊接收邊解析，每 batch_size 筆在一個交易內寫入；錯誤以行號回報，不影響其他行。
+- 紀錄一律匯入到路徑上的使用者名下。藥物若帶有原本的 id，同一次匯入中的提醒可用該 id 參照
+  (藥物必須出現在參照它的提醒之前，匯出的檔案即是此順序)；其他提醒只能參照該使用者既有的藥物。
+"""
+
+import codecs
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, insert
+
+from app.db.database import async_session_scope
+from app.models.alert import Alert
+from app.models.medication import Medication, MEDICATION_STATUSES
+from app.models.reminder import Reminder
+from app.api.medication import MedicationCreate
+from app.api.reminder import ReminderCreate
+from app.services.adherence import apply_reminder_batch, DoseSnapshot
+from app.services.cache import response_cache, mark_changed, NS_MEDICATIONS
+from app.services.speculative import speculative_analyzer
+from app.services.timezone import to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+KINDS = ("medications", "reminders", "alerts")
+FORMATS = ("ndjson", "csv")
+EXPORT_BATCH_SIZE = 500
+DEFAULT_IMPORT_BATCH_SIZE = 500
+MAX_IMPORT_BATCH_SIZE = 5000
+MAX_LINE_BYTES = 1024 * 1024
+MAX_REPORTED_ERRORS = 1000
+
+# JSON 欄位在 CSV 中以 JSON 字串存放
+_JSON_COLUMNS = {"remind_times", "result"}
+
+class AlertImport(BaseModel):
+    alert_time: Optional[datetime] = None
+    result: dict
+
+class ImportLineError(BaseModel):
+    line: int
+    error: str
+
+class ImportResult(BaseModel):
+    inserted: Dict[str, int]
+    error_count: int
+    errors: List[ImportLineError]
+
+# --- 匯出 ---
+
+def _export_query(kind: str, user_id: str):
+    if kind == "medications":
+        return select(*Medication.__table__.columns).where(Medication.user_id == user_id).order_by(Medication.id)
+    if kind == "reminders":
+        return (
+            select(*Reminder.__table__.columns)
+            .join(Medication, Medication.id == Reminder.medication_id)
+            .where(Medication.user_id == user_id)
+            .order_by(Reminder.id)
+        )
+    return select(*Alert.__table__.columns).where(Alert.user_id == user_id).order_by(Alert.id)
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def _csv_value(column: str, value):
+    if value is None:
+        return None
+    if column in _JSON_COLUMNS:
+        return json.dumps(value, ensure_ascii=False, default=_json_default)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+async def _stream_partitions(kind: str, user_id: str):
+    """逐批取出資料列 (只取欄位，不建立 ORM 物件)"""
+    async with async_session_scope(user_id) as db:
+        result = await db.stream(_export_query(kind, user_id).execution_options(yield_per=EXPORT_BATCH_SIZE))
+        async for partition in result.partitions():
+            yield [dict(row._mapping) for row in partition]
+
+async def _export_ndjson(kinds: List[str], user_id: str) -> AsyncIterator[bytes]:
+    for kind in kinds:
+        async for rows in _stream_partitions(kind, user_id):
+            yield "".join(
+                json.dumps({"type": kind, **row}, ensure_ascii=False, default=_json_default) + "\n"
+                for row in rows
+            ).encode("utf-8")
+
+async def _export_csv(kind: str, user_id: str) -> AsyncIterator[bytes]:
+    table = {"medications": Medication, "reminders": Reminder, "alerts": Alert}[kind].__table__
+    columns = [c.name for c in table.columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    async for rows in _stream_partitions(kind, user_id):
+        for row in rows:
+            writer.writerow([_csv_value(c, row[c]) for c in columns])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+@router.get("/{user_id}/export")
+async def export_records(user_id: str, kinds: str = ",".join(KINDS), format: str = "ndjson"):
+    """串流匯出使用者的藥物、提醒與分析紀錄"""
+    selected = [k.strip() for k in kinds.split(",") if k.strip()]
+    unknown = [k for k in selected if k not in KINDS]
+    if not selected or unknown:
+        raise HTTPException(status_code=400, detail=f"不支援的紀錄種類: {unknown or kinds}，可用: {', '.join(KINDS)}")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的格式: {format}，可用: {', '.join(FORMATS)}")
+
+    if format == "csv":
+        if len(selected) != 1:
+            raise HTTPException(status_code=400, detail="CSV 一次只能匯出一種紀錄 (kinds 只能有一個值)。")
+        body, media_type, suffix = _export_csv(selected[0], user_id), "text/csv; charset=utf-8", "csv"
+    else:
+        body, media_type, suffix = _export_ndjson(selected, user_id), "application/x-ndjson", "ndjson"
+    filename = f"{user_id}-{'-'.join(selected)}.{suffix}"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# --- 匯入 ---
+
+async def _iter_lines(request: Request) -> AsyncIterator[Tuple[int, str]]:
+    """逐行讀取上傳內容 (處理跨 chunk 的行與 UTF-8 字元)；回傳 (行號, 內容)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    line_no = 0
+    async for chunk in request.stream():
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            line_no += 1
+            yield line_no, line.rstrip("\r")
+        if len(pending) > MAX_LINE_BYTES:
+            raise HTTPException(status_code=413, detail=f"第 {line_no + 1} 行超過 {MAX_LINE_BYTES} bytes")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield line_no + 1, pending.rstrip("\r")
+
+async def _iter_ndjson(request: Request, default_kind: Optional[str]):
+    async for line_no, line in _iter_lines(request):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("每一行必須是 JSON 物件")
+        except ValueError as e:
+            yield line_no, None, None, f"JSON 格式錯誤: {e}"
+            continue
+        yield line_no, record.pop("type", None) or default_kind, record, None
+
+async def _iter_csv(request: Request, kind: str):
+    """一筆 CSV 紀錄可能跨越多行 (引號內的換行)，以引號數量判斷紀錄是否完整"""
+    header = None
+    parts: List[str] = []
+    start_line = 0
+    async for line_no, line in _iter_lines(request):
+        if not parts:
+            start_line = line_no
+        parts.append(line)
+        text = "\n".join(parts)
+        if text.count('"') % 2:
+            continue
+        parts = []
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = values
+            continue
+        if len(values) != len(header):
+            yield start_line, kind, None, f"欄位數量 {len(values)} 與標題列 {len(header)} 不符"
+            continue
+        record = {}
+        for column, value in zip(header, values):
+            if value == "":
+                continue
+            if column in _JSON_COLUMNS:
+                try:
+                    value = json.loads(value)
+                except ValueError as e:
+                    yield start_line, kind, None, f"{column} 不是有效的 JSON: {e}"
+                    break
+            record[column] = value
+        else:
+            yield start_line, kind, record, None
+    if parts:
+        yield start_line, kind, None, "檔案結尾的引號未閉合"
+
+class _Importer:
+    """累積驗證過的資料列，每 batch_size 筆在一個交易內寫入"""
+
+    def __init__(self, user_id: str, batch_size: int):
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.pending: Dict[str, List[Tuple[int, dict]]] = {kind: [] for kind in KINDS}
+        self.inserted = {kind: 0 for kind in KINDS}
+        self.errors: List[dict] = []
+        self.error_count = 0
+        self.id_map: Dict[int, int] = {}  # 檔案中的藥物 id -> 新的藥物 id
+        self.owned_ids: Optional[set] = None  # 使用者擁有的藥物 id
+
+    def error(self, line_no: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "error": message})
+
+    async def add(self, line_no: int, kind: Optional[str], record: dict):
+        if kind not in KINDS:
+            self.error(line_no, f"不支援的紀錄種類: {kind}")
+            return
+        try:
+            if kind == "medications":
+                source_id = record.get("id")
+                row = MedicationCreate(**{**record, "user_id": self.user_id}).dict()
+                if row["status"] not in MEDICATION_STATUSES:
+                    self.error(line_no, f"不支援的用藥狀態: {row['status']}")
+                    return
+                row["_source_id"] = int(source_id) if source_id is not None else None
+            elif kind == "reminders":
+                row = ReminderCreate(**record).dict()
+                # 資料庫與彙總一律使用 naive UTC；帶時區 (例如 +08:00) 的時間先換算，
+                # 否則同一批次中 naive 與 aware 的時間無法一起換算日期，整批寫入都會失敗
+                row["remind_time"] = to_naive_utc(row["remind_time"])
+            else:
+                row = AlertImport(**record).dict()
+                row["user_id"] = self.user_id
+        except (ValidationError, ValueError, TypeError, OverflowError) as e:
+            self.error(line_no, str(e))
+            return
+        self.pending[kind].append((line_no, row))
+        if sum(len(rows) for rows in self.pending.values()) >= self.batch_size:
+            await self.flush()
+
+    async def _load_owned_ids(self, db):
+        if self.owned_ids is None:
+            self.owned_ids = set((await db.scalars(
+                select(Medication.id).where(Medication.user_id == self.user_id)
+            )).all())
+
+    async def flush(self):
+        batch = self.pending
+        self.pending = {kind: [] for kind in KINDS}
+        if not any(batch.values()):
+            return
+        inserted = {kind: 0 for kind in KINDS}
+        new_ids: Dict[int, int] = {}
+        try:
+            async with async_session_scope(self.user_id) as db:
+                await self._load_owned_ids(db)
+                # 藥物先寫入，同一批的提醒才能參照新的 id
+                medications = batch["medications"]
+                if medications:
+                    rows = [{k: v for k, v in row.items() if k != "_source_id"} for _, row in medications]
+                    ids = (await db.scalars(
+                        insert(Medication).returning(Medication.id, sort_by_parameter_order=True), rows
+                    )).all()
+                    for (_, row), new_id in zip(medications, ids):
+                        if row["_source_id"] is not None:
+                            new_ids[row["_source_id"]] = new_id
+                    inserted["medications"] = len(ids)
+
+                reminders, rejected = [], []
+                for line_no, row in batch["reminders"]:
+                    medication_id = new_ids.get(row["medication_id"]) or self.id_map.get(row["medication_id"])
+                    if medication_id is None and row["medication_id"] in self.owned_ids:
+                        medication_id = row["medication_id"]
+                    if medication_id is None:
+                        rejected.append((line_no, f"找不到使用者的藥物 medication_id={row['medication_id']}"))
+                        continue
+                    reminders.append({**row, "medication_id": medication_id})
+                if reminders:
+                    await db.execute(insert(Reminder), reminders)
+                    snaps = [DoseSnapshot(r["medication_id"], r["remind_time"], bool(r["taken"])) for r in reminders]
+                    await db.run_sync(lambda session: apply_reminder_batch(session, self.user_id, snaps))
+                    inserted["reminders"] = len(reminders)
+
+                if batch["alerts"]:
+                    await db.execute(insert(Alert), [row for _, row in batch["alerts"]])
+                    inserted["alerts"] = len(batch["alerts"])
+
+                if inserted["medications"]:
+                    await mark_changed(db, NS_MEDICATIONS, [self.user_id])
+                await db.commit()
+        except Exception as e:
+            logger.error(f"匯入批次寫入失敗: {e}", exc_info=True)
+            for kind in KINDS:
+                for line_no, _ in batch[kind]:
+                    self.error(line_no, f"批次寫入失敗: {e}")
+            return
+
+        if inserted["medications"]:
+            response_cache.invalidate(NS_MEDICATIONS, [self.user_id])
+        self.id_map.update(new_ids)
+        self.owned_ids.update(new_ids.values())
+        for line_no, message in rejected:
+            self.error(line_no, message)
+        for kind, count in inserted.items():
+            self.inserted[kind] += count
+
+@router.post("/{user_id}/import", response_model=ImportResult)
+async def import_records(
+    user_id: str,
+    request: Request,
+    format: str = "ndjson",
+    kind: Optional[str] = None,
+    batch_size: int = DEFAULT_IMPORT_BATCH_SIZE,
+):
+    """串流匯入紀錄 (ndjson 或 csv)，回傳各種紀錄的新增筆數與逐行錯誤"""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"不支援的格式: {format}，可用: {', '.join(FORMATS)}")
+    if kind is not None and kind not in KINDS:
+        raise HTTPException(status_code=400, detail=f"不支援的紀錄種類: {kind}，可用: {', '.join(KINDS)}")
+    if format == "csv" and kind is None:
+        raise HTTPException(status_code=400, detail="CSV 匯入必須指定 kind。")
+    if not 1 <= batch_size <= MAX_IMPORT_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"batch_size 必須介於 1 到 {MAX_IMPORT_BATCH_SIZE}")
+
+    importer = _Importer(user_id, batch_size)
+    records = _iter_csv(request, kind) if format == "csv" else _iter_ndjson(request, kind)
+    async for line_no, record_kind, record, error in records:
+        if error is not None:
+            importer.error(line_no, error)
+        else:
+            await importer.add(line_no, record_kind, record)
+    await importer.flush()
+
+    if importer.inserted["medications"]:
+        speculative_analyzer.schedule([user_id])
+    logger.info(f"使用者 {user_id} 匯入完成: {importer.inserted}，錯誤 {importer.error_count} 行")
+    # 提醒的參照錯誤在批次寫入時才會發現，依行號重新排序
+    errors = sorted(importer.errors, key=lambda e: e["line"])
+    return {"inserted": importer.inserted, "error_count": importer.error_count, "errors": errors}
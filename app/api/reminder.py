@@ -1,39 +1,212 @@
+# app/api/reminder.py
+
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.db.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, and_, or_
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+import base64
+
+from app.db.database import get_async_db
+from app.models.medication import Medication
 from app.models.reminder import Reminder
+from app.services.adherence import apply_reminder_change, snapshot
+from app.services.timezone import get_local_day_bounds_utc, is_valid_timezone, DEFAULT_TIMEZONE
 
 router = APIRouter()
 
-@router.get("/")
-def list_reminders(medication_id: int, db: Session = Depends(get_db)):
-    reminders = db.query(Reminder).filter(Reminder.medication_id == medication_id).all()
-    return [r.__dict__ for r in reminders]
+REMINDER_STATUSES = ("all", "taken", "pending")
+MAX_PAGE_SIZE = 500
+
+# --- Pydantic 模型 ---
+class ReminderCreate(BaseModel):
+    medication_id: int
+    remind_time: datetime  # UTC
+    taken: bool = False
+
+class ReminderUpdate(BaseModel):
+    medication_id: Optional[int] = None
+    remind_time: Optional[datetime] = None
+    taken: Optional[bool] = None
+
+class ReminderResponse(BaseModel):
+    id: int
+    medication_id: Optional[int] = None
+    remind_time: Optional[datetime] = None
+    taken: bool = False
+
+    class Config:
+        orm_mode = True
+
+class UserReminder(ReminderResponse):
+    """使用者提醒清單的項目，帶上藥物資訊，前端不必再逐一查詢藥物"""
+    medication_name: Optional[str] = None
+    dose: Optional[str] = None
+    frequency: Optional[str] = None
+
+class UserReminderPage(BaseModel):
+    items: List[UserReminder]
+    next_cursor: Optional[str] = None
+
+class DeleteResult(BaseModel):
+    ok: bool
+
+# --- 分頁游標 (remind_time, id) ---
+def _encode_cursor(remind_time: datetime, reminder_id: int) -> str:
+    raw = f"{remind_time.isoformat()}|{reminder_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        remind_time, reminder_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(remind_time), int(reminder_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="無效的分頁游標 (cursor)")
 
-@router.post("/")
-def create_reminder(data: dict, db: Session = Depends(get_db)):
-    reminder = Reminder(**data)
+# 只取需要的欄位，回傳 row mapping，不建立 ORM 物件
+_USER_REMINDER_COLUMNS = (
+    Reminder.id,
+    Reminder.medication_id,
+    Reminder.remind_time,
+    Reminder.taken,
+    Medication.name.label("medication_name"),
+    Medication.dose,
+    Medication.frequency,
+)
+
+async def query_user_reminders(
+    db: AsyncSession,
+    user_id: str,
+    start: datetime,
+    end: datetime,
+    status: str = "all",
+    limit: int = 100,
+    cursor: Optional[str] = None,
+) -> dict:
+    """
+    查詢使用者在 [start, end) 之間的所有提醒 (UTC)，與 medications 合併成單一查詢。
+    依 (remind_time, id) 排序並以 keyset 游標分頁。
+    """
+    stmt = (
+        select(*_USER_REMINDER_COLUMNS)
+        .join(Medication, Medication.id == Reminder.medication_id)
+        .where(
+            Medication.user_id == user_id,
+            Reminder.remind_time >= start,
+            Reminder.remind_time < end,
+        )
+        .order_by(Reminder.remind_time, Reminder.id)
+        .limit(limit + 1)
+    )
+    if status == "taken":
+        stmt = stmt.where(Reminder.taken.is_(True))
+    elif status == "pending":
+        stmt = stmt.where(or_(Reminder.taken.is_(False), Reminder.taken.is_(None)))
+    if cursor:
+        after_time, after_id = _decode_cursor(cursor)
+        stmt = stmt.where(
+            or_(
+                Reminder.remind_time > after_time,
+                and_(Reminder.remind_time == after_time, Reminder.id > after_id),
+            )
+        )
+
+    rows = (await db.execute(stmt)).mappings().all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1]["remind_time"], rows[-1]["id"])
+    return {"items": [dict(row) for row in rows], "next_cursor": next_cursor}
+
+def _validate_page(status: str, limit: int):
+    if status not in REMINDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status 必須是 {', '.join(REMINDER_STATUSES)} 其中之一")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit 必須介於 1 到 {MAX_PAGE_SIZE}")
+
+# --- API 端點 ---
+
+@router.get("/", response_model=List[ReminderResponse])
+async def list_reminders(medication_id: int, db: AsyncSession = Depends(get_async_db)):
+    reminders = (await db.scalars(
+        select(Reminder).where(Reminder.medication_id == medication_id).order_by(Reminder.remind_time)
+    )).all()
+    return reminders
+
+@router.get("/user/{user_id}", response_model=UserReminderPage)
+async def list_user_reminders(
+    user_id: str,
+    start: datetime,
+    end: datetime,
+    status: str = "all",
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """查詢使用者在 [start, end) (UTC) 之間的所有提醒，可依已服/未服篩選並分頁"""
+    _validate_page(status, limit)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必須早於 end")
+    return await query_user_reminders(db, user_id, start, end, status=status, limit=limit, cursor=cursor)
+
+@router.get("/user/{user_id}/today", response_model=UserReminderPage)
+async def list_today_reminders(
+    user_id: str,
+    timezone: str = DEFAULT_TIMEZONE,
+    status: str = "all",
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """今日提醒：以使用者時區的今天換算 UTC 區間後查詢"""
+    _validate_page(status, limit)
+    if not is_valid_timezone(timezone):
+        raise HTTPException(status_code=400, detail=f"不支援的時區: {timezone}")
+    start, end = get_local_day_bounds_utc(timezone)
+    return await query_user_reminders(db, user_id, start, end, status=status, limit=limit, cursor=cursor)
+
+@router.post("/", response_model=ReminderResponse)
+async def create_reminder(data: ReminderCreate, db: AsyncSession = Depends(get_async_db)):
+    reminder = Reminder(**data.dict())
     db.add(reminder)
-    db.commit()
-    db.refresh(reminder)
-    return reminder.__dict__
+    after = snapshot(reminder)
+    # 彙總更新沿用同步版本的服務函式，與提醒寫入在同一個交易內
+    await db.run_sync(lambda session: apply_reminder_change(session, None, after))
+    await db.commit()
+    await db.refresh(reminder)
+    return reminder
 
-@router.put("/{reminder_id}")
-def update_reminder(reminder_id: int, data: dict, db: Session = Depends(get_db)):
-    reminder = db.query(Reminder).filter(Reminder.id == reminder_id).first()
+async def _get_owned(db: AsyncSession, reminder_id: int, user_id: Optional[str]) -> Reminder:
+    """user_id (查詢參數) 有指定時必須是提醒所屬藥物的擁有者"""
+    reminder = await db.get(Reminder, reminder_id)
+    if reminder and user_id is not None:
+        owner = await db.scalar(select(Medication.user_id).where(Medication.id == reminder.medication_id))
+        if owner != user_id:
+            reminder = None
     if not reminder:
         raise HTTPException(status_code=404, detail="Reminder not found")
-    for k, v in data.items():
+    return reminder
+
+@router.put("/{reminder_id}", response_model=ReminderResponse)
+async def update_reminder(reminder_id: int, data: ReminderUpdate, user_id: Optional[str] = None,
+                          db: AsyncSession = Depends(get_async_db)):
+    reminder = await _get_owned(db, reminder_id, user_id)
+    before = snapshot(reminder)
+    for k, v in data.dict(exclude_unset=True).items():
         setattr(reminder, k, v)
-    db.commit()
-    db.refresh(reminder)
-    return reminder.__dict__
+    after = snapshot(reminder)
+    await db.run_sync(lambda session: apply_reminder_change(session, before, after))
+    await db.commit()
+    await db.refresh(reminder)
+    return reminder
 
-@router.delete("/{reminder_id}")
-def delete_reminder(reminder_id: int, db: Session = Depends(get_db)):
-    reminder = db.query(Reminder).filter(Reminder.id == reminder_id).first()
-    if not reminder:
-        raise HTTPException(status_code=404, detail="Reminder not found")
-    db.delete(reminder)
-    db.commit()
+@router.delete("/{reminder_id}", response_model=DeleteResult)
+async def delete_reminder(reminder_id: int, user_id: Optional[str] = None, db: AsyncSession = Depends(get_async_db)):
+    reminder = await _get_owned(db, reminder_id, user_id)
+    before = snapshot(reminder)
+    await db.run_sync(lambda session: apply_reminder_change(session, before, None))
+    await db.delete(reminder)
+    await db.commit()
     return {"ok": True}
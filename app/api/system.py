@@ -0,0 +1,89 @@
+# app/api/system.py
+
+import os
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import fan_out_async, shards
+from app.models.alert import Alert
+from app.models.medication import Medication
+from app.models.user import User
+from app.services.bulkhead import all_bulkheads
+from app.services.cache import response_cache
+from app.services.scheduler import scheduler_status
+from app.services.speculative import speculative_analyzer
+from app.services.interaction_analysis import inflight_count
+from app.services.profiling import authorized, profile_store
+
+router = APIRouter()
+
+# 各元件的統計欄位由元件自行定義 (見各自的 stats())，這裡只宣告外層結構
+Stats = Dict[str, Any]
+
+class BulkheadStats(BaseModel):
+    bulkheads: List[Stats]
+
+@router.get("/bulkheads", response_model=BulkheadStats)
+def get_bulkhead_stats():
+    """各資源池 (AI / DB) 目前的使用量、等待數與拒絕次數"""
+    return {"bulkheads": [b.stats() for b in all_bulkheads()]}
+
+@router.get("/cache", response_model=Stats)
+def get_cache_stats():
+    """個人資料 / 用藥清單讀取快取的命中率與大小"""
+    return response_cache.stats()
+
+
+@router.get("/scheduler", response_model=Stats)
+def get_scheduler_status():
+    """本 worker 是否為排程領導者，以及共用 job store 中的排程"""
+    return scheduler_status()
+
+@router.get("/speculative", response_model=Stats)
+def get_speculative_stats():
+    """新增藥物後預先進行的交互作用分析：排程、完成、取消、略過的次數"""
+    return {**speculative_analyzer.stats(), "inflight_analyses": inflight_count()}
+
+async def _shard_stats(db: AsyncSession) -> Stats:
+    shard = shards[db.info.get("shard", 0)]
+    counts = {
+        name: await db.scalar(select(func.count()).select_from(model))
+        for name, model in (("users", User), ("medications", Medication), ("alerts", Alert))
+    }
+    size = os.path.getsize(shard.path) if os.path.exists(shard.path) else 0
+    return {"shard": shard.index, "path": shard.path, "file_bytes": size, **counts}
+
+@router.get("/shards", response_model=List[Stats])
+async def get_shard_stats():
+    """各資料分片的資料筆數與檔案大小 (並行查詢所有分片)，用來觀察分片是否平均"""
+    return await fan_out_async(_shard_stats)
+
+def require_profile_token(x_profile_token: Optional[str] = Header(None)):
+    if not authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="需要有效的 X-Profile-Token")
+
+@router.get("/profiles", response_model=List[Stats], dependencies=[Depends(require_profile_token)])
+def list_profiles(limit: int = 50):
+    """最近的請求剖析摘要 (各類別的時間分配)，最新的在前"""
+    return profile_store.list(limit)
+
+@router.get("/profiles/{profile_id}", response_model=Stats, dependencies=[Depends(require_profile_token)])
+def get_profile(profile_id: str):
+    summary = profile_store.get(profile_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="找不到剖析結果")
+    return summary
+
+@router.get("/profiles/{profile_id}/flamegraph", response_class=FileResponse,
+            dependencies=[Depends(require_profile_token)])
+def get_profile_flamegraph(profile_id: str):
+    """collapsed stack 格式，可交給 flamegraph.pl / speedscope / inferno 產生火焰圖"""
+    path = profile_store.folded_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="找不到剖析結果")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=f"{profile_id}.folded")
@@ -1,8 +1,12 @@
 from fastapi import APIRouter
+from pydantic import BaseModel
 
 router = APIRouter()
 
-@router.get("/")
+class TermsResponse(BaseModel):
+    terms: str
+
+@router.get("/", response_model=TermsResponse)
 def get_terms():
     # 建議將條款內容移到檔案或資料庫，這裡直接寫死
     terms = """
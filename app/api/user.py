@@ -1,32 +1,44 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from app.db.database import get_db
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from app.db.database import get_async_db
 from app.models.user import User
+from pydantic import BaseModel
+from typing import Optional
 
 router = APIRouter()
 
-@router.get("/")
-def get_user(line_user_id: str, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.line_user_id == line_user_id).first()
+class UserResponse(BaseModel):
+    id: int
+    line_user_id: Optional[str] = None
+    name: Optional[str] = None
+    timezone: Optional[str] = None
+
+    class Config:
+        orm_mode = True
+
+@router.get("/", response_model=UserResponse)
+async def get_user(line_user_id: str, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.line_user_id == line_user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user.__dict__
+    return user
 
-@router.post("/")
-def create_user(data: dict, db: Session = Depends(get_db)):
+@router.post("/", response_model=UserResponse)
+async def create_user(data: dict, db: AsyncSession = Depends(get_async_db)):
     user = User(**data)
     db.add(user)
-    db.commit()
-    db.refresh(user)
-    return user.__dict__
+    await db.commit()
+    await db.refresh(user)
+    return user
 
-@router.put("/")
-def update_user(line_user_id: str, data: dict, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.line_user_id == line_user_id).first()
+@router.put("/", response_model=UserResponse)
+async def update_user(line_user_id: str, data: dict, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(User).where(User.line_user_id == line_user_id))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     for k, v in data.items():
         setattr(user, k, v)
-    db.commit()
-    db.refresh(user)
-    return user.__dict__
+    await db.commit()
+    await db.refresh(user)
+    return user
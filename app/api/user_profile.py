@@ -1,22 +1,24 @@
 # app/api/user_profile.py
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, Boolean
 from pydantic import BaseModel
 from typing import Optional
 import logging
 
-from app.db.database import get_db
+from app.db.database import get_async_db
 from app.models.user_profile import UserProfile
+from app.services.cache import response_cache, mark_changed, dumps, to_model, NS_PROFILE
+from app.services.speculative import speculative_analyzer
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 # --- Pydantic 模型 ---
 class UserProfileResponse(BaseModel):
-    id: int
+    id: Optional[int] = None  # 尚未儲存過的預設個人資料為 None
     user_id: str
     
     # 飲食習慣
@@ -59,6 +61,9 @@ class UserProfileResponse(BaseModel):
     class Config:
         orm_mode = True
 
+class MessageResponse(BaseModel):
+    message: str
+
 class UserProfileUpdate(BaseModel):
     # 飲食習慣
     diet_alcohol: Optional[bool] = None
@@ -97,31 +102,36 @@ class UserProfileUpdate(BaseModel):
     condition_elderly: Optional[bool] = None
     condition_obesity: Optional[bool] = None
 
+def _default_profile(user_id: str) -> UserProfileResponse:
+    """尚未建立個人資料時回傳的預設值 (所有選項皆為 False)，在第一次更新前不寫入資料庫"""
+    defaults = {col.name: False for col in UserProfile.__table__.columns if isinstance(col.type, Boolean)}
+    return UserProfileResponse(id=None, user_id=user_id, **defaults)
+
 # --- API 端點 ---
 
 @router.get("/{user_id}", response_model=UserProfileResponse)
-def get_user_profile(user_id: str, db: Session = Depends(get_db)):
-    """取得使用者個人資料"""
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
-    
-    if not profile:
-        # 如果沒有資料，建立預設的個人資料
-        profile = UserProfile(user_id=user_id)
-        db.add(profile)
-        db.commit()
-        db.refresh(profile)
-        logger.info(f"為使用者 {user_id} 建立新的個人資料")
-    
-    return profile
+async def get_user_profile(user_id: str, db: AsyncSession = Depends(get_async_db)):
+    """取得使用者個人資料 (優先讀取快取)"""
+    await response_cache.sync(db)
+    payload = response_cache.get(NS_PROFILE, user_id)
+    if payload is None:
+        generation = response_cache.generation()
+        profile = await db.scalar(select(UserProfile).where(UserProfile.user_id == user_id))
+        # 如果沒有資料，回傳預設的個人資料 (不寫入資料庫)
+        data = to_model(UserProfileResponse, profile) if profile else _default_profile(user_id)
+        payload = dumps(data)
+        response_cache.set(NS_PROFILE, user_id, payload, generation=generation)
+    
+    return Response(content=payload, media_type="application/json")
 
 @router.put("/{user_id}", response_model=UserProfileResponse)
-def update_user_profile(
+async def update_user_profile(
     user_id: str, 
     profile_data: UserProfileUpdate, 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新使用者個人資料"""
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+    profile = await db.scalar(select(UserProfile).where(UserProfile.user_id == user_id))
     
     if not profile:
         # 如果沒有資料，建立新的個人資料
@@ -133,22 +143,28 @@ def update_user_profile(
     for key, value in update_dict.items():
         setattr(profile, key, value)
     
-    db.commit()
-    db.refresh(profile)
+    await mark_changed(db, NS_PROFILE, [user_id])
+    await db.commit()
+    response_cache.invalidate(NS_PROFILE, [user_id])
+    # 個人資料也是交互作用分析的輸入，變更後預先重新分析
+    speculative_analyzer.schedule([user_id])
+    await db.refresh(profile)
     
     logger.info(f"成功更新使用者 {user_id} 的個人資料")
     return profile
 
-@router.delete("/{user_id}")
-def delete_user_profile(user_id: str, db: Session = Depends(get_db)):
+@router.delete("/{user_id}", response_model=MessageResponse)
+async def delete_user_profile(user_id: str, db: AsyncSession = Depends(get_async_db)):
     """刪除使用者個人資料"""
-    profile = db.query(UserProfile).filter(UserProfile.user_id == user_id).first()
+    profile = await db.scalar(select(UserProfile).where(UserProfile.user_id == user_id))
     
     if not profile:
         raise HTTPException(status_code=404, detail="使用者個人資料不存在")
     
-    db.delete(profile)
-    db.commit()
+    await db.delete(profile)
+    await mark_changed(db, NS_PROFILE, [user_id])
+    await db.commit()
+    response_cache.invalidate(NS_PROFILE, [user_id])
     
     logger.info(f"成功刪除使用者 {user_id} 的個人資料")
     return {"message": "個人資料已刪除"}
\ No newline at end of file
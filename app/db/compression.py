@@ -0,0 +1,129 @@
+# app/db/compression.py
+"""
+JSON 欄位中長文字的透明壓縮 (目前用於 Alert.result 的 analysis 報告)。
+
+- 寫入時 analysis 超過 min_size bytes 就壓縮，以 {"analysis_z": {"codec", "data"(base64)}} 存放；
+  讀取時還原成原本的 {"analysis": "..."}，使用端不需要知道資料是否壓縮過。
+- 預設 zlib，可改用 zstd (需安裝 zstandard)；兩者都使用內建的共用字典 (報告固定的標題與常見用語)，
+  短報告也能壓得小。字典內容一旦使用就不能修改，要調整請新增新的 codec 名稱。
+- 尚未壓縮的舊資料照常讀取，可由 alert_retention 的壓縮整理工作分批改寫。
+
+config.ini 範例：
+    [ALERTS]
+    codec = zlib
+    min_size = 256
+"""
+
+import base64
+import logging
+import importlib.util
+import zlib
+from functools import lru_cache
+
+from sqlalchemy.types import TypeDecorator, JSON
+
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+COMPRESSED_KEY_SUFFIX = "_z"
+
+# 共用字典 v1：藥物交互作用分析報告固定的段落標題與常見用語 (不可修改)
+_DICTIONARY_V1 = "\n".join([
+    "### 🔍 分析結果", "### ⚠️ 發現的交互作用", "### 💊 用藥建議", "### 📋 注意事項", "### 🏥 就醫建議",
+    "交互作用", "藥物", "服用", "建議", "注意", "醫師", "藥師", "諮詢", "副作用", "風險", "劑量",
+    "同時服用", "間隔", "小時", "避免", "監測", "血壓", "血糖", "肝功能", "腎功能", "出血",
+    "葡萄柚", "酒精", "咖啡因", "牛奶", "維他命K", "保健食品", "懷孕", "哺乳", "老年人",
+    "* **", "**：", "- ", "。\n", "，",
+]).encode("utf-8")
+
+def _zlib_compress(data: bytes) -> bytes:
+    compressor = zlib.compressobj(level=6, zdict=_DICTIONARY_V1)
+    return compressor.compress(data) + compressor.flush()
+
+def _zlib_decompress(data: bytes) -> bytes:
+    decompressor = zlib.decompressobj(zdict=_DICTIONARY_V1)
+    return decompressor.decompress(data) + decompressor.flush()
+
+def _zstd_available() -> bool:
+    return importlib.util.find_spec("zstandard") is not None
+
+@lru_cache(maxsize=1)
+def _zstandard():
+    """zstandard 為選用套件，第一次遇到 zstd 資料時才載入"""
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("資料以 zstd 壓縮，但未安裝 zstandard 套件")
+    return zstandard
+
+def _zstd_dict():
+    zstandard = _zstandard()
+    return zstandard.ZstdCompressionDict(_DICTIONARY_V1, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+def _zstd_compress(data: bytes) -> bytes:
+    return _zstandard().ZstdCompressor(level=9, dict_data=_zstd_dict()).compress(data)
+
+def _zstd_decompress(data: bytes) -> bytes:
+    return _zstandard().ZstdDecompressor(dict_data=_zstd_dict()).decompress(data)
+
+# codec 名稱 -> (壓縮, 解壓縮)
+CODECS = {
+    "zlib-d1": (_zlib_compress, _zlib_decompress),
+    "zstd-d1": (_zstd_compress, _zstd_decompress),
+}
+
+def _configured_codec() -> str:
+    name = get_settings().alerts.codec
+    if name == "zstd":
+        if _zstd_available():
+            return "zstd-d1"
+        logger.warning("設定使用 zstd 壓縮，但未安裝 zstandard 套件，改用 zlib")
+    return "zlib-d1"
+
+DEFAULT_CODEC = _configured_codec()
+MIN_SIZE = get_settings().alerts.min_size
+
+def compress_text(text: str, codec: str = DEFAULT_CODEC) -> dict:
+    compress, _ = CODECS[codec]
+    return {"codec": codec, "data": base64.b64encode(compress(text.encode("utf-8"))).decode("ascii")}
+
+def decompress_text(value: dict) -> str:
+    _, decompress = CODECS[value["codec"]]
+    return decompress(base64.b64decode(value["data"])).decode("utf-8")
+
+def is_compressed(value) -> bool:
+    return isinstance(value, dict) and any(key.endswith(COMPRESSED_KEY_SUFFIX) for key in value)
+
+class CompressedJSON(TypeDecorator):
+    """
+    JSON 欄位，其中 compress_keys 列出的文字欄位在寫入時壓縮、讀取時解壓縮。
+    資料庫中仍是一般的 JSON，其他欄位 (例如 medication_count) 仍可用 json_extract 查詢。
+    """
+    impl = JSON
+    cache_ok = True
+
+    def __init__(self, compress_keys=("analysis",), min_size: int = None, **kwargs):
+        super().__init__(**kwargs)
+        self.compress_keys = tuple(compress_keys)
+        self.min_size = MIN_SIZE if min_size is None else min_size
+
+    def process_bind_param(self, value, dialect):
+        if not isinstance(value, dict):
+            return value
+        stored = dict(value)
+        for key in self.compress_keys:
+            text = stored.get(key)
+            if isinstance(text, str) and len(text.encode("utf-8")) >= self.min_size:
+                stored[key + COMPRESSED_KEY_SUFFIX] = compress_text(text)
+                del stored[key]
+        return stored
+
+    def process_result_value(self, value, dialect):
+        if not isinstance(value, dict):
+            return value
+        for key in self.compress_keys:
+            packed = value.pop(key + COMPRESSED_KEY_SUFFIX, None)
+            if packed is not None:
+                value[key] = decompress_text(packed)
+        return value
@@ -1,30 +1,396 @@
 # 在 app/db/database.py 的 init_db() 函式中確保匯入所有模型
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from configparser import ConfigParser
-
-config = ConfigParser()
-config.read('./app/config/config.ini')
-SQLALCHEMY_DATABASE_URL = f"sqlite:///{config.get('DATABASE', 'sqlite_path')}"
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from fastapi import Request
+from sqlalchemy import Integer, create_engine, event, inspect, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.schema import CreateTable
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from contextlib import asynccontextmanager
+
+from app.db.query_stats import instrument
+from app.db.sharding import (
+    ShardLayoutError, ShardRoutingError, id_base, routing_keys, shard_for, shard_of_id, shard_path,
+)
+from app.services.bulkhead import db_bulkhead
+from app.services.metrics import registry
+
+from app.utils.config import get_settings
+
+T = TypeVar("T")
+
+SQLITE_PATH = get_settings().database.sqlite_path
+SHARD_COUNT = get_settings().database.shards
+
 Base = declarative_base()
 
-def init_db():
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    同步與非同步引擎會同時存取同一個檔案：使用 WAL 讓讀寫互不阻塞，並在鎖定時等待而非立即失敗。
+    auto_vacuum 只對尚未建立資料表的新檔案生效，舊檔案需執行一次
+    python -m app.services.alert_retention --enable-incremental-vacuum
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+class Shard:
+    """
+    一個 SQLite 檔案的同步引擎 (init_db、排程工作與 CLI 腳本使用)
+    與非同步引擎 (aiosqlite，FastAPI 路由使用，等待資料庫時不佔用執行緒池)。
+    session.info["shard"] 為分片編號。
+    """
+
+    def __init__(self, index: int, path: str):
+        self.index = index
+        self.path = path
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine, info={"shard": index})
+        self.async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        self.AsyncSessionLocal = async_sessionmaker(
+            self.async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False, info={"shard": index}
+        )
+        event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        event.listen(self.async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        instrument(self.engine)
+        instrument(self.async_engine.sync_engine)
+
+# 分片 0 即原本的 med.db；shards = 1 (預設) 時只有這一個，行為與不分片相同 (見 app/db/sharding.py)
+shards: List[Shard] = [Shard(i, shard_path(i)) for i in range(SHARD_COUNT)]
+engine = shards[0].engine
+SessionLocal = shards[0].SessionLocal
+async_engine = shards[0].async_engine
+AsyncSessionLocal = shards[0].AsyncSessionLocal
+
+# 依賴注入開啟的 session (sync: get_db，async: get_async_db / async_session_scope)
+db_sessions_total = registry.counter("medimgmt_db_sessions_total", "已開啟的資料庫 session 數", ["kind"])
+db_sessions_active = registry.gauge("medimgmt_db_sessions_active", "目前開啟中的資料庫 session 數", ["kind"])
+shard_routes = registry.counter(
+    "medimgmt_db_shard_routes_total", "依請求選擇分片的次數 (via = user / entity)", ["shard", "via"]
+)
+
+def _pool_checked_out():
+    return {
+        (kind,): sum(getattr(e.pool, "checkedout", lambda: 0)() for e in group)
+        for kind, group in (
+            ("sync", [s.engine for s in shards]),
+            ("async", [s.async_engine.sync_engine for s in shards]),
+        )
+    }
+
+registry.gauge("medimgmt_db_pool_checked_out", "連線池中借出中的連線數", ["kind"], callback=_pool_checked_out)
+
+def _import_models():
     # 匯入所有模型以確保它們被註冊到 Base.metadata
     from app.models.medication import Medication
     from app.models.user import User
     from app.models.alert import Alert
     from app.models.reminder import Reminder
     from app.models.user_profile import UserProfile  # 新增
-    
+    from app.models.medication_status_log import MedicationStatusLog
+    from app.models.adherence import AdherenceDaily
+    from app.models.rate_limit import RateLimitEvent
+    from app.models.cache_version import CacheVersion
+    from app.models.scheduler_lease import SchedulerLease
+    from app.models.shard_layout import ShardLayout
+
+def _autoincrement_tables() -> list:
+    """以單一整數為主鍵的資料表"""
+    return [
+        table for table in Base.metadata.sorted_tables
+        if len(table.primary_key.columns) == 1 and isinstance(list(table.primary_key.columns)[0].type, Integer)
+    ]
+
+def init_shard_schema(shard: Shard):
+    """
+    建立 / 補齊單一分片的資料表。
+    新建立的資料表使用 AUTOINCREMENT (已有的資料表由 ensure_autoincrement() 重建)：id 不重複使用，
+    分片 k 的 id 由 sqlite_sequence 的 k * ID_STRIDE 起算。
+    """
+    _import_models()
+    for table in _autoincrement_tables():
+        table.dialect_kwargs["sqlite_autoincrement"] = True
     # 建立所有資料表
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=shard.engine)
+    _migrate_schema(shard.engine)
+    if shard.index:
+        with shard.engine.begin() as conn:
+            for table in _autoincrement_tables():
+                conn.execute(
+                    text("INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                         "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"),
+                    {"name": table.name, "seq": id_base(shard.index)},
+                )
+
+def _has_autoincrement(conn, table: str) -> bool:
+    sql = conn.scalar(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table})
+    return sql is not None and "AUTOINCREMENT" in sql.upper()
+
+def ensure_autoincrement(shard: Shard) -> List[str]:
+    """
+    重新分片前呼叫：舊的 med.db 的資料表沒有 AUTOINCREMENT，SQLite 以目前最大 id + 1 編號，
+    搬走的資料列的 id 會再配給其他使用者 (與搬到其他分片的資料 id 重複)。
+    這裡以 AUTOINCREMENT 重建這些資料表 (保留原本的 id 與索引)，並將 sqlite_sequence 設為
+    max(目前最大 id, 分片的 id 起點)，之後的 id 不再重複使用。回傳重建的資料表。
+    """
+    init_shard_schema(shard)
+    rebuilt = []
+    with shard.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            for table in _autoincrement_tables():
+                if not _has_autoincrement(conn, table.name):
+                    staging = f"{table.name}__autoincrement"
+                    ddl = str(CreateTable(table).compile(dialect=shard.engine.dialect)).strip()
+                    conn.exec_driver_sql(f"DROP TABLE IF EXISTS {staging}")
+                    conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {staging} ", 1))
+                    columns = ", ".join(column.name for column in table.columns)
+                    conn.exec_driver_sql(f"INSERT INTO {staging} ({columns}) SELECT {columns} FROM {table.name}")
+                    # 舊資料表的索引隨 DROP TABLE 一起刪除，改名後重新建立
+                    conn.exec_driver_sql(f"DROP TABLE {table.name}")
+                    conn.exec_driver_sql(f"ALTER TABLE {staging} RENAME TO {table.name}")
+                    for index in table.indexes:
+                        index.create(bind=conn)
+                    rebuilt.append(table.name)
+                key = list(table.primary_key.columns)[0].name
+                seq = max(conn.scalar(text(f"SELECT COALESCE(MAX({key}), 0) FROM {table.name}")), id_base(shard.index))
+                conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name AND seq < :seq"),
+                             {"name": table.name, "seq": seq})
+                conn.execute(
+                    text("INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq "
+                         "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)"),
+                    {"name": table.name, "seq": seq},
+                )
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+    return rebuilt
+
+def init_db():
+    for shard in shards:
+        if SHARD_COUNT > 1:
+            # 重新分片前就存在的資料表也要改為 AUTOINCREMENT，否則分片 0 會重複使用搬走的 id
+            ensure_autoincrement(shard)
+        else:
+            init_shard_schema(shard)
+    _check_layout()
+
+def _migrate_schema(engine):
+    """
+    create_all 不會修改既有資料表，這裡為舊的 med.db 補上之後新增的欄位與索引。
+    新增欄位必須可為 NULL 或帶有常數的 server_default。
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                conn.execute(text(ddl))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+def has_user_data(engine) -> bool:
+    with engine.connect() as conn:
+        return any(conn.scalar(text(f"SELECT 1 FROM {table} LIMIT 1")) for table in ("users", "medications"))
+
+def _check_layout():
+    """設定的分片數必須與資料庫記錄的一致；第一次啟動時記錄下來"""
+    from app.models.shard_layout import ShardLayout
+
+    with SessionLocal() as db:
+        layout = db.get(ShardLayout, 1)
+        if layout is None:
+            # 尚未記錄的資料庫視為不分片；已有資料就必須先搬移才能以多個分片啟動
+            if SHARD_COUNT > 1 and has_user_data(engine):
+                raise ShardLayoutError(
+                    f"{SQLITE_PATH} 已有未分片的資料，請先執行 python -m app.services.reshard --to {SHARD_COUNT}"
+                )
+            db.execute(sqlite_insert(ShardLayout).values(id=1, shards=SHARD_COUNT, updated_at=time.time())
+                       .on_conflict_do_nothing(index_elements=["id"]))
+            db.commit()
+            layout = db.get(ShardLayout, 1)
+        if layout.target_shards:
+            raise ShardLayoutError(
+                f"重新分片 ({layout.shards} -> {layout.target_shards}) 尚未完成，"
+                f"請再次執行 python -m app.services.reshard --to {layout.target_shards}"
+            )
+        if layout.shards != SHARD_COUNT:
+            raise ShardLayoutError(
+                f"資料庫目前為 {layout.shards} 個分片，設定為 {SHARD_COUNT} 個；"
+                f"增加分片請執行 python -m app.services.reshard --to {SHARD_COUNT}"
+            )
+
+# --- 分片選擇 ---
 
-def get_db():
-    db = SessionLocal()
+def shard_index(user_id: Optional[str] = None, shard: Optional[int] = None) -> int:
+    """指定 shard 時直接使用；否則為 user_id 所在的分片，兩者皆無時為分片 0"""
+    if shard is not None:
+        return shard
+    if user_id is None:
+        return 0
+    return shard_for(user_id, SHARD_COUNT)
+
+def _route_users(user_ids) -> Optional[int]:
+    targets = {shard_for(user_id, SHARD_COUNT) for user_id in user_ids}
+    if len(targets) > 1:
+        raise ShardRoutingError("同一個請求中的使用者分屬不同的資料分片，請分開送出")
+    if targets:
+        index = targets.pop()
+        shard_routes.inc(str(index), "user")
+        return index
+    return None
+
+# 以 id 查資料列的擁有者 (資料表 -> SQL)
+_OWNER_SQL = {
+    "medications": "SELECT user_id FROM medications WHERE id = :id",
+    "reminders": ("SELECT m.user_id FROM reminders r LEFT JOIN medications m ON m.id = r.medication_id "
+                  "WHERE r.id = :id"),
+}
+
+def _owned_here(row, index: int) -> bool:
+    """資料列存在，且擁有者依目前的分片數屬於這個分片 (中斷的重新分片可能留下尚未刪除的舊副本)"""
+    return row is not None and (row[0] is None or shard_for(row[0], SHARD_COUNT) == index)
+
+def _pick(table: str, entity_id: int, matches: List[int]) -> Optional[int]:
+    if len(matches) > 1:
+        # 舊版重新分片會重複使用 id：不猜測，請用戶端指定擁有者
+        raise ShardRoutingError(f"{table} id {entity_id} 同時存在於分片 {matches}，請加上 user_id 查詢參數指定擁有者")
+    return matches[0] if matches else None
+
+def locate_sync(table: str, entity_id: int) -> Optional[int]:
+    """資料列所在的分片 (找不到時為 None；查詢所有分片，id 在多個分片都有時拋出 ShardRoutingError)"""
+    matches = []
+    for shard in shards:
+        with shard.engine.connect() as conn:
+            if _owned_here(conn.execute(text(_OWNER_SQL[table]), {"id": entity_id}).first(), shard.index):
+                matches.append(shard.index)
+    return _pick(table, entity_id, matches)
+
+async def locate(table: str, entity_id: int) -> Optional[int]:
+    async def owned(db: AsyncSession) -> bool:
+        row = (await db.execute(text(_OWNER_SQL[table]), {"id": entity_id})).first()
+        return _owned_here(row, db.info["shard"])
+
+    found = await fan_out_async(owned)
+    return _pick(table, entity_id, [index for index, hit in enumerate(found) if hit])
+
+def _route_entity(entity, index: Optional[int]) -> int:
+    _, entity_id = entity
+    # 找不到時仍交給 id 區段的分片，由路由回應 404
+    index = shard_of_id(entity_id, SHARD_COUNT) if index is None else index
+    shard_routes.inc(str(index), "entity")
+    return index
+
+def _no_route():
+    return ShardRoutingError("無法判斷資料所在的分片：請求必須帶有 user_id 或資料 id")
+
+async def request_shard(request: Request) -> int:
+    """依請求的 user_id (路徑 / 查詢參數 / JSON 內文) 或資料 id 選擇分片"""
+    if SHARD_COUNT == 1:
+        return 0
+    body = None
+    if "json" in request.headers.get("content-type", ""):
+        # FastAPI 已讀取並快取請求內文，這裡不會再讀一次
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+    user_ids, entity = routing_keys(request.path_params, request.query_params, body)
+    index = _route_users(user_ids)
+    if index is not None:
+        return index
+    if entity is not None:
+        return _route_entity(entity, await locate(*entity))
+    raise _no_route()
+
+def request_shard_sync(request: Request) -> int:
+    """同步路由使用的版本 (不讀取請求內文)"""
+    if SHARD_COUNT == 1:
+        return 0
+    user_ids, entity = routing_keys(request.path_params, request.query_params)
+    index = _route_users(user_ids)
+    if index is not None:
+        return index
+    if entity is not None:
+        return _route_entity(entity, locate_sync(*entity))
+    raise _no_route()
+
+def same_shard(*user_ids: str) -> bool:
+    """這些使用者的資料是否在同一個分片 (跨分片的修改無法在一個交易內完成)"""
+    return len({shard_for(u, SHARD_COUNT) for u in user_ids if u is not None}) <= 1
+
+# --- Session ---
+
+def get_db(request: Request):
+    db = shards[request_shard_sync(request)].SessionLocal()
+    db_sessions_total.inc("sync")
+    db_sessions_active.inc("sync")
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+        db_sessions_active.dec("sync")
+
+def session_for(user_id: Optional[str] = None, shard: Optional[int] = None) -> Session:
+    """排程工作與 CLI 使用的同步 session (呼叫端負責 close)"""
+    return shards[shard_index(user_id, shard)].SessionLocal()
+
+@asynccontextmanager
+async def async_session_scope(user_id: Optional[str] = None, shard: Optional[int] = None):
+    """
+    在 DB 隔艙內開啟 user_id 所在分片 (或指定分片) 的非同步 session；
+    連線數已達上限且等待佇列已滿時拋出 BulkheadFull
+    """
+    async with db_bulkhead.acquire():
+        async with shards[shard_index(user_id, shard)].AsyncSessionLocal() as db:
+            db_sessions_total.inc("async")
+            db_sessions_active.inc("async")
+            try:
+                yield db
+            finally:
+                db_sessions_active.dec("async")
+
+async def get_async_db(request: Request):
+    async with async_session_scope(shard=await request_shard(request)) as db:
+        yield db
+
+# --- 跨分片讀取 (管理端點、排程與統計工作) ---
+
+def fan_out(fn: Callable[[Session], T], max_workers: int = 8) -> List[T]:
+    """在每個分片各開一個同步 session 並行執行 fn(session)，依分片順序回傳結果；任一分片失敗時拋出該例外"""
+    def run(shard: Shard) -> T:
+        with shard.SessionLocal() as db:
+            return fn(db)
+
+    if len(shards) == 1:
+        return [run(shards[0])]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(shards)), thread_name_prefix="shard") as pool:
+        return list(pool.map(run, shards))
+
+async def fan_out_async(fn: Callable[[AsyncSession], Awaitable[T]]) -> List[T]:
+    """非同步版本：每個分片各開一個 session (經過 DB 隔艙) 並行執行 fn(session)"""
+    async def run(shard: Shard) -> T:
+        async with async_session_scope(shard=shard.index) as db:
+            return await fn(db)
+
+    return list(await asyncio.gather(*(run(shard) for shard in shards)))
+
+async def dispose_engines():
+    for shard in shards:
+        await shard.async_engine.dispose()
+        shard.engine.dispose()
@@ -0,0 +1,180 @@
+# app/db/query_stats.py
+"""
+SQL 查詢的量測與慢查詢紀錄。
+
+以 SQLAlchemy 的 before/after_cursor_execute 事件掛在同步與非同步引擎上 (見 instrument())：
+- 每個 HTTP 請求累計查詢次數與總時間 (QueryStatsMiddleware 以 contextvar 傳遞，
+  非同步 session 的 greenlet 與同步路由的執行緒池都會繼承請求的 context)。
+- 超過 slow_query_ms 的查詢記錄為警告，並附上 EXPLAIN QUERY PLAN (同一個 SQL 只解釋一次)。
+- 同一個請求中相同的 SQL 執行達 n_plus_one_threshold 次時，視為 N+1 候選記錄一次警告。
+- debug_headers = true 時在回應加上 X-DB-Query-Count / X-DB-Query-Time-Ms / X-DB-N-Plus-One；
+  串流回應在送出標頭之後的查詢不會計入標頭，但仍會計入日誌與指標。
+
+config.ini 範例：
+    [QUERY_LOG]
+    slow_query_ms = 200
+    explain = true
+    n_plus_one_threshold = 5
+    debug_headers = false
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+from app.services.metrics import registry
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_settings = get_settings().query_log
+SLOW_QUERY_SECONDS = _settings.slow_query_ms / 1000
+N_PLUS_ONE_THRESHOLD = _settings.n_plus_one_threshold
+
+query_duration = registry.histogram(
+    "medimgmt_db_query_duration_seconds", "SQL 查詢時間", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+slow_queries = registry.counter("medimgmt_db_slow_queries_total", "超過 slow_query_ms 的查詢數", ["operation"])
+n_plus_one = registry.counter("medimgmt_db_n_plus_one_total", "偵測到的 N+1 候選 (每個請求每個 SQL 一次)", ["route"])
+
+class RequestQueryStats:
+    """單一請求的查詢統計 (只在該請求的 context 中修改)"""
+
+    __slots__ = ("count", "seconds", "statements", "suspects", "label", "scope")
+
+    def __init__(self, label: str = "", scope: Optional[dict] = None):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Dict[str, int] = {}
+        self.suspects = 0
+        self.label = label  # 日誌用 (含實際路徑)
+        self.scope = scope
+
+    @property
+    def route(self) -> str:
+        """
+        指標標籤用的路由樣板 (例如 POST /api/records/{user_id}/import)：
+        路由比對完成後 scope["route"] 才存在，尚未比對到路由時為 unmatched。
+        實際路徑含有使用者 ID，不可作為指標標籤 (見 app/services/metrics.py)。
+        """
+        if self.scope is None:
+            return "unknown"
+        route = self.scope.get("route")
+        return f"{self.scope['method']} {getattr(route, 'path', None) or 'unmatched'}"
+
+    def record(self, statement: str, elapsed: float):
+        self.count += 1
+        self.seconds += elapsed
+        seen = self.statements.get(statement, 0) + 1
+        self.statements[statement] = seen
+        if seen == N_PLUS_ONE_THRESHOLD:
+            self.suspects += 1
+            return True
+        return False
+
+_current: contextvars.ContextVar[Optional[RequestQueryStats]] = contextvars.ContextVar("query_stats", default=None)
+
+def current_stats() -> Optional[RequestQueryStats]:
+    return _current.get()
+
+def _operation(statement: str) -> str:
+    keyword = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+    return keyword if keyword in ("select", "insert", "update", "delete") else "other"
+
+# 已解釋過的 SQL (LRU)，避免同一個慢查詢每次都再執行 EXPLAIN
+_explained: "OrderedDict[str, None]" = OrderedDict()
+_EXPLAINED_MAX = 256
+_explained_lock = threading.Lock()
+
+def _explain(conn, statement: str, parameters, executemany: bool) -> Optional[str]:
+    if not _settings.explain or executemany or _operation(statement) == "other":
+        return None
+    with _explained_lock:
+        if statement in _explained:
+            _explained.move_to_end(statement)
+            return None
+        _explained[statement] = None
+        if len(_explained) > _EXPLAINED_MAX:
+            _explained.popitem(last=False)
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+        return "\n".join(f"    {row[-1]}" for row in cursor.fetchall())
+    except Exception as e:
+        return f"    (無法取得查詢計畫: {e})"
+    finally:
+        cursor.close()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    operation = _operation(statement)
+    query_duration.observe(elapsed, operation)
+
+    stats = _current.get()
+    if stats is not None and stats.record(statement, elapsed):
+        n_plus_one.inc(stats.route)
+        logger.warning(
+            f"可能的 N+1 查詢：{stats.label} 中相同的 SQL 已執行 {N_PLUS_ONE_THRESHOLD} 次\n    {statement}"
+        )
+
+    if elapsed >= SLOW_QUERY_SECONDS:
+        slow_queries.inc(operation)
+        plan = _explain(conn, statement, parameters, executemany)
+        where = f" ({stats.label})" if stats is not None and stats.label else ""
+        message = f"慢查詢 {elapsed * 1000:.1f} ms{where}\n    {statement}"
+        if plan:
+            message += f"\n  查詢計畫:\n{plan}"
+        logger.warning(message)
+
+def _handle_error(exception_context):
+    # 失敗的查詢不會觸發 after_cursor_execute，把開始時間丟掉
+    starts = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if starts:
+        starts.pop()
+
+def instrument(engine):
+    """在引擎 (非同步引擎請傳入 .sync_engine) 上掛上查詢量測"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+class QueryStatsMiddleware:
+    """純 ASGI 中介軟體：為每個請求建立查詢統計，請求結束時記錄摘要 (debug) 並視設定加上回應標頭"""
+
+    def __init__(self, app, debug_headers: bool = _settings.debug_headers):
+        self.app = app
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestQueryStats(f"{scope['method']} {scope['path']}", scope)
+        token = _current.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                if self.debug_headers:
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"x-db-query-count", str(stats.count).encode()),
+                        (b"x-db-query-time-ms", f"{stats.seconds * 1000:.1f}".encode()),
+                        (b"x-db-n-plus-one", str(stats.suspects).encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if stats.count:
+                logger.debug(
+                    f"{stats.label}: {stats.count} 個查詢，{stats.seconds * 1000:.1f} ms，N+1 候選 {stats.suspects} 個"
+                )
@@ -0,0 +1,114 @@
+# app/db/sharding.py
+"""
+依使用者分片的 SQLite 儲存 (選用)。
+
+所有使用者共用一個 med.db 時，SQLite 同時只允許一個寫入者，worker 再多寫入量也不會增加。
+[DATABASE] shards = N (> 1) 時，使用者資料依 user_id 分散到 N 個 SQLite 檔案，每個檔案各有自己的寫入鎖：
+- 分片 0 為 sqlite_path，同時存放排程租約、APScheduler job store 等全域資料；
+  分片 k (k >= 1) 為 shard_path.format(shard=k)，未設定時為 sqlite_path 加上 .shard<k> (med.shard1.db)。
+- 分片編號 = jump consistent hash(blake2b(user_id), N)：與行程、Python 的 hash 種子無關；
+  分片數由 N 增為 M 時只有約 (M - N) / M 的使用者需要搬移，而且只會搬到新增的分片。
+- 同一位使用者的資料 (users / medications / reminders / user_profiles / alerts / adherence_daily /
+  medication_status_logs / cache_versions / rate_limit_events) 都在同一個分片，交易不會跨檔案。
+- 分片 k 的自動編號 id 由 k * ID_STRIDE 起算，各分片的 id 不重複 (舊 med.db 的資料表在重新分片前
+  改為 AUTOINCREMENT，搬走的 id 不會再配給其他資料)。以 id 存取的路由 (例如 PUT /api/medications/{med_id})
+  查詢所有分片，只採用擁有者屬於該分片的資料列；可加上 ?user_id= 直接指定擁有者，路由會檢查擁有者相符。
+- 目前的分片數記錄在分片 0 的 shard_layout 資料表，與設定不符時拒絕啟動。
+  變更分片數 (只支援增加) 請先停止服務，執行
+      python -m app.services.reshard --to 8
+  完成後將設定改為 shards = 8 再啟動。既有的單一 med.db 也是以同樣方式 (由 1 增為 N) 轉換。
+
+config.ini 範例：
+    [DATABASE]
+    sqlite_path = ./med.db
+    shards = 4
+    shard_path = /data/med.shard{shard}.db
+"""
+
+import hashlib
+import os
+from typing import Any, Iterable, Mapping, Optional, Set, Tuple
+
+from app.utils.config import DatabaseSettings, get_settings
+
+# 每個分片的 id 區段大小；JavaScript 的整數上限為 2^53，可容納 8192 個分片
+ID_STRIDE = 1 << 40
+
+# 請求中可用來決定分片的欄位：使用者 ID，或以 id 指定的資料 (欄位名稱 -> 資料表)
+USER_KEYS = ("user_id", "line_user_id")
+ENTITY_KEYS = {"med_id": "medications", "medication_id": "medications", "reminder_id": "reminders"}
+
+class ShardRoutingError(ValueError):
+    """無法由請求判斷資料所在的分片 (main.py 轉為 400)"""
+
+class ShardLayoutError(RuntimeError):
+    """資料庫的分片配置與設定不符，或重新分片尚未完成"""
+
+def _key(user_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest(), "big")
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Lamping & Veach 的 jump consistent hash：64 位元整數 -> [0, buckets)"""
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+def shard_for(user_id: str, shards: int) -> int:
+    """使用者所在的分片編號"""
+    if shards <= 1:
+        return 0
+    return jump_hash(_key(user_id), shards)
+
+def shard_path(index: int, settings: Optional[DatabaseSettings] = None) -> str:
+    """分片的 SQLite 檔案路徑"""
+    settings = settings or get_settings().database
+    if index == 0:
+        return settings.sqlite_path
+    if settings.shard_path:
+        return settings.shard_path.format(shard=index)
+    root, ext = os.path.splitext(settings.sqlite_path)
+    return f"{root}.shard{index}{ext or '.db'}"
+
+def id_base(index: int) -> int:
+    """分片自動編號 id 的起點 (分片 0 沿用既有的 id)"""
+    return index * ID_STRIDE
+
+def shard_of_id(entity_id: int, shards: int) -> int:
+    """id 建立時所在的分片 (使用者之後可能被搬到其他分片，只作為第一個查詢的分片)"""
+    index = entity_id // ID_STRIDE
+    return index if 0 <= index < shards else 0
+
+def _user_ids(values: Mapping[str, Any]) -> Set[str]:
+    return {str(values[key]) for key in USER_KEYS if values.get(key)}
+
+def _entity(values: Mapping[str, Any]) -> Optional[Tuple[str, int]]:
+    for key, table in ENTITY_KEYS.items():
+        try:
+            return table, int(values[key])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+def routing_keys(path_params: Mapping[str, Any], query_params: Mapping[str, Any],
+                 body: Any = None) -> Tuple[Set[str], Optional[Tuple[str, int]]]:
+    """
+    由請求取出 (使用者 ID 集合, (資料表, id))，依 路徑 -> 查詢參數 -> JSON 內文 的順序，先找到的為準。
+    路徑上的 id 優先於內文的 user_id：例如修改藥物時內文的 user_id 是新的擁有者，資料仍在原本的分片。
+    """
+    bodies: Iterable = body if isinstance(body, list) else [body]
+    sources = [path_params, query_params] + [b for b in bodies if isinstance(b, dict)]
+    for index, values in enumerate(sources):
+        user_ids, entity = _user_ids(values), _entity(values)
+        if index == 0 and entity and not user_ids:
+            # 以 id 存取時可在查詢參數指定擁有者 (路由會檢查擁有者是否相符)
+            user_ids = _user_ids(query_params)
+        if user_ids or entity:
+            if index >= 2:
+                # JSON 陣列 (批次新增) 要取出所有元素的使用者
+                for extra in sources[index + 1:]:
+                    user_ids |= _user_ids(extra)
+            return user_ids, entity
+    return set(), None
@@ -2,33 +2,47 @@
 
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
-from configparser import ConfigParser
+from fastapi.responses import RedirectResponse, JSONResponse, ORJSONResponse, Response
 import logging
-import json
+import time
 
 # 匯入您的 API 路由模組和資料庫初始化函式
-from app.api import medication, prescription, alert, user, reminder, terms, user_profile
-from app.db.database import init_db
+from app.api import medication, prescription, alert, user, reminder, terms, user_profile, adherence, system, records, linebot
+from app.db.database import init_db, dispose_engines
+from app.db.sharding import ShardRoutingError
+from app.services.scheduler import start_scheduler, shutdown_scheduler, schedule_interval_job
+from app.services.medication_expiry import run_expiry_sweep
+from app.services.alert_retention import run_alert_compaction
+from app.services.bulkhead import BulkheadFull, all_bulkheads
+from app.services.admission import RateLimited
+from app.services.speculative import speculative_analyzer
+from app.services.line_webhook import line_webhook
+from app.services.static_assets import liff_static_app
+from app.services.metrics import registry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from app.db.query_stats import QueryStatsMiddleware
+from app.services.profiling import ProfilingMiddleware, enabled as profiling_enabled
+from app.utils.config import get_settings, validate_settings
+from app.utils.logging_config import configure_logging
 
 # --- 1. 設定與初始化 ---
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [MAIN] - %(message)s')
+# 設定有誤時在匯入階段就失敗，worker 不會帶著錯誤設定開始接收請求
+settings = get_settings()
+validate_settings(settings)
+# 日誌經由佇列交給背景執行緒輸出 (JSON)，詳見 app/utils/logging_config.py
+configure_logging(settings.logging)
+logger = logging.getLogger(__name__)
 
-config = ConfigParser()
-config.read('app/config/config.ini')
-
-try:
-    allowed_origins = config.get('SECURITY', 'allowed_origins').split(',')
-except (config.NoSectionError, config.NoOptionError):
-    allowed_origins = ["https://liff.line.me"]
-    logging.warning("在 config.ini 中找不到 [SECURITY] -> allowed_origins 設定，使用預設值。")
+allowed_origins = settings.security.allowed_origins
+expiry_sweep_minutes = settings.scheduler.expiry_sweep_minutes
+alert_compaction_minutes = settings.alerts.compaction_minutes
 
 app = FastAPI(
     title="MediMgmt API",
     description="用藥管理系統後端 API",
-    version="1.0.4"
+    version="1.0.4",
+    # 回應以 orjson 序列化；各路由宣告 response_model，由 Pydantic 直接轉換後交給 orjson，不經過 jsonable_encoder
+    default_response_class=ORJSONResponse,
 )
 
 # --- 2. 中介軟體 (Middleware) ---
@@ -41,28 +55,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.middleware("http")
-async def log_request_body(request: Request, call_next):
-    """記錄請求內文的中介軟體"""
-    body_bytes = await request.body()
-    
-    if request.method == "POST" and str(request.url.path) == "/api/medications/":
-        if body_bytes:
-            try:
-                body_json = json.loads(body_bytes)
-                log_message = json.dumps(body_json, indent=2, ensure_ascii=False)
-                logging.info(f"↓↓↓ 收到 /api/medications/ 的請求內文 (Request Body) ↓↓↓\n{log_message}")
-            except json.JSONDecodeError:
-                logging.info(f"↓↓↓ 收到 /api/medications/ 的非 JSON 請求內文 ↓↓↓\n{body_bytes.decode(errors='ignore')}")
-        else:
-            logging.info("↓↓↓ 收到 /api/medications/ 的請求，但請求內文為空 ↓↓↓")
-
-    async def receive():
-        return {"type": "http.request", "body": body_bytes}
-    
-    new_request = Request(request.scope, receive)
-    response = await call_next(new_request)
-    return response
+http_latency = registry.histogram(
+    "medimgmt_http_request_duration_seconds", "HTTP 請求處理時間 (至回應送出完畢)", ["method", "route", "status"],
+)
+http_in_progress = registry.gauge("medimgmt_http_requests_in_progress", "處理中的 HTTP 請求數")
+
+class MetricsMiddleware:
+    """
+    純 ASGI 中介軟體 (不經過 BaseHTTPMiddleware，不額外複製請求與回應)。
+    route 標籤使用路由樣板 (例如 /api/medications/{med_id})，未對應到路由的請求 (404、靜態檔案) 歸為 unmatched。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_in_progress.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_progress.dec()
+            route = scope.get("route")
+            http_latency.observe(
+                time.perf_counter() - started,
+                scope["method"], getattr(route, "path", None) or "unmatched", str(status),
+            )
+
+# 最後加入的中介軟體在最外層，量測的時間包含其他中介軟體
+app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(MetricsMiddleware)
+# 選用的單一請求剖析 (見 app/services/profiling.py)；未啟用時不加入，請求不經過它
+if profiling_enabled(settings.profiling):
+    app.add_middleware(ProfilingMiddleware)
+
+@app.exception_handler(BulkheadFull)
+async def bulkhead_full_handler(request: Request, exc: BulkheadFull):
+    """資源池已滿時快速回絕，請用戶端稍後重試"""
+    logger.warning(f"{exc.name} 資源池已滿，拒絕請求 {request.method} {request.url.path}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "服務目前忙碌中，請稍後再試。"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    """單一使用者呼叫過於頻繁"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"請求過於頻繁，請於 {exc.retry_after} 秒後再試。"},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(ShardRoutingError)
+async def shard_routing_handler(request: Request, exc: ShardRoutingError):
+    """分片模式下無法由請求判斷使用者 (見 app/db/sharding.py)"""
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
 
 # --- 3. API 路由註冊 ---
 app.include_router(medication.router, prefix="/api/medications", tags=["藥物 (Medications)"])
@@ -71,16 +130,38 @@ app.include_router(alert.router, prefix="/api/alert", tags=["藥物警戒 (Alert
 app.include_router(user.router, prefix="/api/user", tags=["使用者 (Users)"])
 app.include_router(user_profile.router, prefix="/api/user-profile", tags=["使用者個人資料 (User Profile)"])
 app.include_router(reminder.router, prefix="/api/reminder", tags=["提醒事項 (Reminders)"])
+app.include_router(adherence.router, prefix="/api/adherence", tags=["服藥遵從度 (Adherence)"])
 app.include_router(terms.router, prefix="/api/terms", tags=["服務條款 (Terms)"])
+app.include_router(records.router, prefix="/api/records", tags=["匯出入 (Records)"])
+app.include_router(system.router, prefix="/api/system", tags=["系統狀態 (System)"])
+app.include_router(linebot.router, prefix="/api/line", tags=["LINE Webhook"])
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus 文字格式的指標 (async：執行緒池使用量必須在事件迴圈中讀取)"""
+    return Response(registry.render(), media_type=METRICS_CONTENT_TYPE)
 
 # --- 4. 生命週期事件 ---
 @app.on_event("startup")
 def on_startup():
-    """應用程式啟動時，初始化資料庫連線與表格。"""
+    """應用程式啟動時，初始化資料庫連線與表格，並啟動排程 (只有取得領導者租約的 worker 會實際執行)。"""
     init_db()
+    schedule_interval_job(run_expiry_sweep, minutes=expiry_sweep_minutes, job_id="medication_expiry_sweep")
+    schedule_interval_job(run_alert_compaction, minutes=alert_compaction_minutes, job_id="alert_compaction")
+    start_scheduler()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    shutdown_scheduler()
+    await speculative_analyzer.shutdown()
+    await line_webhook.shutdown()
+    for bulkhead in all_bulkheads():
+        bulkhead.shutdown()
+    await dispose_engines()
 
 # --- 5. 靜態檔案與根路徑處理 ---
-app.mount("/liff", StaticFiles(directory="app/liff", html=True), name="liff-app")
+# 已建置時提供雜湊檔名與預先壓縮的版本 (python -m app.services.static_assets build)
+app.mount("/liff", liff_static_app(), name="liff-app")
 
 # ▼▼▼▼▼ 主要修正區域 ▼▼▼▼▼
 
@@ -96,10 +177,10 @@ async def read_root(request: Request):
     # 如果有查詢參數，保留它們
     if query_string:
         redirect_url = f"/liff/?{query_string}"
-        logging.info(f"根路徑重定向，保留參數：{redirect_url}")
+        logger.info(f"根路徑重定向，保留參數：{redirect_url}")
     else:
         redirect_url = "/liff/"
-        logging.info("根路徑重定向到預設 LIFF 頁面")
+        logger.info(f"根路徑重定向到預設 LIFF 頁面")
     
     return RedirectResponse(url=redirect_url)
 
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, String, Date, Index, UniqueConstraint
+from app.db.database import Base
+
+class AdherenceDaily(Base):
+    """每位使用者、每種藥物、每一天 (使用者當地日期) 的應服/已服次數彙總"""
+    __tablename__ = "adherence_daily"
+    __table_args__ = (
+        UniqueConstraint("user_id", "medication_id", "day", name="uq_adherence_daily_user_med_day"),
+        Index("ix_adherence_daily_user_day", "user_id", "day"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(String)
+    medication_id = Column(Integer)
+    day = Column(Date)
+    scheduled = Column(Integer, nullable=False, default=0)
+    taken = Column(Integer, nullable=False, default=0)
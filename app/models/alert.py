@@ -1,9 +1,18 @@
-from sqlalchemy import Column, Integer, String, DateTime, JSON
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, Index
 from app.db.database import Base
+from app.db.compression import CompressedJSON
 
 class Alert(Base):
     __tablename__ = "alerts"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, index=True)
-    alert_time = Column(DateTime)
-    result = Column(JSON)
+    alert_time = Column(DateTime, default=datetime.utcnow)
+    # analysis 報告在資料庫中壓縮存放，讀取時自動還原 (見 app/db/compression.py)
+    result = Column(CompressedJSON)
+
+    __table_args__ = (
+        # 保留政策：依使用者由新到舊挑出要保留的紀錄
+        Index("ix_alerts_user_time", "user_id", "alert_time"),
+    )
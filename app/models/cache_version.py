@@ -0,0 +1,17 @@
+from sqlalchemy import Column, Integer, String, Float, UniqueConstraint
+from app.db.database import Base
+
+class CacheVersion(Base):
+    """
+    回應快取的版本表：每次寫入某使用者的資料時遞增 version 並更新 changed_at，
+    其他 worker 定期讀取最近變動的資料列來清除自己的快取。
+    """
+    __tablename__ = "cache_versions"
+    __table_args__ = (
+        UniqueConstraint("namespace", "user_id", name="uq_cache_versions_namespace_user"),
+    )
+    id = Column(Integer, primary_key=True)
+    namespace = Column(String, nullable=False)  # profile / medications
+    user_id = Column(String, nullable=False)
+    version = Column(Integer, nullable=False, default=1)
+    changed_at = Column(Float, nullable=False, index=True)  # UNIX 時間 (秒)
@@ -1,8 +1,17 @@
-from sqlalchemy import Column, Integer, String, Date, JSON
+from sqlalchemy import Column, Integer, String, Date, JSON, Index
 from app.db.database import Base
 
+# 用藥狀態
+STATUS_ACTIVE = "進行中"
+STATUS_STOPPED = "已停藥"
+MEDICATION_STATUSES = (STATUS_ACTIVE, STATUS_STOPPED)
+
 class Medication(Base):
     __tablename__ = "medications"
+    __table_args__ = (
+        # 到期掃描 (status = 進行中 AND end_date < 今天) 使用
+        Index("ix_medications_status_end_date", "status", "end_date"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(String, index=True)
     name = Column(String)
@@ -12,4 +21,5 @@ class Medication(Base):
     remind_times = Column(JSON)
     start_date = Column(Date)
     end_date = Column(Date)
-    status = Column(String, default="進行中")  # 進行中/已停藥
+    status = Column(String, default=STATUS_ACTIVE)  # 進行中/已停藥
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # 每次更新遞增
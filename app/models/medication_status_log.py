@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from app.db.database import Base
+
+class MedicationStatusLog(Base):
+    """用藥狀態轉換紀錄 (例如結束日期已過，自動由 進行中 轉為 已停藥)"""
+    __tablename__ = "medication_status_logs"
+    id = Column(Integer, primary_key=True, index=True)
+    medication_id = Column(Integer, index=True)
+    user_id = Column(String, index=True)
+    from_status = Column(String)
+    to_status = Column(String)
+    reason = Column(String)  # end_date_expired / ...
+    changed_at = Column(DateTime)
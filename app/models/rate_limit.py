@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, String, Float, Index
+from app.db.database import Base
+
+class RateLimitEvent(Base):
+    """多個 worker 共用的限流紀錄 (admission backend = sqlite 時使用)"""
+    __tablename__ = "rate_limit_events"
+    __table_args__ = (
+        Index("ix_rate_limit_events_key_ts", "key", "ts"),
+    )
+    id = Column(Integer, primary_key=True)
+    key = Column(String, nullable=False)  # "<endpoint>:<user_id>"
+    ts = Column(Float, nullable=False)  # UNIX 時間 (秒)
@@ -1,8 +1,12 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, DateTime, Boolean, Index
 from app.db.database import Base
 
 class Reminder(Base):
     __tablename__ = "reminders"
+    __table_args__ = (
+        # 依藥物 + 時間區間查詢提醒 (使用者查詢會先由 medications.user_id 找出藥物再走此索引)
+        Index("ix_reminders_medication_time", "medication_id", "remind_time"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     medication_id = Column(Integer)
     remind_time = Column(DateTime)
@@ -0,0 +1,10 @@
+from sqlalchemy import Column, String, Float
+from app.db.database import Base
+
+class SchedulerLease(Base):
+    """排程領導者租約：同一時間只有 holder 這個 process 會執行排程工作"""
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False, default="")
+    expires_at = Column(Float, nullable=False, default=0)  # UNIX 時間 (秒)
+    heartbeat_at = Column(Float, nullable=False, default=0)
@@ -0,0 +1,10 @@
+from sqlalchemy import Column, Integer, Float
+from app.db.database import Base
+
+class ShardLayout(Base):
+    """目前的分片數 (只使用分片 0 中 id = 1 的資料列，見 app/db/sharding.py)"""
+    __tablename__ = "shard_layout"
+    id = Column(Integer, primary_key=True)
+    shards = Column(Integer, nullable=False, default=1)
+    target_shards = Column(Integer, nullable=True)  # 重新分片進行中時為目標分片數
+    updated_at = Column(Float, nullable=False, default=0)  # UNIX 時間 (秒)
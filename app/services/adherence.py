@@ -0,0 +1,238 @@
+# app/services/adherence.py
+"""
+服藥遵從度彙總 (adherence rollup)。
+
+每次新增/修改/刪除提醒 (Reminder) 時，在同一個交易內以增量方式更新 adherence_daily
+(刪除藥物或把藥物移給其他使用者時，也在同一個交易內刪除或重新計算該藥物的彙總)：
+  - scheduled: 當天應服藥次數 (提醒筆數)
+  - taken:     當天已服藥次數
+查詢日/週/月遵從度時只需讀取 O(天數) 筆彙總資料，而不必掃描所有提醒。
+
+若彙總資料與 reminders 不一致 (例如匯入舊資料)，可用 CLI 重建：
+    python -m app.services.adherence --user-id Uxxxx
+"""
+
+import argparse
+import logging
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app.db.database import fan_out, init_db, session_for
+from app.models.adherence import AdherenceDaily
+from app.models.medication import Medication
+from app.models.reminder import Reminder
+from app.models.user import User
+from app.services.timezone import convert_time_to_user_timezone, convert_batch, DEFAULT_TIMEZONE
+from app.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ("day", "week", "month")
+
+class DoseSnapshot(NamedTuple):
+    """提醒在寫入前/後影響彙總的欄位"""
+    medication_id: Optional[int]
+    remind_time: Optional[datetime]
+    taken: bool
+
+def snapshot(reminder: Optional[Reminder]) -> Optional[DoseSnapshot]:
+    if reminder is None:
+        return None
+    return DoseSnapshot(reminder.medication_id, reminder.remind_time, bool(reminder.taken))
+
+def user_timezone(db: Session, user_id: str) -> str:
+    tz = db.scalar(select(User.timezone).where(User.line_user_id == user_id))
+    return tz or DEFAULT_TIMEZONE
+
+def _bump(db: Session, user_id: str, medication_id: int, day: date, scheduled: int, taken: int):
+    """以 UPSERT 累加單日計數"""
+    stmt = sqlite_insert(AdherenceDaily).values(
+        user_id=user_id, medication_id=medication_id, day=day, scheduled=scheduled, taken=taken
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "medication_id", "day"],
+        set_={
+            "scheduled": AdherenceDaily.scheduled + stmt.excluded.scheduled,
+            "taken": AdherenceDaily.taken + stmt.excluded.taken,
+        },
+    )
+    db.execute(stmt)
+
+def apply_reminder_change(db: Session, before: Optional[DoseSnapshot], after: Optional[DoseSnapshot]):
+    """
+    依提醒寫入前後的狀態更新彙總 (不 commit，由呼叫端與提醒寫入一起提交)。
+    新增: before=None；刪除: after=None。
+    """
+    deltas: Dict[tuple, List[int]] = {}
+    for snap, sign in ((before, -1), (after, 1)):
+        if snap is None or snap.medication_id is None or snap.remind_time is None:
+            continue
+        user_id = db.scalar(select(Medication.user_id).where(Medication.id == snap.medication_id))
+        if user_id is None:
+            continue
+        day = convert_time_to_user_timezone(snap.remind_time, user_timezone(db, user_id)).date()
+        counts = deltas.setdefault((user_id, snap.medication_id, day), [0, 0])
+        counts[0] += sign
+        counts[1] += sign * int(snap.taken)
+
+    for (user_id, medication_id, day), (scheduled, taken) in deltas.items():
+        if scheduled or taken:
+            _bump(db, user_id, medication_id, day, scheduled, taken)
+
+def apply_reminder_batch(db: Session, user_id: str, added: List[DoseSnapshot]):
+    """
+    同一位使用者一次新增多筆提醒 (例如批次匯入) 時使用：只查一次時區、批次換算日期。
+    呼叫端需確認所有 medication_id 都屬於 user_id。不 commit。
+    """
+    added = [snap for snap in added if snap.medication_id is not None and snap.remind_time is not None]
+    if not added:
+        return
+    days = convert_batch([snap.remind_time for snap in added], user_timezone(db, user_id))
+    deltas: Dict[tuple, List[int]] = {}
+    for snap, local_dt in zip(added, days):
+        counts = deltas.setdefault((snap.medication_id, local_dt.date()), [0, 0])
+        counts[0] += 1
+        counts[1] += int(snap.taken)
+    for (medication_id, day), (scheduled, taken) in deltas.items():
+        _bump(db, user_id, medication_id, day, scheduled, taken)
+
+def remove_medication_rollups(db: Session, medication_ids: List[int]):
+    """刪除藥物時一併刪除其彙總 (不 commit)"""
+    if medication_ids:
+        db.execute(delete(AdherenceDaily).where(AdherenceDaily.medication_id.in_(medication_ids)))
+
+def reassign_medication_rollups(db: Session, medication_id: int, user_id: str):
+    """
+    藥物改由其他使用者擁有時，刪除舊擁有者名下的彙總，依新擁有者的時區重新計算 (不 commit)。
+    兩人時區可能不同，不能只改 user_id。
+    """
+    remove_medication_rollups(db, [medication_id])
+    rows = db.execute(
+        select(Reminder.remind_time, Reminder.taken)
+        .where(Reminder.medication_id == medication_id, Reminder.remind_time.isnot(None))
+    ).all()
+    apply_reminder_batch(db, user_id, [DoseSnapshot(medication_id, row.remind_time, bool(row.taken)) for row in rows])
+
+def rebuild_rollups(db: Session, user_id: Optional[str] = None) -> int:
+    """由 reminders 重新計算彙總資料，回傳處理的提醒筆數"""
+    clear = delete(AdherenceDaily)
+    query = (
+        select(Reminder.medication_id, Reminder.remind_time, Reminder.taken, Medication.user_id)
+        .join(Medication, Medication.id == Reminder.medication_id)
+        .where(Reminder.remind_time.isnot(None))
+    )
+    if user_id is not None:
+        clear = clear.where(AdherenceDaily.user_id == user_id)
+        query = query.where(Medication.user_id == user_id)
+
+    counts: Dict[tuple, List[int]] = {}
+    zones: Dict[str, str] = {}
+    processed = 0
+    for row in db.execute(query.execution_options(yield_per=1000)):
+        if row.user_id not in zones:
+            zones[row.user_id] = user_timezone(db, row.user_id)
+        day = convert_time_to_user_timezone(row.remind_time, zones[row.user_id]).date()
+        entry = counts.setdefault((row.user_id, row.medication_id, day), [0, 0])
+        entry[0] += 1
+        entry[1] += int(bool(row.taken))
+        processed += 1
+
+    db.execute(clear)
+    if counts:
+        db.execute(
+            AdherenceDaily.__table__.insert(),
+            [
+                {"user_id": u, "medication_id": m, "day": d, "scheduled": s, "taken": t}
+                for (u, m, d), (s, t) in counts.items()
+            ],
+        )
+    db.commit()
+    return processed
+
+def _period_start(day: date, period: str) -> date:
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+def default_range(period: str, today: date) -> tuple:
+    """未指定日期區間時的預設範圍：最近 7 天 / 最近 4 週 / 最近 3 個月"""
+    if period == "week":
+        return _period_start(today, "week") - timedelta(weeks=3), today
+    if period == "month":
+        start = _period_start(today, "month")
+        for _ in range(2):
+            start = _period_start(start - timedelta(days=1), "month")
+        return start, today
+    return today - timedelta(days=6), today
+
+def get_adherence(
+    db: Session,
+    user_id: str,
+    start: date,
+    end: date,
+    period: str = "day",
+    medication_id: Optional[int] = None,
+) -> dict:
+    """讀取彙總資料並依日/週/月分組計算遵從度"""
+    query = (
+        select(AdherenceDaily.day, func.sum(AdherenceDaily.scheduled), func.sum(AdherenceDaily.taken))
+        .where(AdherenceDaily.user_id == user_id, AdherenceDaily.day >= start, AdherenceDaily.day <= end)
+        .group_by(AdherenceDaily.day)
+        .order_by(AdherenceDaily.day)
+    )
+    if medication_id is not None:
+        query = query.where(AdherenceDaily.medication_id == medication_id)
+
+    buckets: "OrderedDict[date, List[int]]" = OrderedDict()
+    for day, scheduled, taken in db.execute(query):
+        bucket = buckets.setdefault(_period_start(day, period), [0, 0])
+        bucket[0] += scheduled or 0
+        bucket[1] += taken or 0
+
+    total_scheduled = sum(b[0] for b in buckets.values())
+    total_taken = sum(b[1] for b in buckets.values())
+    return {
+        "user_id": user_id,
+        "period": period,
+        "start": start,
+        "end": end,
+        "scheduled": total_scheduled,
+        "taken": total_taken,
+        "rate": round(total_taken / total_scheduled, 4) if total_scheduled else None,
+        "buckets": [
+            {
+                "period_start": key,
+                "scheduled": s,
+                "taken": t,
+                "rate": round(t / s, 4) if s else None,
+            }
+            for key, (s, t) in buckets.items()
+        ],
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="由 reminders 重建服藥遵從度彙總")
+    parser.add_argument("--user-id", default=None, help="只重建指定使用者，預設為全部")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    init_db()
+    if args.user_id is None:
+        processed = sum(fan_out(rebuild_rollups))
+    else:
+        db = session_for(args.user_id)
+        try:
+            processed = rebuild_rollups(db, user_id=args.user_id)
+        finally:
+            db.close()
+    print(f"已重建 {processed} 筆提醒的彙總資料")
+
+if __name__ == "__main__":
+    main()
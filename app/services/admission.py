@@ -0,0 +1,144 @@
+# app/services/admission.py
+"""
+昂貴端點 (藥物交互作用分析、處方箋辨識) 的使用者層級准入控制。
+
+- 以 user_id 為鍵的滑動視窗計數：視窗內超過上限時拋出 RateLimited，由 main.py 轉為 429 + Retry-After。
+- backend = memory：單一 process 內的計數 (預設)。
+  backend = sqlite：計數寫在 rate_limit_events，多個 worker 共用同一份額度。
+  (各 worker 同時檢查時可能略為超出上限，對保護 Gemini 額度而言已足夠)
+- 准入時一併決定優先權：視窗內第一次呼叫為 PRIORITY_FIRST，重複呼叫為 PRIORITY_REPEAT，
+  在 AI 隔艙排隊時第一次的分析會先被處理。
+
+config.ini 範例：
+    [ADMISSION]
+    backend = memory
+    analyze_limit = 5
+    analyze_window = 60
+    recognize_limit = 10
+    recognize_window = 60
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Deque, Dict, Tuple
+
+from sqlalchemy import select, delete, func
+
+from app.db.database import async_session_scope
+from app.models.rate_limit import RateLimitEvent
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+PRIORITY_FIRST = 0
+PRIORITY_REPEAT = 1
+# 預先分析 (見 speculative.py) 排在所有使用者請求之後
+PRIORITY_SPECULATIVE = 2
+PURGE_EVERY = 1024
+
+class RateLimited(Exception):
+    """使用者在視窗內的請求次數已達上限"""
+    def __init__(self, endpoint: str, user_id: str, retry_after: int):
+        super().__init__(f"{user_id} exceeded the {endpoint} limit")
+        self.endpoint = endpoint
+        self.user_id = user_id
+        self.retry_after = retry_after
+
+class SlidingWindowLimiter:
+    """單一 process 內的滑動視窗計數"""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._events: Dict[str, Deque[float]] = defaultdict(deque)
+        self._lock = threading.Lock()
+        self._hits = 0
+
+    def hit(self, key: str, now: float = None) -> Tuple[bool, int, int]:
+        """記錄一次呼叫；回傳 (是否允許, 視窗內先前的次數, 建議重試秒數)"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._hits += 1
+            if self._hits % PURGE_EVERY == 0:
+                self._purge(now)
+            events = self._events[key]
+            while events and events[0] <= now - self.window:
+                events.popleft()
+            previous = len(events)
+            if previous >= self.limit:
+                return False, previous, max(1, math.ceil(events[0] + self.window - now))
+            events.append(now)
+            return True, previous, 0
+
+    def _purge(self, now: float):
+        """清掉視窗內已經沒有事件的使用者，避免長時間執行後佔用記憶體"""
+        for key in [k for k, ev in self._events.items() if not ev or ev[-1] <= now - self.window]:
+            del self._events[key]
+
+class SqliteWindowLimiter:
+    """以 rate_limit_events 資料表實作的滑動視窗，多個 worker 共用"""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._hits = 0
+
+    async def hit(self, key: str, now: float = None, user_id: str = None) -> Tuple[bool, int, int]:
+        now = time.time() if now is None else now
+        self._hits += 1
+        # 分片模式下寫在使用者所在的分片
+        async with async_session_scope(user_id) as db:
+            # 平常只清自己的過期紀錄，偶爾順便清掉所有使用者的
+            expired = RateLimitEvent.ts <= now - self.window
+            if self._hits % PURGE_EVERY:
+                expired = expired & (RateLimitEvent.key == key)
+            await db.execute(delete(RateLimitEvent).where(expired))
+            previous, oldest = (await db.execute(
+                select(func.count(RateLimitEvent.id), func.min(RateLimitEvent.ts)).where(RateLimitEvent.key == key)
+            )).one()
+            if previous >= self.limit:
+                await db.commit()
+                return False, previous, max(1, math.ceil(oldest + self.window - now))
+            db.add(RateLimitEvent(key=key, ts=now))
+            await db.commit()
+            return True, previous, 0
+
+class AdmissionController:
+    def __init__(self, endpoint: str, limit: int, window: float, backend: str = "memory"):
+        self.endpoint = endpoint
+        self.backend = backend
+        if backend == "sqlite":
+            self.limiter = SqliteWindowLimiter(limit, window)
+        else:
+            self.limiter = SlidingWindowLimiter(limit, window)
+
+    async def admit(self, user_id: str) -> int:
+        """准入檢查；超過上限時拋出 RateLimited，否則回傳排隊用的優先權"""
+        key = f"{self.endpoint}:{user_id}"
+        if self.backend == "sqlite":
+            allowed, previous, retry_after = await self.limiter.hit(key, user_id=user_id)
+        else:
+            allowed, previous, retry_after = self.limiter.hit(key)
+        if not allowed:
+            logger.warning(f"使用者 {user_id} 呼叫 {self.endpoint} 過於頻繁，{retry_after} 秒後才可再試")
+            raise RateLimited(self.endpoint, user_id, retry_after)
+        return PRIORITY_FIRST if previous == 0 else PRIORITY_REPEAT
+
+_settings = get_settings().admission
+
+analyze_admission = AdmissionController(
+    "analyze",
+    limit=_settings.analyze_limit,
+    window=_settings.analyze_window,
+    backend=_settings.backend,
+)
+recognize_admission = AdmissionController(
+    "recognize",
+    limit=_settings.recognize_limit,
+    window=_settings.recognize_window,
+    backend=_settings.backend,
+)
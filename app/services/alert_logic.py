@@ -1,20 +1,19 @@
+from app.services.interaction_kb import interaction_kb
+from app.services.prompts import PROFILE_LABELS
+
 def check_drug_interactions(medications, user_profile):
-    # 簡化範例，可自行串接醫學資料庫
-    known_interactions = [
-        ("Aspirin", "Warfarin"),
-        ("Clopidogrel", "Omeprazole"),
-        # ...擴充
-    ]
-    interaction_found = []
-    med_names = [med['name'] for med in medications]
-    for a, b in known_interactions:
-        if a in med_names and b in med_names:
-            interaction_found.append((a, b))
-    # profile分析可根據 user_profile
+    # 交互作用資料來自 app/data/interactions.csv 建置的知識庫 (見 interaction_kb.py)
+    # 由 interaction_analysis.analyze 呼叫，結果附在 Gemini 提示詞中；medications 可為 dict 或 Medication
+    med_names = [med['name'] if isinstance(med, dict) else med.name for med in medications]
+    # profile分析：使用者勾選的飲食/保健食品/病史/生理狀況欄位
+    profile_flags = []
+    if user_profile:
+        items = user_profile.items() if isinstance(user_profile, dict) else vars(user_profile).items()
+        profile_flags = [key for key, value in items if value is True]
     warnings = []
-    if interaction_found:
-        for pair in interaction_found:
-            warnings.append(f"{pair[0]} 與 {pair[1]} 可能有交互作用")
+    for hit in interaction_kb.find_interactions(med_names, profile_flags):
+        # 個人因子以欄位名稱儲存，顯示時改用個人資料頁的名稱
+        warnings.append(f"{hit.a} 與 {PROFILE_LABELS.get(hit.b, hit.b)} 可能有交互作用：{hit.note}")
     return {
         "interaction": bool(warnings),
         "warnings": warnings,
@@ -0,0 +1,226 @@
+# app/services/alert_retention.py
+"""
+藥物交互作用分析紀錄 (alerts) 的保留政策與壓縮整理。
+
+- 每位使用者保留最新的 keep_latest 筆，另外在最近 monthly_months 個月 (0 表示不限) 中
+  每個月保留最後一筆作為月快照，其餘刪除。
+- 尚未壓縮的舊紀錄分批以目前的 codec 改寫 (見 app/db/compression.py)。
+- 刪除與改寫都以每批 batch_size 筆提交，不會長時間鎖住資料庫；
+  完成後以 incremental_vacuum 分段歸還空間 (資料庫需為 auto_vacuum=INCREMENTAL)。
+- 分片模式下每個分片 (見 app/db/sharding.py) 分別並行整理。
+
+config.ini 範例：
+    [ALERTS]
+    keep_latest = 20
+    monthly_months = 12
+    batch_size = 500
+    vacuum_pages = 1000
+    compaction_minutes = 1440
+
+可由排程器定期執行，也可以手動執行：
+    python -m app.services.alert_retention --dry-run
+    python -m app.services.alert_retention --enable-incremental-vacuum
+"""
+
+import argparse
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import LargeBinary, and_, cast, select, update, delete, func
+from sqlalchemy.orm import Session
+
+from app.db.database import engine, fan_out, init_db, shards
+from app.db.compression import COMPRESSED_KEY_SUFFIX, MIN_SIZE as COMPRESSION_MIN_SIZE
+from app.models.alert import Alert
+from app.utils.config import get_settings
+from app.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+_settings = get_settings().alerts
+KEEP_LATEST = _settings.keep_latest
+MONTHLY_MONTHS = _settings.monthly_months
+DEFAULT_BATCH_SIZE = _settings.batch_size
+VACUUM_PAGES = _settings.vacuum_pages
+
+def _month_index(dt: datetime) -> int:
+    return dt.year * 12 + dt.month - 1
+
+def select_expired(rows, keep_latest: int, monthly_months: int, now_utc: datetime) -> List[int]:
+    """
+    rows 為同一位使用者的 (id, alert_time)，由新到舊排列；回傳應刪除的 id。
+    沒有 alert_time 的舊紀錄視為同一個月。
+    """
+    expired = []
+    seen_months = set()
+    oldest_month = _month_index(now_utc) - monthly_months + 1 if monthly_months > 0 else None
+    for position, (alert_id, alert_time) in enumerate(rows):
+        month = _month_index(alert_time) if alert_time else None
+        is_snapshot = month not in seen_months and (
+            oldest_month is None or month is None or month >= oldest_month
+        )
+        seen_months.add(month)
+        if position < keep_latest or is_snapshot:
+            continue
+        expired.append(alert_id)
+    return expired
+
+def apply_retention(
+    db: Session,
+    keep_latest: int = KEEP_LATEST,
+    monthly_months: int = MONTHLY_MONTHS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    now_utc: Optional[datetime] = None,
+    dry_run: bool = False,
+) -> int:
+    """依保留政策刪除舊的分析紀錄，回傳刪除 (或 dry_run 時預計刪除) 的筆數"""
+    now_utc = now_utc or datetime.utcnow()
+    user_ids = db.scalars(
+        select(Alert.user_id).group_by(Alert.user_id).having(func.count(Alert.id) > keep_latest)
+    ).all()
+
+    total = 0
+    pending: List[int] = []
+    for user_id in user_ids:
+        rows = db.execute(
+            select(Alert.id, Alert.alert_time)
+            .where(Alert.user_id == user_id)
+            .order_by(Alert.alert_time.desc().nulls_last(), Alert.id.desc())
+        ).all()
+        pending.extend(select_expired(rows, keep_latest, monthly_months, now_utc))
+        while len(pending) >= batch_size:
+            total += _delete_batch(db, pending[:batch_size], dry_run)
+            pending = pending[batch_size:]
+    if pending:
+        total += _delete_batch(db, pending, dry_run)
+    return total
+
+def _delete_batch(db: Session, ids: List[int], dry_run: bool) -> int:
+    if not dry_run:
+        db.execute(delete(Alert).where(Alert.id.in_(ids)).execution_options(synchronize_session=False))
+        db.commit()
+    logger.info(f"{'[dry-run] ' if dry_run else ''}刪除 {len(ids)} 筆過期的分析紀錄")
+    return len(ids)
+
+def compress_existing(db: Session, batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False) -> int:
+    """將尚未壓縮的分析報告分批改寫為壓縮格式，回傳改寫筆數"""
+    # 短於 min_size (UTF-8 bytes) 的報告寫回後仍不壓縮，不選取，否則每次執行都會重新改寫這些資料列
+    analysis = func.json_extract(Alert.result, "$.analysis")
+    uncompressed = and_(analysis.isnot(None), func.length(cast(analysis, LargeBinary)) >= COMPRESSION_MIN_SIZE)
+    if dry_run:
+        return db.scalar(select(func.count(Alert.id)).where(uncompressed))
+
+    total, last_id = 0, 0
+    while True:
+        rows = db.execute(
+            select(Alert.id, Alert.result)
+            .where(Alert.id > last_id, uncompressed)
+            .order_by(Alert.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        # 透過 CompressedJSON 寫回
+        db.execute(
+            update(Alert).execution_options(synchronize_session=False),
+            [{"id": row.id, "result": row.result} for row in rows],
+        )
+        db.commit()
+        compressed = db.scalar(
+            select(func.count(Alert.id)).where(
+                Alert.id.in_([row.id for row in rows]),
+                func.json_extract(Alert.result, f"$.analysis{COMPRESSED_KEY_SUFFIX}").isnot(None),
+            )
+        )
+        total += compressed
+        logger.info(f"已壓縮 {compressed} 筆分析紀錄 (至 id {last_id})")
+    return total
+
+def incremental_vacuum(pages: int = VACUUM_PAGES, bind=None) -> int:
+    """分段歸還空閒頁面 (bind 預設為分片 0)，每段一個短交易；回傳歸還的頁數"""
+    released = 0
+    with (bind or engine).connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+            logger.info("資料庫未啟用 auto_vacuum=INCREMENTAL，略過空間回收")
+            return 0
+        while True:
+            free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if not free:
+                break
+            step = min(free, pages)
+            # incremental_vacuum 每次 step 只釋放一頁，直接用 DBAPI cursor 讀完所有結果才會執行完畢
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(f"PRAGMA incremental_vacuum({int(step)})")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            conn.commit()
+            after = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if after >= free:
+                break
+            released += free - after
+    if released:
+        logger.info(f"已歸還 {released} 個空閒頁面")
+    return released
+
+def enable_incremental_vacuum():
+    """將既有的資料庫 (所有分片) 轉為 auto_vacuum=INCREMENTAL (需要完整 VACUUM 一次，會短暫鎖住資料庫)"""
+    for shard in shards:
+        with shard.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+
+def _compact_shard(db: Session):
+    shard = db.info.get("shard", 0)
+    try:
+        deleted = apply_retention(db)
+        compressed = compress_existing(db)
+        if deleted or compressed:
+            logger.info(f"分析紀錄整理完成 (分片 {shard})：刪除 {deleted} 筆，壓縮 {compressed} 筆。")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"分析紀錄整理失敗 (分片 {shard}): {e}", exc_info=True)
+        return
+    try:
+        incremental_vacuum(bind=db.get_bind())
+    except Exception as e:
+        logger.error(f"空間回收失敗 (分片 {shard}): {e}", exc_info=True)
+
+def run_alert_compaction():
+    """排程器使用的進入點：各分片並行執行 保留政策 -> 壓縮舊紀錄 -> 回收空間"""
+    fan_out(_compact_shard)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="依保留政策整理藥物交互作用分析紀錄")
+    parser.add_argument("--keep-latest", type=int, default=KEEP_LATEST, help="每位使用者保留最新的筆數")
+    parser.add_argument("--monthly-months", type=int, default=MONTHLY_MONTHS,
+                        help="保留最近幾個月的月快照 (0 表示不限)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每批處理筆數")
+    parser.add_argument("--dry-run", action="store_true", help="只計算筆數，不寫入資料庫")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="將既有資料庫轉為 auto_vacuum=INCREMENTAL (執行一次完整 VACUUM)")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    init_db()
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum()
+        print("已啟用 auto_vacuum=INCREMENTAL")
+        return
+
+    def run(db: Session):
+        deleted = apply_retention(db, keep_latest=args.keep_latest, monthly_months=args.monthly_months,
+                                  batch_size=args.batch_size, dry_run=args.dry_run)
+        compressed = compress_existing(db, batch_size=args.batch_size, dry_run=args.dry_run)
+        released = 0 if args.dry_run else incremental_vacuum(bind=db.get_bind())
+        return deleted, compressed, released
+
+    deleted, compressed, released = (sum(column) for column in zip(*fan_out(run)))
+    prefix = "預計" if args.dry_run else "已"
+    print(f"{prefix}刪除 {deleted} 筆、{prefix}壓縮 {compressed} 筆分析紀錄，歸還 {released} 個頁面")
+
+if __name__ == "__main__":
+    main()
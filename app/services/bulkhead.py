@@ -0,0 +1,193 @@
+# app/services/bulkhead.py
+"""
+隔艙 (bulkhead)：把 AI 呼叫與資料庫存取放在各自有上限的資源池，
+避免大量的藥物交互作用分析 (每次可能等待 Gemini 數十秒) 佔滿資源、拖慢一般的 CRUD 讀取。
+
+- ai_bulkhead: 專用的執行緒池執行同步的 Gemini 呼叫 (requests)，不使用 FastAPI 共用的執行緒池。
+- db_bulkhead: 限制同時開啟的非同步資料庫連線數。
+兩者都有等待佇列上限，超過時立即拋出 BulkheadFull，由 main.py 轉為 503 + Retry-After。
+等待中的工作依 priority 由小到大取得空位 (同優先權則先到先得)。
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+from app.services.metrics import registry
+from app.services.profiling import bind_thread
+from app.utils.config import get_settings
+
+bulkhead_wait = registry.histogram(
+    "medimgmt_bulkhead_wait_seconds", "在隔艙等待佇列中等待空位的時間", ["bulkhead"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+class BulkheadFull(Exception):
+    """資源池與等待佇列皆已滿"""
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} bulkhead is full")
+        self.name = name
+        self.retry_after = retry_after
+
+class Bulkhead:
+    """
+    計數與等待佇列只在事件迴圈中操作；阻塞的函式則在專用執行緒池中執行，
+    執行緒數與同時進行的上限相同，所以執行緒池本身不會再排隊。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, retry_after: int = 5):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._active = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._completed = 0
+        self._rejected = 0
+        self._peak_active = 0
+        self._executor = None
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for *_, fut in self._waiters if not fut.done())
+
+    def _wake_next(self):
+        while self._waiters:
+            *_, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                fut.set_result(None)
+                return True
+        return False
+
+    async def _reserve(self, priority: int):
+        """取得空位 (沒有空位時依 priority 排隊)；佇列已滿時拋出 BulkheadFull"""
+        if self._active >= self.max_concurrency or self.queued:
+            if self.queued >= self.max_queue:
+                self._rejected += 1
+                raise BulkheadFull(self.name, self.retry_after)
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+            started = time.perf_counter()
+            try:
+                await fut
+            except BaseException:
+                # 已被喚醒 (取得空位) 才取消時，把空位讓給下一位
+                if fut.done() and not fut.cancelled() and not self._wake_next():
+                    self._active -= 1
+                raise
+            # 喚醒者已替我們保留空位 (見 _release)
+            bulkhead_wait.observe(time.perf_counter() - started, self.name)
+        else:
+            self._active += 1
+            bulkhead_wait.observe(0.0, self.name)
+        self._peak_active = max(self._peak_active, self._active)
+
+    def _release(self):
+        self._completed += 1
+        # 有人在等就直接把空位交接，否則歸還
+        if not self._wake_next():
+            self._active -= 1
+
+    @asynccontextmanager
+    async def acquire(self, priority: int = 0):
+        """
+        async with bulkhead.acquire(): ...
+        沒有空位時依 priority 排隊；佇列已滿時拋出 BulkheadFull。
+        """
+        await self._reserve(priority)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix=f"bulkhead-{self.name}"
+            )
+        return self._executor
+
+    async def run_callable(self, priority: int, func: Callable[[], Any],
+                           on_start: Optional[Callable[[], None]] = None):
+        """
+        取得空位後在專用執行緒池中執行 func()。on_start 在取得空位後、交給執行緒池之前於事件迴圈中呼叫。
+        空位保留到 func 執行完畢才歸還：等待者被取消時執行緒仍在執行，不能提早讓出空位。
+        """
+        await self._reserve(priority)
+        loop = asyncio.get_running_loop()
+        try:
+            if on_start is not None:
+                on_start()
+            future = self._get_executor().submit(bind_thread(func))
+        except BaseException:
+            self._release()
+            raise
+
+        def release(_):
+            # 在執行緒池的執行緒中呼叫；事件迴圈已關閉 (關機) 時不必再歸還
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._release)
+
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future, loop=loop)
+
+    async def run_prioritized(self, priority: int, func, *args, **kwargs):
+        """在此隔艙的專用執行緒池中執行阻塞函式，排隊時依 priority 取得空位"""
+        return await self.run_callable(priority, partial(func, *args, **kwargs))
+
+    async def run(self, func, *args, **kwargs):
+        """在此隔艙的專用執行緒池中執行阻塞函式；佇列已滿時拋出 BulkheadFull"""
+        return await self.run_prioritized(0, func, *args, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "active": self._active,
+            "queued": self.queued,
+            "peak_active": self._peak_active,
+            "completed": self._completed,
+            "rejected": self._rejected,
+            "utilization": round(self._active / self.max_concurrency, 4) if self.max_concurrency else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+_settings = get_settings().bulkhead
+ai_bulkhead = Bulkhead(
+    "ai",
+    max_concurrency=_settings.ai_max_concurrency,
+    max_queue=_settings.ai_max_queue,
+    retry_after=_settings.ai_retry_after,
+)
+db_bulkhead = Bulkhead(
+    "db",
+    max_concurrency=_settings.db_max_concurrency,
+    max_queue=_settings.db_max_queue,
+    retry_after=_settings.db_retry_after,
+)
+
+def all_bulkheads():
+    return [ai_bulkhead, db_bulkhead]
+
+def _bulkhead_stat(key: str):
+    return lambda: {(b.name,): b.stats()[key] for b in all_bulkheads()}
+
+registry.gauge("medimgmt_bulkhead_active", "隔艙中進行中的工作數", ["bulkhead"], callback=_bulkhead_stat("active"))
+registry.gauge("medimgmt_bulkhead_queued", "隔艙等待佇列中的工作數", ["bulkhead"], callback=_bulkhead_stat("queued"))
+registry.gauge("medimgmt_bulkhead_capacity", "隔艙同時進行的上限", ["bulkhead"],
+               callback=_bulkhead_stat("max_concurrency"))
+registry.callback_counter("medimgmt_bulkhead_rejected_total", "佇列已滿而被拒絕 (503) 的次數", ["bulkhead"],
+                          callback=_bulkhead_stat("rejected"))
@@ -0,0 +1,201 @@
+# app/services/cache.py
+"""
+使用者個人資料與用藥清單的讀取快取 (read-through，LRU + TTL)。
+
+- 快取內容是已序列化好的 JSON bytes，命中時直接回傳，不再查詢資料庫或重新序列化。
+- 寫入路徑 (user_profile.py / medication.py / 到期掃描) 在同一個交易內呼叫 mark_changed()
+  遞增 cache_versions，提交後再呼叫 response_cache.invalidate() 清除本 worker 的快取。
+- 其他 worker 在讀取時每隔 poll_interval 秒查詢一次最近變動的 cache_versions，清除對應的快取；
+  跨 worker 最多延遲 poll_interval 秒。分片模式下 cache_versions 與使用者資料在同一個分片，
+  各分片分別記錄上次輪詢的時間。
+- 未命中時先取得 generation()，查詢完再以 set(..., generation=...) 寫入：查詢期間若該使用者的快取
+  被清除 (本 worker 的寫入或輪詢到其他 worker 的變動)，不寫入查詢到的舊資料。
+
+config.ini 範例：
+    [CACHE]
+    maxsize = 10000
+    ttl = 300
+    poll_interval = 1
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.cache_version import CacheVersion
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+NS_PROFILE = "profile"
+NS_MEDICATIONS = "medications"
+
+# 各 worker 的時鐘可能有些微差距，輪詢時多往前看一點
+_POLL_OVERLAP = 2.0
+
+def _encode_default(obj):
+    """orjson 無法直接處理的型別：Pydantic 模型轉為 dict (日期等由 orjson 處理)，其他交給 jsonable_encoder"""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if hasattr(obj, "dict"):
+        return obj.dict()
+    return jsonable_encoder(obj)
+
+def dumps(obj) -> bytes:
+    """將回應內容序列化為 JSON bytes (orjson，與預設的 ORJSONResponse 輸出一致)"""
+    return orjson.dumps(obj, default=_encode_default, option=orjson.OPT_NON_STR_KEYS)
+
+def to_model(model_cls, obj):
+    """ORM 物件 -> Pydantic 模型 (同時支援 Pydantic v1 的 from_orm 與 v2 的 from_attributes)"""
+    if hasattr(model_cls, "model_validate"):
+        return model_cls.model_validate(obj, from_attributes=True)
+    return model_cls.from_orm(obj)
+
+def _mark_changed_stmt(namespace: str, user_id: str, now: float):
+    stmt = sqlite_insert(CacheVersion).values(namespace=namespace, user_id=user_id, version=1, changed_at=now)
+    return stmt.on_conflict_do_update(
+        index_elements=["namespace", "user_id"],
+        set_={"version": CacheVersion.version + 1, "changed_at": now},
+    )
+
+async def mark_changed(db: AsyncSession, namespace: str, user_ids: Iterable[str]):
+    """在寫入的交易中遞增版本 (不 commit)"""
+    now = time.time()
+    for user_id in set(user_ids):
+        if user_id is not None:
+            await db.execute(_mark_changed_stmt(namespace, user_id, now))
+
+def mark_changed_sync(db: Session, namespace: str, user_ids: Iterable[str]):
+    """同步 session (排程工作、CLI) 使用的版本"""
+    now = time.time()
+    for user_id in set(user_ids):
+        if user_id is not None:
+            db.execute(_mark_changed_stmt(namespace, user_id, now))
+
+class ResponseCache:
+    def __init__(self, maxsize: int, ttl: float, poll_interval: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (expires_at, payload)
+        self._generation = 0
+        # key -> 最近一次清除時的 generation，依時間排序，最多保留 maxsize 筆
+        self._invalidated: "OrderedDict[tuple, int]" = OrderedDict()
+        self._invalidated_floor = 0  # 已被移出 _invalidated 的最大 generation
+        self._lock = threading.Lock()
+        self._last_poll: Dict[int, float] = {}  # 分片 -> 上次輪詢時間
+        self._created = time.time()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, namespace: str, user_id: str) -> Optional[bytes]:
+        key = (namespace, user_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def generation(self) -> int:
+        """未命中、查詢資料庫之前取得，寫入時交給 set()"""
+        with self._lock:
+            return self._generation
+
+    def _is_stale(self, key: tuple, generation: int) -> bool:
+        if generation < self._invalidated_floor:
+            # 已無法確認查詢期間是否被清除，保守地視為過期
+            return True
+        return self._invalidated.get(key, 0) > generation
+
+    def _drop(self, key: tuple):
+        """清除一筆快取並記錄 generation (呼叫端持有 _lock)"""
+        self._entries.pop(key, None)
+        self._generation += 1
+        self._invalidated[key] = self._generation
+        self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.maxsize:
+            _, generation = self._invalidated.popitem(last=False)
+            self._invalidated_floor = generation
+
+    def set(self, namespace: str, user_id: str, payload: bytes, generation: Optional[int] = None) -> bool:
+        """
+        寫入快取；generation 為查詢前由 generation() 取得的值，
+        查詢期間該使用者的快取已被清除時不寫入 (回傳 False)，避免舊資料覆蓋較新的寫入。
+        """
+        key = (namespace, user_id)
+        with self._lock:
+            if generation is not None and self._is_stale(key, generation):
+                return False
+            self._entries[key] = (time.monotonic() + self.ttl, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+            return True
+
+    def invalidate(self, namespace: str, user_ids: Iterable[str]):
+        with self._lock:
+            for user_id in set(user_ids):
+                self._drop((namespace, user_id))
+
+    async def sync(self, db: AsyncSession):
+        """每隔 poll_interval 秒讀取其他 worker 寫入的版本變動，清除對應快取"""
+        now = time.time()
+        shard = db.info.get("shard", 0)
+        since = self._last_poll.get(shard, self._created)
+        if now - since < self.poll_interval:
+            return
+        self._last_poll[shard] = now
+        rows = (await db.execute(
+            select(CacheVersion.namespace, CacheVersion.user_id)
+            .where(CacheVersion.changed_at > since - _POLL_OVERLAP)
+        )).all()
+        if rows:
+            with self._lock:
+                for namespace, user_id in rows:
+                    self._drop((namespace, user_id))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            # 進行中的查詢一律不寫入
+            self._generation += 1
+            self._invalidated.clear()
+            self._invalidated_floor = self._generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": round(self._hits / total, 4) if total else None,
+            }
+
+_settings = get_settings().cache
+response_cache = ResponseCache(
+    maxsize=_settings.maxsize,
+    ttl=_settings.ttl,
+    poll_interval=_settings.poll_interval,
+)
@@ -0,0 +1,186 @@
+# app/services/interaction_analysis.py
+"""
+藥物交互作用分析 (Gemini) 與分析結果快取。
+
+- 分析結果存放在 alerts，result 中記錄提示詞的指紋 (fingerprint，包含範本版本)；
+  用藥與個人資料都沒變時 (提示詞相同)，max_age 內直接回傳已存的分析，不再呼叫 Gemini。
+- 提示詞範本與 token 預算見 app/services/prompts.py；知識庫 (interaction_kb.py) 查到的交互作用附在提示詞中，
+  知識庫更新後指紋改變，會重新分析。
+- 同一個 worker 內，相同使用者與指紋的分析只會有一個在進行，其他請求 (包含預先分析) 共用同一個結果。
+- 使用者的請求遇到仍在 AI 隔艙排隊、尚未開始的預先分析時，會取消它並以使用者請求的優先權重新排隊。
+
+config.ini 範例：
+    [ANALYSIS]
+    max_age_hours = 24
+"""
+
+import asyncio
+import logging
+from functools import partial
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func
+
+from app.db.database import async_session_scope
+from app.models.alert import Alert
+from app.models.medication import Medication, STATUS_ACTIVE
+from app.models.user_profile import UserProfile
+from app.services.alert_logic import check_drug_interactions
+from app.services.bulkhead import ai_bulkhead
+from app.services.germini_service import call_gemini_text
+from app.services.profiling import follow
+from app.services.prompts import RenderedPrompt, render_analysis, build_analysis_prompt  # build_analysis_prompt：保留原本的匯入路徑
+from app.utils.config import get_settings
+from app.utils.logging_config import log_payload
+
+logger = logging.getLogger(__name__)
+
+MAX_AGE = timedelta(hours=get_settings().analysis.max_age_hours)
+
+NO_MEDICATIONS_MESSAGE = "目前沒有正在服用的藥物紀錄，無法進行交互作用分析。請先新增用藥紀錄。"
+EXTRACT_FAILED_MESSAGE = "分析結果提取失敗，請稍後再試。"
+EXTRACT_ERROR_MESSAGE = "分析結果處理時發生錯誤，請稍後再試。"
+
+class _InFlight:
+    """進行中的分析；started 在取得 AI 隔艙空位時 (於事件迴圈中、交給執行緒池之前) 設為 True"""
+    __slots__ = ("task", "speculative", "started")
+
+    def __init__(self, speculative: bool):
+        self.task: Optional[asyncio.Task] = None
+        self.speculative = speculative
+        self.started = False
+
+    def mark_started(self):
+        # 已取得空位，之後就不再取消
+        self.started = True
+
+# (user_id, fingerprint) -> 進行中的分析
+_inflight: Dict[Tuple[str, str], _InFlight] = {}
+
+async def load_inputs(user_id: str) -> Tuple[List[Medication], Optional[UserProfile]]:
+    """讀取使用者進行中的藥物與個人資料 (沒有藥物時不讀個人資料)"""
+    async with async_session_scope(user_id) as db:
+        medications = (await db.scalars(select(Medication).where(
+            Medication.user_id == user_id,
+            Medication.status == STATUS_ACTIVE
+        ))).all()
+        if not medications:
+            return [], None
+        user_profile = await db.scalar(select(UserProfile).where(UserProfile.user_id == user_id))
+    return list(medications), user_profile
+
+async def find_cached(user_id: str, fp: str) -> Optional[str]:
+    """max_age 內指紋相同的最新分析"""
+    since = datetime.utcnow() - MAX_AGE
+    async with async_session_scope(user_id) as db:
+        alert = await db.scalar(
+            select(Alert)
+            .where(
+                Alert.user_id == user_id,
+                Alert.alert_time >= since,
+                func.json_extract(Alert.result, "$.fingerprint") == fp,
+            )
+            .order_by(Alert.id.desc())
+            .limit(1)
+        )
+    return alert.result.get("analysis") if alert is not None else None
+
+async def _run(entry: _InFlight, user_id: str, prompt: RenderedPrompt, fp: str,
+               medication_count: int, has_profile: bool, priority: int) -> str:
+    # Gemini 呼叫仍是同步的 requests，交給 AI 隔艙的執行緒池，滿載時直接拋出 BulkheadFull
+    gemini_result = await ai_bulkhead.run_callable(priority, partial(call_gemini_text, prompt),
+                                                   on_start=entry.mark_started)
+    analysis_text = extract_analysis_result(gemini_result)
+
+    result = {
+        "analysis": analysis_text,
+        "medication_count": medication_count,
+        "has_profile": has_profile,
+        "speculative": entry.speculative,
+    }
+    # 提取失敗的結果不快取，下次重新分析
+    if analysis_text not in (EXTRACT_FAILED_MESSAGE, EXTRACT_ERROR_MESSAGE):
+        result["fingerprint"] = fp
+    async with async_session_scope(user_id) as db:
+        db.add(Alert(user_id=user_id, alert_time=datetime.utcnow(), result=result))
+        await db.commit()
+    return analysis_text
+
+def _forget(key, entry: _InFlight, task: asyncio.Task):
+    if _inflight.get(key) is entry:
+        del _inflight[key]
+
+async def analyze(
+    user_id: str,
+    medications: List[Medication],
+    user_profile: Optional[UserProfile],
+    priority: int = 0,
+    speculative: bool = False,
+    admit: Optional[Callable[[], Awaitable[int]]] = None,
+) -> str:
+    """
+    回傳分析結果：快取命中 -> 已存的分析；有相同的分析進行中 -> 等待同一個結果；
+    否則先呼叫 admit() (准入檢查，回傳優先權) 再呼叫 Gemini。
+    """
+    known = check_drug_interactions(medications, user_profile)["warnings"]
+    prompt = render_analysis(medications, user_profile, known_interactions=known)
+    logger.info(f"生成的分析提示词 ({prompt.version}) 估计 {prompt.estimated_tokens} token")
+    fp = prompt.fingerprint()
+    key = (user_id, fp)
+
+    entry = _inflight.get(key)
+    if entry is not None and entry.speculative and not speculative and not entry.started:
+        # 預先分析還在排隊：取消它，改以使用者請求的優先權排隊
+        entry.task.cancel()
+        _inflight.pop(key, None)
+        entry = None
+
+    if entry is None:
+        cached = await find_cached(user_id, fp)
+        if cached is not None:
+            logger.info(f"用户 {user_id} 的分析命中快取")
+            return cached
+        if admit is not None:
+            priority = await admit()
+        entry = _inflight.get(key)
+        if entry is None:
+            entry = _InFlight(speculative)
+            entry.task = asyncio.create_task(
+                _run(entry, user_id, prompt, fp, len(medications), user_profile is not None, priority)
+            )
+            _inflight[key] = entry
+            entry.task.add_done_callback(lambda task, key=key, entry=entry: _forget(key, entry, task))
+    else:
+        logger.info(f"用户 {user_id} 的分析已在進行中，等待同一個結果")
+    follow(entry.task)
+
+    try:
+        # shield：單一請求斷線不會取消其他請求也在等待的分析
+        return await asyncio.shield(entry.task)
+    except asyncio.CancelledError:
+        if speculative and entry.speculative and not entry.started:
+            entry.task.cancel()
+        raise
+
+def inflight_count() -> int:
+    return len(_inflight)
+
+def extract_analysis_result(gemini_response: dict) -> str:
+    """从 Gemini API 响应中提取分析结果"""
+    try:
+        # 从 Gemini 响应中提取文本内容
+        if 'candidates' in gemini_response and len(gemini_response['candidates']) > 0:
+            candidate = gemini_response['candidates'][0]
+            if 'content' in candidate and 'parts' in candidate['content']:
+                parts = candidate['content']['parts']
+                if len(parts) > 0 and 'text' in parts[0]:
+                    return parts[0]['text'].strip()
+        
+        # 如果无法提取，返回错误信息
+        log_payload(logger, "无法从 Gemini 响应中提取文本内容", gemini_response, level=logging.ERROR, sample=False)
+        return EXTRACT_FAILED_MESSAGE
+        
+    except Exception as e:
+        logger.error(f"提取分析结果时发生错误: {e}")
+        return EXTRACT_ERROR_MESSAGE
@@ -0,0 +1,363 @@
+# app/services/interaction_kb.py
+"""
+藥物交互作用知識庫 (interaction knowledge base)。
+
+由 CSV 建置成精簡的二進位檔，以 mmap 唯讀開啟：
+- 各 worker 共用作業系統的 page cache，不會各自把整份資料解析成 Python dict。
+- 開啟時只讀檔頭，查詢時才以二分搜尋觸及需要的頁面。
+- 檔案被替換時 (建置工具以 os.replace 原子寫入)，下一次查詢發現 mtime/inode 改變就開啟新檔並整個換掉參考；
+  進行中的查詢仍使用舊的 mmap，舊檔在沒有參考後自動關閉，不需重新啟動也不會卡住請求。
+
+檔案格式 (little endian)：
+    檔頭   magic "MIKB", version, 各區段筆數與位移
+    names  依 UTF-8 bytes 排序的正規化名稱 (藥名與個人因子，例如 diet_grapefruit)：(n+1) 個 u32 位移 + 字串內容
+    texts  說明文字 (依編號存取)：(n+1) 個 u32 位移 + 字串內容
+    pairs  藥物-藥物紀錄，依 (a, b) 排序且 a < b
+    rules  藥物-個人因子紀錄，依 (drug, factor) 排序
+    紀錄皆為 <IIHHI：(名稱編號, 名稱編號, 嚴重度, 保留, 說明編號)
+
+CSV 欄位：kind,a,b,severity,note
+    kind = pair   -> a、b 為兩個藥名
+    kind = factor -> a 為藥名，b 為 user_profiles 的欄位名稱 (diet_* / supp_* / history_* / condition_*)
+    severity = minor / moderate / major / contraindicated
+
+建置：
+    python -m app.services.interaction_kb build app/data/interactions.csv app/data/interactions.kb
+    python -m app.services.interaction_kb lookup Aspirin Warfarin
+
+config.ini 範例：
+    [INTERACTION_KB]
+    path = ./app/data/interactions.kb
+    source = ./app/data/interactions.csv
+    check_interval = 5
+"""
+
+import argparse
+import bisect
+import csv
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from app.utils.config import get_settings
+from app.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MIKB"
+FORMAT_VERSION = 1
+# magic, version, 保留, names 筆數, texts 筆數, pairs 筆數, rules 筆數, 四個區段位移
+_HEADER = struct.Struct("<4sHHIIIIIIII")
+_RECORD = struct.Struct("<IIHHI")
+_U32 = struct.Struct("<I")
+
+SEVERITIES = {"minor": 1, "moderate": 2, "major": 3, "contraindicated": 4}
+SEVERITY_NAMES = {v: k for k, v in SEVERITIES.items()}
+
+_TOKEN_SPLIT = re.compile(r"[\s()（）\[\]/,，、]+")
+
+def normalize(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+class Interaction(NamedTuple):
+    a: str
+    b: str
+    severity: str
+    note: str
+
+class _StringTable:
+    def __init__(self, buf: memoryview, offset: int, count: int):
+        self.count = count
+        self._buf = buf
+        self._offsets = offset
+        self._blob = offset + (count + 1) * _U32.size
+
+    def __len__(self):
+        return self.count
+
+    def raw(self, i: int) -> bytes:
+        start = _U32.unpack_from(self._buf, self._offsets + i * _U32.size)[0]
+        end = _U32.unpack_from(self._buf, self._offsets + (i + 1) * _U32.size)[0]
+        return bytes(self._buf[self._blob + start:self._blob + end])
+
+    def __getitem__(self, i: int) -> bytes:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self.raw(i)
+
+class _RecordArray:
+    """依 (a, b) 排序的紀錄，可直接交給 bisect"""
+
+    def __init__(self, buf: memoryview, offset: int, count: int):
+        self.count = count
+        self._buf = buf
+        self._offset = offset
+
+    def __len__(self):
+        return self.count
+
+    def record(self, i: int) -> Tuple[int, int, int, int, int]:
+        return _RECORD.unpack_from(self._buf, self._offset + i * _RECORD.size)
+
+    def __getitem__(self, i: int) -> Tuple[int, int]:
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        a, b, *_ = self.record(i)
+        return a, b
+
+class KnowledgeBase:
+    """一個已開啟的知識庫檔案 (唯讀)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = memoryview(self._mmap)
+        (magic, version, _, n_names, n_texts, n_pairs, n_rules,
+         names_off, texts_off, pairs_off, rules_off) = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} 不是可辨識的知識庫檔案 (magic={magic!r}, version={version})")
+        if rules_off + n_rules * _RECORD.size > len(buf) or pairs_off + n_pairs * _RECORD.size > len(buf):
+            raise ValueError(f"{path} 檔案長度不符，可能尚未寫入完成")
+        self.names = _StringTable(buf, names_off, n_names)
+        self.texts = _StringTable(buf, texts_off, n_texts)
+        self.pairs = _RecordArray(buf, pairs_off, n_pairs)
+        self.rules = _RecordArray(buf, rules_off, n_rules)
+
+    def name_id(self, name: str) -> Optional[int]:
+        key = normalize(name).encode("utf-8")
+        i = bisect.bisect_left(self.names, key)
+        if i < len(self.names) and self.names[i] == key:
+            return i
+        return None
+
+    def resolve(self, name: str) -> Optional[int]:
+        """完整名稱找不到時，再以名稱中的單字查詢 (例如「脈優錠 Norvasc 5mg」-> norvasc)"""
+        name_id = self.name_id(name)
+        if name_id is not None:
+            return name_id
+        for token in _TOKEN_SPLIT.split(name):
+            if token:
+                name_id = self.name_id(token)
+                if name_id is not None:
+                    return name_id
+        return None
+
+    def _make(self, record) -> Interaction:
+        a, b, severity, _, note = record
+        return Interaction(
+            a=self.names.raw(a).decode("utf-8"),
+            b=self.names.raw(b).decode("utf-8"),
+            severity=SEVERITY_NAMES.get(severity, str(severity)),
+            note=self.texts.raw(note).decode("utf-8"),
+        )
+
+    def pair(self, a_id: int, b_id: int) -> Optional[Interaction]:
+        key = (a_id, b_id) if a_id < b_id else (b_id, a_id)
+        i = bisect.bisect_left(self.pairs, key)
+        if i < len(self.pairs) and self.pairs[i] == key:
+            return self._make(self.pairs.record(i))
+        return None
+
+    def factors(self, drug_id: int) -> List[Interaction]:
+        i = bisect.bisect_left(self.rules, (drug_id, 0))
+        found = []
+        while i < len(self.rules) and self.rules[i][0] == drug_id:
+            found.append(self._make(self.rules.record(i)))
+            i += 1
+        return found
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "names": len(self.names),
+            "pairs": len(self.pairs),
+            "rules": len(self.rules),
+            "bytes": self.signature[2],
+        }
+
+def build(rows: Iterable[Dict[str, str]], output_path: str) -> dict:
+    """由 CSV 列建置知識庫，寫入暫存檔後以 os.replace 原子替換"""
+    pairs: Dict[Tuple[str, str], Tuple[int, str]] = {}
+    rules: Dict[Tuple[str, str], Tuple[int, str]] = {}
+    for line_no, row in enumerate(rows, start=2):
+        kind = (row.get("kind") or "").strip()
+        a, b = normalize(row.get("a") or ""), normalize(row.get("b") or "")
+        severity = SEVERITIES.get((row.get("severity") or "").strip().lower())
+        if not a or not b or severity is None or kind not in ("pair", "factor"):
+            raise ValueError(f"第 {line_no} 行格式錯誤: {row}")
+        note = (row.get("note") or "").strip()
+        if kind == "pair":
+            if a == b:
+                raise ValueError(f"第 {line_no} 行的兩個藥名相同: {row}")
+            pairs[tuple(sorted((a, b)))] = (severity, note)
+        else:
+            rules[(a, b)] = (severity, note)
+
+    names = sorted({n for key in list(pairs) + list(rules) for n in key}, key=lambda n: n.encode("utf-8"))
+    name_ids = {n: i for i, n in enumerate(names)}
+    texts: List[str] = []
+    text_ids: Dict[str, int] = {}
+
+    def text_id(note: str) -> int:
+        if note not in text_ids:
+            text_ids[note] = len(texts)
+            texts.append(note)
+        return text_ids[note]
+
+    def records(entries) -> bytes:
+        rows_ = sorted(
+            (name_ids[a], name_ids[b], severity, text_id(note)) for (a, b), (severity, note) in entries.items()
+        )
+        return b"".join(_RECORD.pack(a, b, severity, 0, note) for a, b, severity, note in rows_)
+
+    def table(strings: List[str]) -> bytes:
+        encoded = [s.encode("utf-8") for s in strings]
+        offsets, pos = [0], 0
+        for s in encoded:
+            pos += len(s)
+            offsets.append(pos)
+        return b"".join(_U32.pack(o) for o in offsets) + b"".join(encoded)
+
+    # 需要先產生紀錄才知道所有說明文字的編號
+    pair_bytes, rule_bytes = records(pairs), records(rules)
+    names_bytes, texts_bytes = table(names), table(texts)
+    names_off = _HEADER.size
+    texts_off = names_off + len(names_bytes)
+    pairs_off = texts_off + len(texts_bytes)
+    rules_off = pairs_off + len(pair_bytes)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(names), len(texts), len(pairs), len(rules),
+                          names_off, texts_off, pairs_off, rules_off)
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".interactions-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header + names_bytes + texts_bytes + pair_bytes + rule_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return {"names": len(names), "pairs": len(pairs), "rules": len(rules)}
+
+def build_from_csv(csv_path: str, output_path: str) -> dict:
+    with open(csv_path, newline="", encoding="utf-8-sig") as f:
+        return build(csv.DictReader(f), output_path)
+
+class InteractionKB:
+    """
+    目前使用中的知識庫。每 check_interval 秒最多 stat 一次檔案，
+    有變動時開啟新檔並替換參考 (單一指派，對其他執行緒而言是原子的)。
+    """
+
+    def __init__(self, path: str, source: Optional[str] = None, check_interval: float = 5):
+        self.path = path
+        self.source = source
+        self.check_interval = check_interval
+        self._current: Optional[KnowledgeBase] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _reload(self):
+        signature = self._signature()
+        if signature is None and self._current is None and self.source and os.path.exists(self.source):
+            logger.info(f"找不到知識庫 {self.path}，由 {self.source} 建置")
+            build_from_csv(self.source, self.path)
+            signature = self._signature()
+        if signature is None:
+            if self._current is None:
+                logger.warning(f"找不到藥物交互作用知識庫 {self.path}")
+            return
+        if self._current is not None and self._current.signature == signature:
+            return
+        try:
+            kb = KnowledgeBase(self.path)
+        except Exception as e:
+            # 新檔無法開啟時繼續使用舊的
+            logger.error(f"載入知識庫失敗，沿用目前版本: {e}")
+            return
+        self._current = kb
+        logger.info(f"已載入藥物交互作用知識庫: {kb.stats()}")
+
+    def get(self) -> Optional[KnowledgeBase]:
+        now = time.monotonic()
+        if self._current is None or now - self._checked_at >= self.check_interval:
+            # 只有一個執行緒負責檢查，其他執行緒直接使用目前的版本
+            if self._lock.acquire(blocking=self._current is None):
+                try:
+                    if self._current is None or now - self._checked_at >= self.check_interval:
+                        self._checked_at = now
+                        self._reload()
+                finally:
+                    self._lock.release()
+        return self._current
+
+    def find_interactions(self, medication_names: List[str], profile_flags: Iterable[str] = ()) -> List[Interaction]:
+        """回傳藥物之間，以及藥物與使用者個人因子 (已勾選的 user_profiles 欄位) 之間的交互作用"""
+        kb = self.get()
+        if kb is None:
+            return []
+        ids = []
+        for name in medication_names:
+            name_id = kb.resolve(name)
+            if name_id is not None and name_id not in ids:
+                ids.append(name_id)
+        found = []
+        for i, a_id in enumerate(ids):
+            for b_id in ids[i + 1:]:
+                hit = kb.pair(a_id, b_id)
+                if hit:
+                    found.append(hit)
+        flags = {normalize(f) for f in profile_flags}
+        if flags:
+            for drug_id in ids:
+                found.extend(rule for rule in kb.factors(drug_id) if rule.b in flags)
+        return found
+
+_settings = get_settings().interaction_kb
+interaction_kb = InteractionKB(
+    path=_settings.path,
+    source=_settings.source,
+    check_interval=_settings.check_interval,
+)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="藥物交互作用知識庫工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="由 CSV 建置二進位知識庫 (原子替換)")
+    build_cmd.add_argument("csv_path")
+    build_cmd.add_argument("output_path", nargs="?", default=interaction_kb.path)
+    lookup_cmd = sub.add_parser("lookup", help="查詢藥物之間的交互作用")
+    lookup_cmd.add_argument("names", nargs="+")
+    lookup_cmd.add_argument("--flag", action="append", default=[], help="個人因子，例如 diet_grapefruit")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.command == "build":
+        counts = build_from_csv(args.csv_path, args.output_path)
+        print(f"已建置 {args.output_path}: {counts}")
+    else:
+        for hit in interaction_kb.find_interactions(args.names, args.flag):
+            print(f"[{hit.severity}] {hit.a} + {hit.b}: {hit.note}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# app/services/leader.py
+"""
+以 SQLite 租約列 (scheduler_leases) 實作的領導者選舉。
+
+- 每個 process 以背景執行緒每 heartbeat 秒嘗試取得或續約租約；
+  只有目前持有者或租約已過期時才能成功 (單一 UPDATE，由 SQLite 的寫入鎖保證互斥)。
+- 成為領導者時呼叫 on_elected，失去租約時呼叫 on_demoted，每次續約成功後呼叫 on_renewed。
+- 正常關閉時主動釋放租約，其他 process 在下一次心跳 (最多 heartbeat 秒) 內接手；
+  異常中止時則在租約到期 (lease 秒) 後接手。
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Callable, Optional
+
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.db.database import engine
+from app.models.scheduler_lease import SchedulerLease
+
+logger = logging.getLogger(__name__)
+
+class LeaderElector:
+    def __init__(
+        self,
+        name: str,
+        lease_seconds: float = 15,
+        heartbeat_seconds: float = 5,
+        on_elected: Optional[Callable[[], None]] = None,
+        on_demoted: Optional[Callable[[], None]] = None,
+        on_renewed: Optional[Callable[[], None]] = None,
+        holder_id: Optional[str] = None,
+    ):
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.on_elected = on_elected
+        self.on_demoted = on_demoted
+        self.on_renewed = on_renewed
+        self.holder_id = holder_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._last_renewed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def try_acquire(self) -> bool:
+        """取得或續約租約，成功時回傳 True"""
+        now = time.time()
+        with engine.begin() as conn:
+            conn.execute(
+                sqlite_insert(SchedulerLease)
+                .values(name=self.name, holder="", expires_at=0, heartbeat_at=0)
+                .on_conflict_do_nothing(index_elements=["name"])
+            )
+            result = conn.execute(
+                update(SchedulerLease)
+                .where(
+                    SchedulerLease.name == self.name,
+                    (SchedulerLease.holder == self.holder_id) | (SchedulerLease.expires_at < now),
+                )
+                .values(holder=self.holder_id, expires_at=now + self.lease_seconds, heartbeat_at=now)
+            )
+        return result.rowcount == 1
+
+    def release(self):
+        """主動釋放租約 (只有持有者本身能釋放)"""
+        with engine.begin() as conn:
+            conn.execute(
+                update(SchedulerLease)
+                .where(SchedulerLease.name == self.name, SchedulerLease.holder == self.holder_id)
+                .values(expires_at=0)
+            )
+
+    def _set_leader(self, leader: bool):
+        if leader == self.is_leader:
+            return
+        self.is_leader = leader
+        callback = self.on_elected if leader else self.on_demoted
+        logger.info(f"{self.holder_id} {'成為' if leader else '不再是'} {self.name} 的領導者")
+        if callback:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"領導者狀態切換處理失敗: {e}", exc_info=True)
+
+    def heartbeat(self):
+        """單次心跳：續約或嘗試接手"""
+        try:
+            acquired = self.try_acquire()
+        except Exception as e:
+            logger.warning(f"租約續約失敗: {e}")
+            # 暫時性錯誤 (例如資料庫忙碌) 不立刻卸任，但租約可能已過期時必須停止工作
+            if self.is_leader and time.time() - self._last_renewed >= self.lease_seconds - self.heartbeat_seconds:
+                self._set_leader(False)
+            return
+        if acquired:
+            self._last_renewed = time.time()
+        self._set_leader(acquired)
+        if acquired and self.on_renewed:
+            try:
+                self.on_renewed()
+            except Exception as e:
+                logger.error(f"續約後處理失敗: {e}", exc_info=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.heartbeat()
+            self._stop.wait(self.heartbeat_seconds)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"leader-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.heartbeat_seconds)
+        if self.is_leader:
+            self._set_leader(False)
+            try:
+                self.release()
+            except Exception as e:
+                logger.warning(f"釋放租約失敗: {e}")
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "holder_id": self.holder_id,
+            "is_leader": self.is_leader,
+            "lease_seconds": self.lease_seconds,
+            "heartbeat_seconds": self.heartbeat_seconds,
+            "last_renewed": self._last_renewed or None,
+        }
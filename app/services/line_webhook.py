@@ -0,0 +1,221 @@
+# app/services/line_webhook.py
+"""
+LINE webhook 事件的非同步處理。
+
+- 路由 (app/api/linebot.py) 只驗證簽章並把事件放進佇列，立即回應 200，避免 LINE 逾時後重送。
+- 固定數量的 worker 協程從佇列取出事件處理；佇列已滿時丟棄並記錄 (不阻塞 webhook 回應)。
+- 以 webhookEventId 去除重複：LINE 重送 (deliveryContext.isRedelivery) 的事件在 dedupe_ttl 秒內只處理一次，
+  記錄的 ID 數量上限為 dedupe_maxsize (超過時淘汰最舊的)。此集合只在單一 worker process 內有效。
+- 回覆透過共用連線池的 httpx.AsyncClient 送出，不再於事件迴圈中呼叫同步的 LINE SDK。
+- api_endpoint 可指向本機替身 (bench/fake_services.py)。
+
+config.ini 範例：
+    [LINE]
+    channel_secret = ...
+    channel_access_token = ...
+    webhook_workers = 4
+    webhook_queue_size = 1000
+    dedupe_ttl = 86400
+    dedupe_maxsize = 100000
+    reply_timeout = 10
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import httpx
+
+from app.services.metrics import registry
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_ENDPOINT = "https://api.line.me"
+GREETING = "您好，這是用藥管理及藥物警戒系統。請使用下方圖文選單操作。"
+
+webhook_events = registry.counter(
+    "medimgmt_line_webhook_events_total", "收到的 LINE webhook 事件 (accepted / duplicate / dropped)", ["result"]
+)
+handled_events = registry.counter("medimgmt_line_events_handled_total", "處理完成的事件", ["type", "outcome"])
+reply_duration = registry.histogram(
+    "medimgmt_line_reply_duration_seconds", "LINE reply API 呼叫時間", ["status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+
+def verify_signature(body: bytes, signature: Optional[str], channel_secret: str) -> bool:
+    """X-Line-Signature = base64(HMAC-SHA256(channel_secret, 原始請求內文))"""
+    if not signature:
+        return False
+    digest = hmac.new(channel_secret.encode("utf-8"), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest), signature.encode("utf-8"))
+
+class TTLSet:
+    """有容量上限的 TTL 集合 (只在事件迴圈中使用，不需要鎖)"""
+
+    def __init__(self, ttl: float, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._expiry: "OrderedDict[str, float]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def _evict(self, now: float):
+        while self._expiry:
+            key, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now and len(self._expiry) <= self.maxsize:
+                break
+            del self._expiry[key]
+
+    def add(self, key: str, now: Optional[float] = None) -> bool:
+        """加入 key；已存在且未過期時回傳 False"""
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        if key in self._expiry:
+            return False
+        self._expiry[key] = now + self.ttl
+        self._evict(now)
+        return True
+
+    def discard(self, key: str):
+        self._expiry.pop(key, None)
+
+class LineReplyClient:
+    """共用連線池的 LINE Messaging API 用戶端 (第一次使用時建立)"""
+
+    def __init__(self, access_token: Optional[str], endpoint: Optional[str], timeout: float):
+        self.access_token = access_token
+        self.endpoint = (endpoint or DEFAULT_API_ENDPOINT).rstrip("/")
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            if not self.access_token:
+                raise RuntimeError("未設定 [LINE] channel_access_token")
+            self._client = httpx.AsyncClient(
+                base_url=self.endpoint,
+                headers={"Authorization": f"Bearer {self.access_token}"},
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                # 只重試連線建立失敗 (請求尚未送出)；reply token 只能使用一次，不重送已送出的請求
+                transport=httpx.AsyncHTTPTransport(retries=1),
+            )
+        return self._client
+
+    async def reply(self, reply_token: str, messages: List[dict]):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await self._get_client().post(
+                "/v2/bot/message/reply", json={"replyToken": reply_token, "messages": messages}
+            )
+            status = str(response.status_code)
+            response.raise_for_status()
+        finally:
+            reply_duration.observe(time.perf_counter() - started, status)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+class LineWebhookProcessor:
+    def __init__(self, client: LineReplyClient, workers: int, queue_size: int, dedupe_ttl: float, dedupe_maxsize: int):
+        self.client = client
+        self.workers = workers
+        self.queue_size = queue_size
+        self._seen = TTLSet(dedupe_ttl, dedupe_maxsize)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_started(self):
+        """第一次收到事件時才建立佇列與 worker (需要在事件迴圈中呼叫)"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._tasks = [
+                asyncio.create_task(self._worker(), name=f"line-webhook-{i}") for i in range(self.workers)
+            ]
+
+    def submit(self, events: List[dict]) -> int:
+        """把事件放進佇列 (不等待處理)；回傳接受的事件數"""
+        self._ensure_started()
+        accepted = 0
+        for event in events:
+            event_id = event.get("webhookEventId")
+            if event_id and not self._seen.add(event_id):
+                webhook_events.inc("duplicate")
+                logger.info(f"略過重複的 LINE 事件 {event_id}")
+                continue
+            try:
+                self._queue.put_nowait(event)
+            except asyncio.QueueFull:
+                if event_id:
+                    self._seen.discard(event_id)  # 讓之後的重送仍有機會被處理
+                webhook_events.inc("dropped")
+                logger.warning(f"LINE 事件佇列已滿，丟棄事件 {event_id or event.get('type')}")
+                continue
+            webhook_events.inc("accepted")
+            accepted += 1
+        return accepted
+
+    async def _worker(self):
+        while True:
+            event = await self._queue.get()
+            try:
+                await self.handle(event)
+                handled_events.inc(event.get("type", "unknown"), "ok")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                handled_events.inc(event.get("type", "unknown"), "error")
+                logger.error(f"處理 LINE 事件 {event.get('webhookEventId')} 失敗: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def handle(self, event: dict):
+        """文字訊息回覆使用說明，其他事件目前不處理"""
+        message = event.get("message") or {}
+        if event.get("type") == "message" and message.get("type") == "text" and event.get("replyToken"):
+            await self.client.reply(event["replyToken"], [{"type": "text", "text": GREETING}])
+
+    def stats(self) -> dict:
+        return {
+            "started": self._queue is not None,
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "dedupe_entries": len(self._seen),
+        }
+
+    async def shutdown(self, timeout: float = 5):
+        """等待佇列中的事件處理完 (最多 timeout 秒) 後停止 worker 並關閉連線池"""
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"關閉時仍有 {self._queue.qsize()} 個 LINE 事件未處理")
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks, self._queue = [], None
+        await self.client.aclose()
+
+_settings = get_settings().line
+line_webhook = LineWebhookProcessor(
+    LineReplyClient(_settings.channel_access_token, _settings.api_endpoint, _settings.reply_timeout),
+    workers=_settings.webhook_workers,
+    queue_size=_settings.webhook_queue_size,
+    dedupe_ttl=_settings.dedupe_ttl,
+    dedupe_maxsize=_settings.dedupe_maxsize,
+)
+
+registry.gauge(
+    "medimgmt_line_webhook_queued", "LINE 事件佇列中等待處理的事件數",
+    callback=lambda: {(): line_webhook.stats()["queued"]},
+)
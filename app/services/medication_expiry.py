@@ -0,0 +1,166 @@
+# app/services/medication_expiry.py
+"""
+用藥到期掃描：將 end_date 已過的「進行中」藥物轉為「已停藥」。
+
+- 依使用者時區判斷「當天結束」：end_date 為 D 的藥物，在使用者當地時間跨過 D+1 00:00 後才會到期。
+- 以時區分組、每批 batch_size 筆的方式更新，走 ix_medications_status_end_date 索引。
+- 每一筆轉換都會寫入 medication_status_logs。
+
+可由排程器定期執行，也可以手動回補：
+    python -m app.services.medication_expiry --batch-size 1000
+    python -m app.services.medication_expiry --now 2025-01-01T00:00:00 --dry-run
+"""
+
+import argparse
+import logging
+from datetime import datetime, date
+from typing import Dict, Optional
+
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.orm import Session
+
+from app.db.database import fan_out, init_db
+from app.models.medication import Medication, STATUS_ACTIVE, STATUS_STOPPED
+from app.models.medication_status_log import MedicationStatusLog
+from app.models.user import User
+from app.services.timezone import convert_time_to_user_timezone, DEFAULT_TIMEZONE
+from app.services.cache import mark_changed_sync, NS_MEDICATIONS
+from app.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+EXPIRY_REASON = "end_date_expired"
+
+def _local_dates(db: Session, now_utc: datetime) -> Dict[str, date]:
+    """取得所有使用中時區 (含預設時區) 的當地日期"""
+    zones = {DEFAULT_TIMEZONE}
+    zones.update(
+        tz for tz in db.scalars(select(User.timezone).where(User.timezone.isnot(None)).distinct()) if tz
+    )
+    return {tz: convert_time_to_user_timezone(now_utc, tz).date() for tz in zones}
+
+def _zone_condition(zone: str):
+    """該時區底下的使用者；沒有使用者資料或未設定時區的一律視為預設時區"""
+    if zone == DEFAULT_TIMEZONE:
+        # line_user_id 可為 NULL：子查詢結果含 NULL 時 NOT IN 對任何資料列都不成立，預設時區就完全不會到期
+        other_zones = select(User.line_user_id).where(
+            User.line_user_id.isnot(None), User.timezone.isnot(None), User.timezone != DEFAULT_TIMEZONE
+        )
+        return Medication.user_id.notin_(other_zones)
+    return Medication.user_id.in_(select(User.line_user_id).where(User.timezone == zone))
+
+def _expire_batch(db: Session, ids: list) -> list:
+    """
+    將仍為進行中的藥物轉為已停藥，回傳實際轉換的 (id, user_id)：
+    選取之後可能已被其他請求改為已停藥，這些藥物不更新也不記錄。
+    SQLite 3.35 以上使用 RETURNING；較舊的版本則在同一個交易內先取出再更新。
+    """
+    still_active = [Medication.id.in_(ids), Medication.status == STATUS_ACTIVE]
+    stmt = (
+        update(Medication)
+        .values(status=STATUS_STOPPED, version=Medication.version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if getattr(db.bind.dialect, "update_returning", False):
+        return db.execute(stmt.where(*still_active).returning(Medication.id, Medication.user_id)).all()
+    changed = db.execute(select(Medication.id, Medication.user_id).where(*still_active)).all()
+    if changed:
+        db.execute(stmt.where(Medication.id.in_([row.id for row in changed])))
+    return changed
+
+def expire_medications(
+    db: Session,
+    now_utc: Optional[datetime] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dry_run: bool = False,
+) -> int:
+    """
+    將已過結束日期的藥物轉為已停藥，回傳轉換筆數。
+    now_utc 為 naive UTC 時間，預設為目前時間；dry_run 時只計算筆數不寫入。
+    """
+    now_utc = now_utc or datetime.utcnow()
+    total = 0
+
+    for zone, local_today in _local_dates(db, now_utc).items():
+        conditions = [
+            Medication.status == STATUS_ACTIVE,
+            Medication.end_date.isnot(None),
+            Medication.end_date < local_today,
+            _zone_condition(zone),
+        ]
+
+        if dry_run:
+            count = db.scalar(select(func.count(Medication.id)).where(*conditions))
+            if count:
+                logger.info(f"[dry-run] 時區 {zone} (當地日期 {local_today}) 有 {count} 筆藥物將到期")
+            total += count
+            continue
+
+        while True:
+            rows = db.execute(
+                select(Medication.id, Medication.user_id)
+                .where(*conditions)
+                .order_by(Medication.end_date)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+
+            changed = _expire_batch(db, [row.id for row in rows])
+            if not changed:
+                db.commit()
+                continue
+            db.execute(
+                insert(MedicationStatusLog),
+                [
+                    {
+                        "medication_id": row.id,
+                        "user_id": row.user_id,
+                        "from_status": STATUS_ACTIVE,
+                        "to_status": STATUS_STOPPED,
+                        "reason": EXPIRY_REASON,
+                        "changed_at": now_utc,
+                    }
+                    for row in changed
+                ],
+            )
+            # 其他 worker 的用藥清單快取會在下次輪詢時失效
+            mark_changed_sync(db, NS_MEDICATIONS, [row.user_id for row in changed])
+            db.commit()
+            total += len(changed)
+            logger.info(f"時區 {zone} (當地日期 {local_today}) 已將 {len(changed)} 筆到期藥物轉為{STATUS_STOPPED}")
+
+    return total
+
+def _sweep_shard(db: Session) -> int:
+    try:
+        return expire_medications(db)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"到期掃描失敗 (分片 {db.info.get('shard', 0)}): {e}", exc_info=True)
+        return 0
+
+def run_expiry_sweep():
+    """排程器使用的進入點：每個分片各自開啟資料庫連線並行掃描 (使用者與藥物在同一個分片)"""
+    expired = sum(fan_out(_sweep_shard))
+    if expired:
+        logger.info(f"到期掃描完成，共轉換 {expired} 筆藥物。")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="將結束日期已過的藥物轉為已停藥")
+    parser.add_argument("--now", type=datetime.fromisoformat, default=None,
+                        help="以此 UTC 時間作為目前時間 (ISO 格式)，預設為現在")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每批更新筆數")
+    parser.add_argument("--dry-run", action="store_true", help="只計算筆數，不寫入資料庫")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    init_db()
+    total = sum(fan_out(
+        lambda db: expire_medications(db, now_utc=args.now, batch_size=args.batch_size, dry_run=args.dry_run)
+    ))
+    print(f"{'預計' if args.dry_run else '已'}轉換 {total} 筆藥物")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+# app/services/metrics.py
+"""
+Prometheus 文字格式的指標 (不依賴 prometheus_client)。
+
+- Counter / Histogram / Gauge 都註冊在全域的 registry，由 GET /metrics 輸出 (見 main.py)。
+- 記錄時不取鎖：每個執行緒寫入自己的分片 (shard)，只有執行緒第一次記錄時才取鎖登記分片；
+  輸出時再把各分片加總。事件迴圈與執行緒池互不干擾，熱路徑只多一次 dict 查詢與加法。
+- 無法在記錄當下取得的數值 (佇列長度、執行緒池使用量等) 以回呼 (callback) 在輸出時讀取。
+- 標籤值必須是有限的集合 (路由樣板而非實際路徑、job 種類而非 job id)，避免序列數量無限增長。
+"""
+
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelValues = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._shards_lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self) -> Iterable[dict]:
+        # dict.copy() 在持有 GIL 時一次完成，不會遇到其他執行緒同時寫入造成的迭代錯誤
+        for shard in list(self._shards):
+            yield shard.copy()
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def render(self) -> List[str]:
+        raise NotImplementedError
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def totals(self) -> Dict[LabelValues, float]:
+        totals: Dict[LabelValues, float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in sorted(self.totals().items())
+        ]
+
+class Gauge(Counter):
+    """可增減的數值；以 callback 建立時，輸出時呼叫 callback() 取得 {標籤值 tuple: 數值}"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def dec(self, *labelvalues: str, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def totals(self) -> Dict[LabelValues, float]:
+        if self.callback is not None:
+            return self.callback()
+        return super().totals()
+
+class CallbackCounter(Gauge):
+    """數值由其他元件自行累計的計數器 (例如隔艙的拒絕次數)，輸出時以 callback 讀取"""
+    type_name = "counter"
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues: str):
+        shard = self._shard()
+        entry = shard.get(labelvalues)
+        if entry is None:
+            # 每個 bucket 的個數 (非累計) + 最後一格 +Inf，以及總和
+            entry = shard[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self) -> List[str]:
+        merged: Dict[LabelValues, list] = {}
+        for shard in self._snapshots():
+            for labels, (counts, total) in shard.items():
+                target = merged.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+                for i, count in enumerate(list(counts)):
+                    target[0][i] += count
+                target[1] += total
+
+        lines = []
+        for labels, (counts, total) in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"指標 {metric.name} 已註冊")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def callback_counter(self, name: str, documentation: str, labelnames: Sequence[str], callback) -> CallbackCounter:
+        return self.register(CallbackCounter(name, documentation, labelnames, callback))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                body = metric.render()
+            except Exception as e:  # 單一 callback 失敗不影響其他指標
+                lines.append(f"# {metric.name} 讀取失敗: {e!r}")
+                continue
+            lines.extend(metric.header())
+            lines.extend(body)
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _threadpool_usage() -> Dict[LabelValues, float]:
+    """FastAPI 執行同步路由與依賴項的 AnyIO 預設執行緒池 (必須在事件迴圈中呼叫)"""
+    import anyio.to_thread
+
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    return {("busy",): limiter.borrowed_tokens, ("limit",): limiter.total_tokens}
+
+registry.gauge(
+    "medimgmt_threadpool_threads", "AnyIO 預設執行緒池的使用中執行緒數 (busy) 與上限 (limit)",
+    ["state"], callback=_threadpool_usage,
+)
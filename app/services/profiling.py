@@ -0,0 +1,419 @@
+# app/services/profiling.py
+"""
+單一請求的取樣剖析 (選用)，用來找出某個慢請求的時間花在哪裡。
+
+觸發方式 (兩者皆未設定時不安裝中介軟體，也不會啟動取樣執行緒，對請求沒有任何額外負擔)：
+- 請求帶有 X-Profile-Token: <token>：剖析該請求，回應加上 X-Profile-Id。
+- sample_rate > 0：依比例隨機剖析請求 (不加回應標頭)。
+同時進行的剖析超過 max_concurrent 時略過，單一剖析最多取樣 max_seconds。
+
+取樣方式 (只用標準函式庫)：背景執行緒每 interval_ms 取樣一次請求的「邏輯堆疊」，
+等待中的時間也會被取樣 (wall-clock)，而不只是佔用 CPU 的時間：
+- 請求的 task 正在事件迴圈中執行：取事件迴圈執行緒目前的堆疊。
+- task 正在 await：沿著 coroutine 的 cr_await 串列取出等待中的堆疊；
+  再接上請求建立的子 task (follow()，例如共用的交互作用分析)，
+  或請求交給執行緒池的工作 (bind_thread()，例如 AI 隔艙中的 Gemini 呼叫) 在該執行緒的堆疊。
+同步路由 (def) 在 FastAPI 共用執行緒池中的工作無法對應到請求，只會看到等待執行緒池的堆疊。
+
+每個樣本依堆疊中的函式歸類 (見 _RULES)：gemini (Gemini I/O)、prompt (組提示詞)、db (SQLAlchemy /
+aiosqlite)、serialization (回應序列化與驗證)、queue (等待隔艙空位)、other。
+
+結果存於 output_dir (保留最新的 max_profiles 筆)：
+- <id>.folded  collapsed stack 格式 ("frame;frame;frame 次數")，可直接交給 flamegraph.pl、
+               speedscope 或 inferno 產生火焰圖
+- <id>.json    請求摘要與各類別的時間分配 (依樣本比例分攤請求的總時間)
+以 GET /api/system/profiles (需要 X-Profile-Token) 列出與下載。
+
+config.ini 範例：
+    [PROFILING]
+    token = change-me
+    sample_rate = 0
+    interval_ms = 5
+    max_seconds = 60
+    max_concurrent = 2
+    output_dir = ./profiles
+    max_profiles = 200
+"""
+
+import asyncio
+import contextvars
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import partial
+from typing import Dict, List, Optional
+
+from app.services.metrics import registry
+from app.utils.config import ProfilingSettings, get_settings
+
+logger = logging.getLogger(__name__)
+
+_settings = get_settings().profiling
+
+CATEGORIES = ("gemini", "prompt", "db", "serialization", "queue", "other")
+
+# (類別, 檔案路徑片段, 函式名稱或 None)：依序比對，堆疊中任一函式符合即歸入該類別
+_RULES = (
+    ("gemini", "app/services/germini_service.py", None),
+    ("prompt", "app/services/prompts.py", None),
+    ("db", "sqlalchemy/", None),
+    ("db", "aiosqlite/", None),
+    ("db", "sqlite3/", None),
+    ("serialization", "fastapi/routing.py", "serialize_response"),
+    ("serialization", "fastapi/encoders.py", None),
+    ("serialization", "fastapi/responses.py", None),
+    ("serialization", "starlette/responses.py", None),
+    ("serialization", "pydantic/", None),
+    ("serialization", "app/services/cache.py", "dumps"),
+    ("queue", "app/services/bulkhead.py", "_reserve"),
+    # 已取得 AI 隔艙空位、但執行 Gemini 呼叫的執行緒不屬於此請求 (共用其他請求的分析)
+    ("gemini", "app/services/bulkhead.py", "run_callable"),
+)
+
+# 框名稱中的檔案路徑去掉這些前綴 (專案根目錄、標準函式庫)，第三方套件則由 site-packages 之後開始
+_PREFIXES = tuple(
+    path.replace(os.sep, "/").rstrip("/") + "/"
+    for path in (os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                 sysconfig.get_paths()["stdlib"])
+)
+# 讀取剖析結果的管理端點也帶有 X-Profile-Token，不剖析這些請求
+_ADMIN_PATH = "/api/system/profiles"
+_PROFILE_ID = re.compile(r"^\d{14}-[0-9a-f]{8}$")
+
+profiles_taken = registry.counter("medimgmt_profiles_total", "已完成的請求剖析", ["trigger"])
+profiles_skipped = registry.counter("medimgmt_profiles_skipped_total", "同時進行的剖析已達上限而略過的請求")
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_profile", default=None)
+
+def enabled(settings: Optional[ProfilingSettings] = None) -> bool:
+    settings = settings or _settings
+    return bool(settings.token) or settings.sample_rate > 0
+
+def authorized(token: Optional[str], settings: Optional[ProfilingSettings] = None) -> bool:
+    """X-Profile-Token 是否正確 (未設定 token 時一律拒絕)"""
+    settings = settings or _settings
+    if not settings.token or not token:
+        return False
+    return hmac.compare_digest(token.encode("utf-8"), settings.token.encode("utf-8"))
+
+# --- 堆疊 ---
+
+_code_info: Dict[object, tuple] = {}
+
+def _describe(code) -> tuple:
+    """(火焰圖的框名稱, 類別規則的順位)，以 code 物件快取"""
+    info = _code_info.get(code)
+    if info is None:
+        filename = code.co_filename.replace(os.sep, "/")
+        for marker in ("site-packages/", "dist-packages/"):
+            if marker in filename:
+                filename = filename.split(marker, 1)[1]
+                break
+        else:
+            prefix = next((p for p in _PREFIXES if filename.startswith(p)), None)
+            filename = filename[len(prefix):] if prefix else os.path.basename(filename)
+        name = getattr(code, "co_qualname", code.co_name)
+        rank = next(
+            (i for i, (_, path, func) in enumerate(_RULES)
+             if path in filename and (func is None or code.co_name == func)),
+            len(_RULES),
+        )
+        info = _code_info[code] = (f"{name} ({filename}:{code.co_firstlineno})".replace(";", ","), rank)
+    return info
+
+def _thread_frames(frame) -> list:
+    """執行緒的堆疊，由外而內"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+def _await_chain(coro) -> list:
+    """沿著 cr_await / gi_yieldfrom 取出 coroutine 等待中的堆疊，由外而內"""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return frames
+
+def _after(frames: list, code) -> list:
+    """只保留 code 的框之內的部分 (找不到時原樣回傳)"""
+    for i, frame in enumerate(frames):
+        if frame.f_code is code:
+            return frames[i + 1:]
+    return frames
+
+def _run_claimed(profile: "RequestProfile", func, *args, **kwargs):
+    ident = threading.get_ident()
+    profile.threads[ident] = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profile.threads.pop(ident, None)
+
+def bind_thread(func):
+    """
+    要交給執行緒池的函式：在剖析中的請求內時，讓取樣器把執行該函式的執行緒算入此請求。
+    未在剖析時原樣回傳 (只多一次 contextvar 讀取)。
+    """
+    profile = _current.get()
+    if profile is None:
+        return func
+    return partial(_run_claimed, profile, func)
+
+def follow(task: asyncio.Task):
+    """請求等待的子 task (例如以 asyncio.shield 共用的分析)：請求 await 時接著取樣子 task 的堆疊"""
+    profile = _current.get()
+    if profile is not None:
+        profile.children.append(task)
+
+class RequestProfile:
+    def __init__(self, scope, trigger: str, max_seconds: float):
+        self.id = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.trigger = trigger
+        self.max_seconds = max_seconds
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.status = None
+        self.route = None
+        self.loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.loop_thread = threading.get_ident()
+        self.children: List[asyncio.Task] = []
+        self.threads: Dict[int, bool] = {}
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+        self.samples = 0
+        self.truncated = False
+
+    def _task_frames(self, task: asyncio.Task, frames: dict, depth: int = 0) -> list:
+        chain = _await_chain(task.get_coro())
+        if asyncio.current_task(self.loop) is task:
+            running = _thread_frames(frames.get(self.loop_thread))
+            if chain and chain[0] in running:
+                return running[running.index(chain[0]):]
+            # 在 greenlet 中 (SQLAlchemy 的非同步 session)：執行緒堆疊不含外層的 coroutine
+            return chain + running
+        children = [child for child in self.children if child is not task and not child.done()]
+        if children and depth < 4:
+            return chain + self._task_frames(children[-1], frames, depth + 1)
+        for ident in list(self.threads):
+            if ident in frames:
+                return chain + _after(_thread_frames(frames[ident]), _run_claimed.__code__)
+        return chain
+
+    def sample(self, frames: dict):
+        if time.perf_counter() - self.started > self.max_seconds:
+            self.truncated = True
+            return
+        stack = _after(self._task_frames(self.task, frames), ProfilingMiddleware.__call__.__code__)
+        if not stack:
+            return
+        described = [_describe(frame.f_code) for frame in stack]
+        rank = min(r for _, r in described)
+        self.categories[_RULES[rank][0] if rank < len(_RULES) else "other"] += 1
+        self.stacks[";".join([f"{self.method} {self.path}"] + [label for label, _ in described])] += 1
+        self.samples += 1
+
+    def finish(self, scope):
+        self.duration = time.perf_counter() - self.started
+        route = scope.get("route")
+        self.route = getattr(route, "path", None)
+
+    def summary(self, interval_ms: float) -> dict:
+        total = sum(self.categories.values())
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "trigger": self.trigger,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 2),
+            "interval_ms": interval_ms,
+            "samples": self.samples,
+            "truncated": self.truncated,
+            # 依樣本比例分攤請求的總時間
+            "categories": {
+                name: {
+                    "samples": self.categories[name],
+                    "share": round(self.categories[name] / total, 4) if total else 0.0,
+                    "ms": round(self.duration * 1000 * self.categories[name] / total, 2) if total else 0.0,
+                }
+                for name in CATEGORIES
+            },
+        }
+
+class Sampler:
+    """有剖析進行中時才存在的背景取樣執行緒"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._profiles = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def active(self) -> int:
+        return len(self._profiles)
+
+    def add(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: RequestProfile):
+        with self._lock:
+            self._profiles.discard(profile)
+
+    def _run(self):
+        deadline = time.perf_counter()
+        while True:
+            with self._lock:
+                if not self._profiles:
+                    self._thread = None
+                    return
+                profiles = list(self._profiles)
+            frames = sys._current_frames()
+            for profile in profiles:
+                try:
+                    profile.sample(frames)
+                except Exception:
+                    # 事件迴圈同時在改變 coroutine 的狀態，偶爾取到不一致的堆疊，略過這個樣本
+                    logger.debug("剖析取樣失敗", exc_info=True)
+            del frames
+            deadline += self.interval
+            time.sleep(max(0.0, deadline - time.perf_counter()))
+
+class ProfileStore:
+    def __init__(self, directory: str, max_profiles: int):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def _path(self, profile_id: str, ext: str) -> Optional[str]:
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        return os.path.join(self.directory, f"{profile_id}{ext}")
+
+    def save(self, profile: RequestProfile, interval_ms: float):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self._path(profile.id, ".folded"), "w", encoding="utf-8") as f:
+            for stack, count in sorted(profile.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        # 摘要最後寫入：list() 只列出有摘要的剖析
+        with open(self._path(profile.id, ".json"), "w", encoding="utf-8") as f:
+            json.dump(profile.summary(interval_ms), f, ensure_ascii=False, indent=2)
+        self.prune()
+
+    def _ids(self) -> List[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith(".json") and _PROFILE_ID.match(name[:-5]))
+
+    def prune(self):
+        ids = self._ids()
+        for profile_id in ids[:max(0, len(ids) - self.max_profiles)]:
+            for ext in (".json", ".folded"):
+                try:
+                    os.remove(self._path(profile_id, ext))
+                except FileNotFoundError:
+                    pass
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        path = self._path(profile_id, ".json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (TypeError, FileNotFoundError, ValueError):
+            return None
+
+    def list(self, limit: int = 50) -> List[dict]:
+        """最新的剖析摘要在前"""
+        summaries = (self.get(profile_id) for profile_id in reversed(self._ids()))
+        return [s for s in summaries if s is not None][:limit]
+
+    def folded_path(self, profile_id: str) -> Optional[str]:
+        path = self._path(profile_id, ".folded")
+        return path if path and os.path.exists(path) else None
+
+profile_store = ProfileStore(_settings.output_dir, _settings.max_profiles)
+
+class ProfilingMiddleware:
+    """純 ASGI 中介軟體，放在最外層 (見 main.py，只在 enabled() 時加入)"""
+
+    def __init__(self, app, settings: Optional[ProfilingSettings] = None):
+        self.app = app
+        self.settings = settings or _settings
+        self.sampler = Sampler(self.settings.interval_ms / 1000)
+
+    def _trigger(self, scope) -> Optional[str]:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-profile-token":
+                if authorized(value.decode("latin-1"), self.settings):
+                    return "header"
+                break
+        if self.settings.sample_rate > 0 and random.random() < self.settings.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(_ADMIN_PATH):
+            return await self.app(scope, receive, send)
+        trigger = self._trigger(scope)
+        if trigger is None:
+            return await self.app(scope, receive, send)
+        if self.sampler.active >= self.settings.max_concurrent:
+            profiles_skipped.inc()
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile(scope, trigger, self.settings.max_seconds)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                if trigger == "header":
+                    message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile.id.encode())]
+            await send(message)
+
+        token = _current.set(profile)
+        self.sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.sampler.remove(profile)
+            _current.reset(token)
+            profile.finish(scope)
+            profiles_taken.inc(trigger)
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, profile_store.save, profile, self.settings.interval_ms
+                )
+            except OSError:
+                logger.exception(f"無法寫入剖析結果 {profile.id}")
+            else:
+                logger.info(
+                    f"已剖析 {profile.method} {profile.path} ({profile.duration * 1000:.1f} ms, "
+                    f"{profile.samples} 個樣本)：{profile.id}"
+                )
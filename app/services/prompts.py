@@ -0,0 +1,391 @@
+# app/services/prompts.py
+"""
+Gemini 提示詞範本 (版本化) 與 token 用量控管。
+
+- 每個端點 (analysis = 交互作用分析、prescription = 藥單辨識) 有多個版本的範本，以 config.ini 選擇：
+    v1  原本的完整提示詞 (全部放在一段使用者訊息中)
+    v2  精簡版：固定的指示放在 system_instruction，每次請求只送出使用者的資料；
+        藥單辨識改以 response_schema 規定輸出結構，提示詞不再逐一描述欄位格式。
+  固定的前綴每次請求位元組完全相同，可利用 Gemini 的前綴快取 (implicit caching 有最小長度限制)。
+- 呼叫前估計輸入 token (CJK 字元約 1 token、其他約 4 字元 1 token、圖片 258 token)，
+  超過端點的 max_input_tokens 時記錄警告與指標 (不拒絕使用者的請求)；max_output_tokens > 0 時
+  以 generationConfig.maxOutputTokens 限制輸出。
+- 呼叫後以 usageMetadata 記錄實際用量，估計值與實際值都依 (endpoint, version) 記錄在
+  medimgmt_prompt_tokens 中，可比較不同版本的成本。
+- 分析結果快取的指紋包含範本版本，切換版本後會重新分析一次。
+- 範本的 A/B 比較：python -m bench.prompt_ab
+
+config.ini 範例：
+    [PROMPTS]
+    analysis_version = v2
+    prescription_version = v2
+    analysis_max_input_tokens = 1500
+    prescription_max_input_tokens = 1200
+    analysis_max_output_tokens = 0
+    prescription_max_output_tokens = 0
+"""
+
+import hashlib
+import logging
+import math
+import re
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence
+
+from app.services.metrics import registry
+from app.utils.config import SettingsError, get_settings
+
+if TYPE_CHECKING:
+    from app.models.medication import Medication
+    from app.models.user_profile import UserProfile
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS = "analysis"
+PRESCRIPTION = "prescription"
+# Gemini 對一張圖片 (384px 以內) 計 258 token
+IMAGE_TOKENS = 258
+
+prompt_tokens = registry.histogram(
+    "medimgmt_prompt_tokens", "每次呼叫的輸入 token (estimated = 呼叫前估計，actual = usageMetadata)",
+    ["endpoint", "version", "source"],
+    buckets=(100, 200, 400, 800, 1200, 1600, 2400, 3200, 6400),
+)
+budget_exceeded = registry.counter(
+    "medimgmt_prompt_budget_exceeded_total", "估計輸入 token 超過端點預算的次數", ["endpoint"]
+)
+
+_CJK = re.compile(r"[⺀-鿿豈-﫿＀-￯\U00020000-\U0002fa1f]")
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """粗略估計 token 數 (沒有離線的 tokenizer；誤差可由 estimated / actual 指標觀察)"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+@lru_cache(maxsize=32)
+def _estimate_static(text: str) -> int:
+    """固定的系統指示只估計一次"""
+    return estimate_tokens(text)
+
+@dataclass(frozen=True)
+class RenderedPrompt:
+    endpoint: str
+    version: str
+    text: str                          # 每次請求不同的內容 (使用者資料)
+    system: Optional[str] = None       # 固定的指示 (可重用的前綴)
+    generation_config: Dict = field(default_factory=dict)
+    image_tokens: int = 0
+
+    @property
+    def estimated_tokens(self) -> int:
+        return (_estimate_static(self.system) if self.system else 0) + estimate_tokens(self.text) + self.image_tokens
+
+    def fingerprint(self) -> str:
+        """分析結果快取的指紋：範本版本 + 送出的內容"""
+        raw = "\0".join((self.endpoint, self.version, self.system or "", self.text))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def request_body(self, extra_parts: tuple = ()) -> dict:
+        body = {"contents": [{"role": "user", "parts": [{"text": self.text}, *extra_parts]}]}
+        if self.system:
+            body["system_instruction"] = {"parts": [{"text": self.system}]}
+        if self.generation_config:
+            body["generationConfig"] = dict(self.generation_config)
+        return body
+
+def check_budget(rendered: RenderedPrompt) -> int:
+    """呼叫前：記錄估計的輸入 token，超過預算時警告；回傳估計值"""
+    estimated = rendered.estimated_tokens
+    prompt_tokens.observe(estimated, rendered.endpoint, rendered.version, "estimated")
+    limit = _budgets().get(rendered.endpoint, (0, 0))[0]
+    if limit and estimated > limit:
+        budget_exceeded.inc(rendered.endpoint)
+        logger.warning(f"{rendered.endpoint} 提示詞 ({rendered.version}) 估計 {estimated} token，超過預算 {limit}")
+    return estimated
+
+def record_usage(rendered: RenderedPrompt, response) -> Optional[int]:
+    """呼叫後：記錄 usageMetadata 回報的輸入 token；回傳實際值 (沒有回報時為 None)"""
+    usage = response.get("usageMetadata") if isinstance(response, dict) else None
+    actual = usage.get("promptTokenCount") if isinstance(usage, dict) else None
+    if isinstance(actual, int):
+        prompt_tokens.observe(actual, rendered.endpoint, rendered.version, "actual")
+        return actual
+    return None
+
+def _generation_config(endpoint: str, **config) -> dict:
+    max_output = _budgets().get(endpoint, (0, 0))[1]
+    if max_output:
+        config["maxOutputTokens"] = max_output
+    return config
+
+# --- 共用的資料整理 ---
+
+# user_profiles 欄位 -> 顯示名稱，依分類排列
+PROFILE_GROUPS = (
+    ("飲食習慣", "飲食", (
+        ("diet_alcohol", "酒精"), ("diet_caffeine", "咖啡因"), ("diet_grapefruit", "葡萄柚"),
+        ("diet_milk", "牛奶/乳製品"), ("diet_high_fat", "高脂餐"), ("diet_high_vitamin_k", "高維他命K食物"),
+        ("diet_tyramine", "含酪胺食物"),
+    )),
+    ("保健食品/中藥", "保健食品", (
+        ("supp_st_johns_wort", "聖約翰草"), ("supp_ginkgo", "銀杏"), ("supp_ginseng", "人蔘"),
+        ("supp_garlic", "大蒜"), ("supp_grape_seed", "葡萄籽"), ("supp_fish_oil", "魚油"),
+        ("supp_omega3", "Omega-3"), ("supp_licorice", "甘草"), ("supp_red_yeast_rice", "紅麴"),
+    )),
+    ("個人病史", "病史", (
+        ("history_asthma", "氣喘"), ("history_diabetes", "糖尿病"), ("history_hypertension", "高血壓"),
+        ("history_liver_dysfunction", "肝功能不全"), ("history_kidney_dysfunction", "腎功能不全"),
+        ("history_gastric_ulcer", "胃潰瘍"), ("history_epilepsy", "癲癇"), ("history_arrhythmia", "心律不整"),
+    )),
+    ("特殊生理狀況", "生理狀況", (
+        ("condition_pregnancy", "懷孕"), ("condition_breastfeeding", "哺乳"), ("condition_infant", "嬰幼兒"),
+        ("condition_elderly", "老年人"), ("condition_obesity", "肥胖"),
+    )),
+)
+PROFILE_LABELS = {column: label for _, _, items in PROFILE_GROUPS for column, label in items}
+
+def _profile_groups(user_profile) -> List[tuple]:
+    """[(完整分類名稱, 精簡分類名稱, [項目...])]，只包含有勾選的分類"""
+    if not user_profile:
+        return []
+    groups = []
+    for title, short_title, items in PROFILE_GROUPS:
+        selected = [label for column, label in items if getattr(user_profile, column, False)]
+        if selected:
+            groups.append((title, short_title, selected))
+    return groups
+
+# --- 交互作用分析 ---
+
+def build_analysis_prompt(medications: List["Medication"], user_profile: Optional["UserProfile"]) -> str:
+    """构建详细的药物交互作用分析提示词 (v1)"""
+    
+    # 构建药物清单
+    med_list = []
+    for med in medications:
+        med_info = f"• {med.name}"
+        if med.dose:
+            med_info += f" ({med.dose})"
+        if med.frequency:
+            med_info += f" - {med.frequency}"
+        if med.effect:
+            med_info += f" [作用: {med.effect}]"
+        med_list.append(med_info)
+    
+    medications_text = "\n".join(med_list)
+    
+    # 构建个人资料信息
+    profile_info = [f"{title}: {', '.join(items)}" for title, _, items in _profile_groups(user_profile)]
+    profile_text = "\n".join(profile_info) if profile_info else "未提供個人健康資料"
+    
+    # 构建完整提示词
+    prompt = f"""
+你是一位專業的臨床藥師，請針對以下用藥組合進行詳細的交互作用分析：
+
+**目前服用藥物：**
+{medications_text}
+
+**個人健康資料：**
+{profile_text}
+
+**分析要求：**
+1. 檢查藥物之間是否存在交互作用
+2. 分析藥物與飲食/保健食品的交互作用
+3. 根據個人病史評估用藥風險
+4. 考慮特殊生理狀況對用藥的影響
+5. 提供具體的用藥建議和注意事項
+
+**回覆格式：**
+請以條列方式，用繁體中文回覆，包含以下內容：
+
+### 🔍 分析結果
+
+### ⚠️ 發現的交互作用
+（如有發現）
+
+### 💊 用藥建議
+（具體建議）
+
+### 📋 注意事項
+（重要提醒）
+
+### 🏥 就醫建議
+（何時需要諮詢醫師）
+
+請提供專業、實用的分析，但避免過度驚嚇患者。
+"""
+    
+    return prompt
+
+# 分析結果的段落標題 (前端依此顯示；各版本的範本都必須要求這些標題)
+ANALYSIS_HEADINGS = ("🔍 分析結果", "⚠️ 發現的交互作用", "💊 用藥建議", "📋 注意事項", "🏥 就醫建議")
+
+ANALYSIS_SYSTEM_V2 = (
+    "你是臨床藥師。依使用者的用藥與個人健康資料，分析藥物之間、藥物與飲食/保健食品的交互作用，"
+    "並依病史與特殊生理狀況評估風險。\n"
+    "以繁體中文條列回覆，依序使用以下標題 (沒有內容時寫「無」)：\n"
+    + "\n".join(f"### {heading}" for heading in ANALYSIS_HEADINGS)
+    + "\n內容專業、實用，避免過度驚嚇患者。"
+)
+
+def _medication_line_v2(med) -> str:
+    # 欄位位置固定，缺少的欄位留空
+    return "- " + "｜".join(str(v or "") for v in (med.name, med.dose, med.frequency, med.effect)).rstrip("｜")
+
+def _analysis_v1(medications, user_profile) -> RenderedPrompt:
+    return RenderedPrompt(ANALYSIS, "v1", build_analysis_prompt(medications, user_profile),
+                          generation_config=_generation_config(ANALYSIS))
+
+def _analysis_v2(medications, user_profile) -> RenderedPrompt:
+    groups = _profile_groups(user_profile)
+    profile = "；".join(f"{short}：{'、'.join(items)}" for _, short, items in groups) or "未提供"
+    text = "藥物 (名稱｜劑量｜頻率｜作用)：\n" + "\n".join(_medication_line_v2(m) for m in medications)
+    text += f"\n個人資料：{profile}"
+    return RenderedPrompt(ANALYSIS, "v2", text, system=ANALYSIS_SYSTEM_V2,
+                          generation_config=_generation_config(ANALYSIS))
+
+# --- 藥單辨識 ---
+
+def create_prescription_prompt(user_timezone: str, current_date: str) -> str:
+    """
+    生成用於藥單辨識的、詳細的 Gemini 提示詞 (v1)。
+    【已修正】使用 {{ 和 }} 來轉義 JSON 範例中的大括號，以避免 f-string 格式錯誤。
+    """
+    return f"""
+    你是一位專業且細心的智慧藥劑師助理。你的任務是分析使用者上傳的處方箋或藥袋圖片，並以純粹的 JSON 格式回傳結構化的藥物資訊。
+
+    # 任務要求：
+    1.  **辨識所有藥物**：從圖片中找出所有獨立的藥物項目。
+    2.  **提取關鍵資訊**：對於每一種藥物，提取以下資訊：
+        - `name` (藥物名稱): 完整的藥物商品名或學名。
+        - `dose` (劑量): 每次服用的劑量，例如 "1顆" 或 "10mg"。
+        - `frequency` (服藥頻率): 服用的頻率。請將常見的醫療縮寫轉換為使用者易於理解的中文，對照如下：
+            - QD (每日一次) -> "每日一次"
+            - BID (每日兩次) -> "每日二次"
+            - TID (每日三次) -> "每日三次"
+            - QID (每日四次) -> "每日四次"
+            - QOD (每隔一日) -> "每隔一日"
+            - HS (睡前) -> "睡前"
+            - PC (飯後) -> 在頻率後補充 "(飯後)"
+            - AC (飯前) -> 在頻率後補充 "(飯前)"
+    3.  **補充關聯資訊 (AI 推斷)**：
+        - `effect` (藥物作用): 根據藥物名稱，從你的知識庫中找出最主要、最常見的作用。內容需簡潔有力，長度約 3-7 個字，例如 "降血壓"、"抗生素"、"止痛藥"。
+        - `remind_times` (建議提醒時間): 根據 `frequency` (服藥頻率) 和常規作息，推斷出建議的提醒時間。格式必須是 JSON 物件陣列 `[{{\"hour\": H, \"minute\": M}}]`。範例如下：
+            - "每日一次": `[{{\"hour\": 9, \"minute\": 0}}]`
+            - "每日二次": `[{{\"hour\": 9, \"minute\": 0}}, {{\"hour\": 21, \"minute\": 0}}]`
+            - "每日三次": `[{{\"hour\": 9, \"minute\": 0}}, {{\"hour\": 14, \"minute\": 0}}, {{\"hour\": 19, \"minute\": 0}}]`
+            - "睡前": `[{{\"hour\": 22, \"minute\": 0}}]`
+        - `start_date` (開始日期): 預設為今天的日期: `{current_date}`。
+        - `end_date` (結束日期): 如果圖片中有明確的「天數」或「總量/用法」可推算出結束日期，請計算並填入。如果無法推算，則留空字串 `""`。
+
+    # 輸出格式限制 (極度重要)：
+    - **必須回傳純粹的 JSON 物件**，不要包含任何 `json` 標籤、註解或任何非 JSON 的文字。
+    - JSON 的根物件必須包含一個名為 `medications` 的鍵，其值為一個陣列 (array)。
+    - 陣列中的每個元素都是一個代表單一藥物的物件，包含 `name`, `effect`, `dose`, `frequency`, `remind_times`, `start_date`, `end_date` 這些鍵。
+    - 如果圖片中沒有辨識到任何藥物，或圖片無關，請回傳 `{{\"medications\": []}}`。
+    - 如果某個欄位的資訊在圖片上不存在或無法辨識，請在 JSON 中使用空字串 `""` (對於字串類型) 或空陣列 `[]` (對於 `remind_times`) 作為其值。
+
+    # 使用者資訊：
+    - 使用者目前時區: `{user_timezone}`
+    - 今天日期: `{current_date}`
+    """
+
+PRESCRIPTION_SYSTEM_V2 = """你是藥劑師助理。辨識處方箋或藥袋圖片中的每一種藥物，依回應結構輸出 JSON。
+- name：商品名或學名；dose：每次劑量，例如「1顆」「10mg」
+- frequency：縮寫轉為中文：QD 每日一次、BID 每日二次、TID 每日三次、QID 每日四次、QOD 每隔一日、HS 睡前；PC、AC 在後面加「(飯後)」「(飯前)」
+- effect：最主要的作用，3-7 字，例如「降血壓」
+- remind_times：依頻率建議提醒時間：每日一次 9:00；每日二次 9:00、21:00；每日三次 9:00、14:00、19:00；睡前 22:00
+- start_date：今天；end_date：可由天數或總量推算時填 YYYY-MM-DD，否則空字串
+- 無法辨識的欄位用空字串或空陣列；沒有藥物或圖片無關時 medications 為空陣列"""
+
+# 藥單辨識每筆藥物必須包含的欄位
+PRESCRIPTION_FIELDS = ("name", "effect", "dose", "frequency", "remind_times", "start_date", "end_date")
+
+_STRING = {"type": "STRING"}
+PRESCRIPTION_SCHEMA_V2 = {
+    "type": "OBJECT",
+    "properties": {
+        "medications": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "name": _STRING, "effect": _STRING, "dose": _STRING, "frequency": _STRING,
+                    "remind_times": {
+                        "type": "ARRAY",
+                        "items": {
+                            "type": "OBJECT",
+                            "properties": {"hour": {"type": "INTEGER"}, "minute": {"type": "INTEGER"}},
+                            "required": ["hour", "minute"],
+                        },
+                    },
+                    "start_date": _STRING, "end_date": _STRING,
+                },
+                "required": list(PRESCRIPTION_FIELDS),
+            },
+        },
+    },
+    "required": ["medications"],
+}
+
+def _prescription_v1(user_timezone: str, current_date: str) -> RenderedPrompt:
+    return RenderedPrompt(
+        PRESCRIPTION, "v1", create_prescription_prompt(user_timezone, current_date),
+        generation_config=_generation_config(PRESCRIPTION, response_mime_type="application/json"),
+        image_tokens=IMAGE_TOKENS,
+    )
+
+def _prescription_v2(user_timezone: str, current_date: str) -> RenderedPrompt:
+    return RenderedPrompt(
+        PRESCRIPTION, "v2", f"使用者時區：{user_timezone}\n今天：{current_date}",
+        system=PRESCRIPTION_SYSTEM_V2,
+        generation_config=_generation_config(
+            PRESCRIPTION, response_mime_type="application/json", response_schema=PRESCRIPTION_SCHEMA_V2,
+        ),
+        image_tokens=IMAGE_TOKENS,
+    )
+
+# --- 版本選擇 ---
+
+TEMPLATES: Dict[str, Dict[str, Callable[..., RenderedPrompt]]] = {
+    ANALYSIS: {"v1": _analysis_v1, "v2": _analysis_v2},
+    PRESCRIPTION: {"v1": _prescription_v1, "v2": _prescription_v2},
+}
+
+def _template(endpoint: str, version: Optional[str]) -> Callable[..., RenderedPrompt]:
+    version = version or _versions()[endpoint]
+    try:
+        return TEMPLATES[endpoint][version]
+    except KeyError:
+        raise ValueError(f"{endpoint} 沒有 {version!r} 版本的提示詞範本")
+
+def render_analysis(medications, user_profile, version: Optional[str] = None,
+                    known_interactions: Sequence[str] = ()) -> RenderedPrompt:
+    """known_interactions：知識庫查到的交互作用 (見 alert_logic.check_drug_interactions)，附在使用者資料之後"""
+    rendered = _template(ANALYSIS, version)(medications, user_profile)
+    if known_interactions:
+        known = "\n".join(f"- {warning}" for warning in known_interactions)
+        rendered = replace(rendered, text=f"{rendered.text}\n資料庫中的已知交互作用 (請納入分析)：\n{known}")
+    return rendered
+
+def render_prescription(user_timezone: str, current_date: str, version: Optional[str] = None) -> RenderedPrompt:
+    return _template(PRESCRIPTION, version)(user_timezone, current_date)
+
+def _versions() -> Dict[str, str]:
+    settings = get_settings().prompts
+    return {ANALYSIS: settings.analysis_version, PRESCRIPTION: settings.prescription_version}
+
+def _budgets() -> Dict[str, tuple]:
+    """endpoint -> (max_input_tokens, max_output_tokens)，0 表示不限制"""
+    settings = get_settings().prompts
+    return {
+        ANALYSIS: (settings.analysis_max_input_tokens, settings.analysis_max_output_tokens),
+        PRESCRIPTION: (settings.prescription_max_input_tokens, settings.prescription_max_output_tokens),
+    }
+
+for _endpoint, _version in _versions().items():
+    if _version not in TEMPLATES[_endpoint]:
+        raise SettingsError(f"PROMPTS.{_endpoint}_version 只能是 {', '.join(TEMPLATES[_endpoint])}，收到 {_version!r}")
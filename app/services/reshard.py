@@ -0,0 +1,220 @@
+# app/services/reshard.py
+"""
+增加資料分片數 (見 app/db/sharding.py)；既有的單一 med.db 也以此轉為多個分片 (由 1 增為 N)。
+
+執行前請先停止所有 worker (仍有未過期的排程租約時拒絕執行，確定沒有 worker 時可用 --force 略過)：
+    python -m app.services.reshard                    # 目前各分片的使用者數
+    python -m app.services.reshard --to 4 --dry-run   # 預計搬移的使用者數
+    python -m app.services.reshard --to 4
+完成後將 [DATABASE] shards 改為 4 再啟動。
+
+- jump consistent hash 在分片數增加時，使用者只會由舊分片搬到新增的分片，舊分片之間不互相搬移。
+- 每批 batch_size 位使用者：在目標分片先刪除這些使用者的資料 (上次中斷時可能留下的部分複製)，
+  以 ATTACH 由來源分片複製並提交，之後才從來源分片刪除。中途中斷時以相同參數再執行一次即可繼續，
+  資料不會遺失也不會重複。
+- 開始時在分片 0 的 shard_layout 記錄目標分片數，完成前應用程式拒絕啟動。
+- 資料列保留原本的 id (各分片的 id 區段不重疊)。搬移前先將既有分片 (舊的 med.db) 的資料表重建為
+  AUTOINCREMENT，搬走的 id 不會再配給其他使用者。提醒 (reminders) 隨所屬的藥物搬移；
+  rate_limit_events 只保存限流視窗內的紀錄，不搬移。
+- 來源分片刪除後的空間由定期的分析紀錄整理 (incremental_vacuum) 歸還。
+"""
+
+import argparse
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import select
+
+from app.db.database import (
+    Base, SessionLocal, Shard, ensure_autoincrement, init_shard_schema, shards as configured_shards,
+)
+from app.db.sharding import ShardLayoutError, shard_for, shard_path
+from app.models.scheduler_lease import SchedulerLease
+from app.models.shard_layout import ShardLayout
+from app.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+
+# 有 user_id 欄位的資料表 (資料表, 使用者欄位)；提醒依所屬藥物另外處理
+USER_TABLES = (
+    ("users", "line_user_id"),
+    ("user_profiles", "user_id"),
+    ("medications", "user_id"),
+    ("alerts", "user_id"),
+    ("adherence_daily", "user_id"),
+    ("medication_status_logs", "user_id"),
+    ("cache_versions", "user_id"),
+)
+_MOVING = "SELECT user_id FROM temp.reshard_users"
+
+def _where(schema: str, table: str, column: str = None) -> str:
+    if table == "reminders":
+        return (f"{schema}.reminders WHERE medication_id IN "
+                f"(SELECT id FROM {schema}.medications WHERE user_id IN ({_MOVING}))")
+    return f"{schema}.{table} WHERE {column} IN ({_MOVING})"
+
+def _tables() -> List[Tuple[str, str]]:
+    """搬移順序：提醒要在藥物之前刪除 (依藥物找出提醒)"""
+    return [("reminders", None)] + list(USER_TABLES)
+
+def _columns(table: str) -> str:
+    # 明確列出欄位：舊的 med.db 以 ALTER TABLE 補上的欄位順序可能與新建立的分片不同
+    return ", ".join(column.name for column in Base.metadata.tables[table].columns)
+
+def _load_users(conn, user_ids: List[str]):
+    conn.exec_driver_sql("CREATE TEMP TABLE IF NOT EXISTS reshard_users (user_id TEXT PRIMARY KEY)")
+    conn.exec_driver_sql("DELETE FROM temp.reshard_users")
+    conn.exec_driver_sql("INSERT INTO temp.reshard_users (user_id) VALUES (?)", [(u,) for u in user_ids])
+
+def _delete_users(conn, schema: str):
+    for table, column in _tables():
+        conn.exec_driver_sql(f"DELETE FROM {_where(schema, table, column)}")
+
+def _transaction(conn, work):
+    conn.exec_driver_sql("BEGIN IMMEDIATE")
+    try:
+        work()
+    except BaseException:
+        conn.exec_driver_sql("ROLLBACK")
+        raise
+    conn.exec_driver_sql("COMMIT")
+
+def copy_users(source: Shard, target: Shard, user_ids: List[str]):
+    """將使用者的資料複製到目標分片 (先清除目標分片中這些使用者的資料)，不修改來源分片"""
+    with target.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("ATTACH DATABASE ? AS src", (source.path,))
+        try:
+            _load_users(conn, user_ids)
+
+            def work():
+                _delete_users(conn, "main")
+                for table, column in USER_TABLES + (("reminders", None),):
+                    columns = _columns(table)
+                    conn.exec_driver_sql(
+                        f"INSERT INTO main.{table} ({columns}) SELECT {columns} FROM {_where('src', table, column)}"
+                    )
+
+            _transaction(conn, work)
+        finally:
+            conn.exec_driver_sql("DETACH DATABASE src")
+
+def delete_users(shard: Shard, user_ids: List[str]):
+    with shard.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        _load_users(conn, user_ids)
+        _transaction(conn, lambda: _delete_users(conn, "main"))
+
+def list_users(shard: Shard) -> List[str]:
+    union = " UNION ".join(f"SELECT {column} FROM {table} WHERE {column} IS NOT NULL" for table, column in USER_TABLES)
+    with shard.engine.connect() as conn:
+        return [row[0] for row in conn.exec_driver_sql(union)]
+
+def plan_moves(shard_list: List[Shard], current: int, target: int) -> Dict[Tuple[int, int], List[str]]:
+    """(來源分片, 目標分片) -> 要搬移的使用者"""
+    moves: Dict[Tuple[int, int], List[str]] = defaultdict(list)
+    for source in shard_list[:current]:
+        for user_id in list_users(source):
+            destination = shard_for(user_id, target)
+            if destination != source.index:
+                moves[(source.index, destination)].append(user_id)
+    return moves
+
+def _shard_list(count: int) -> List[Shard]:
+    return [configured_shards[i] if i < len(configured_shards) else Shard(i, shard_path(i)) for i in range(count)]
+
+def read_layout() -> Tuple[int, int]:
+    """(目前分片數, 進行中的目標分片數或 0)"""
+    with SessionLocal() as db:
+        layout = db.get(ShardLayout, 1)
+    if layout is None:
+        return 1, 0
+    return layout.shards, layout.target_shards or 0
+
+def _write_layout(shards: int, target_shards=None):
+    with SessionLocal() as db:
+        layout = db.get(ShardLayout, 1) or ShardLayout(id=1)
+        layout.shards, layout.target_shards, layout.updated_at = shards, target_shards, time.time()
+        db.add(layout)
+        db.commit()
+
+def _active_leases() -> List[str]:
+    with SessionLocal() as db:
+        return list(db.scalars(
+            select(SchedulerLease.holder).where(SchedulerLease.expires_at > time.time(), SchedulerLease.holder != "")
+        ))
+
+def reshard(target: int, batch_size: int = DEFAULT_BATCH_SIZE, dry_run: bool = False, force: bool = False,
+            log=print) -> int:
+    """將分片數增加為 target，回傳搬移的使用者數"""
+    init_shard_schema(configured_shards[0])
+    current, pending = read_layout()
+    if pending and pending != target:
+        raise ShardLayoutError(f"上一次的重新分片 ({current} -> {pending}) 尚未完成，請先以 --to {pending} 完成")
+    if target < current:
+        raise ShardLayoutError(f"目前為 {current} 個分片，只支援增加分片數")
+    if target == current and not pending:
+        log(f"已經是 {current} 個分片，不需要搬移")
+        return 0
+    holders = _active_leases()
+    if holders and not force and not dry_run:
+        raise ShardLayoutError(f"仍有 worker 持有排程租約 ({', '.join(holders)})，請先停止服務 (或以 --force 略過)")
+
+    shard_list = _shard_list(target)
+    for shard in shard_list[:current]:
+        init_shard_schema(shard)
+    moves = plan_moves(shard_list, current, target)
+    total = sum(len(users) for users in moves.values())
+    for (source, destination), users in sorted(moves.items()):
+        log(f"分片 {source} -> {destination}: {len(users):,} 位使用者")
+    if dry_run:
+        log(f"預計搬移 {total:,} 位使用者 ({current} -> {target} 個分片)")
+        return total
+
+    for shard in shard_list[:current]:
+        rebuilt = ensure_autoincrement(shard)
+        if rebuilt:
+            log(f"分片 {shard.index} 的資料表已改為 AUTOINCREMENT: {', '.join(rebuilt)}")
+    for shard in shard_list[current:]:
+        init_shard_schema(shard)
+    _write_layout(current, target)
+    moved = 0
+    for (source, destination), users in sorted(moves.items()):
+        for start in range(0, len(users), batch_size):
+            batch = users[start:start + batch_size]
+            copy_users(shard_list[source], shard_list[destination], batch)
+            delete_users(shard_list[source], batch)
+            moved += len(batch)
+            logger.info(f"已搬移 {moved:,} / {total:,} 位使用者")
+    _write_layout(target)
+    log(f"已搬移 {moved:,} 位使用者，資料庫現為 {target} 個分片；請將 [DATABASE] shards 設為 {target} 後重新啟動")
+    return moved
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="增加 SQLite 資料分片數並搬移使用者資料")
+    parser.add_argument("--to", type=int, default=None, help="新的分片數 (未指定時只顯示目前狀態)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每批搬移的使用者數")
+    parser.add_argument("--dry-run", action="store_true", help="只計算要搬移的使用者數，不寫入資料庫")
+    parser.add_argument("--force", action="store_true", help="不檢查排程租約 (確定所有 worker 都已停止時使用)")
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    if args.to is None:
+        init_shard_schema(configured_shards[0])
+        current, pending = read_layout()
+        print(f"目前為 {current} 個分片" + (f"，重新分片至 {pending} 個尚未完成" if pending else ""))
+        for shard in _shard_list(current):
+            init_shard_schema(shard)
+            print(f"  分片 {shard.index}  {shard.path:<40} {len(list_users(shard)):>10,} 位使用者")
+        return
+    if args.to < 1 or args.batch_size < 1:
+        parser.error("--to 與 --batch-size 必須大於 0")
+    try:
+        reshard(args.to, batch_size=args.batch_size, dry_run=args.dry_run, force=args.force)
+    except ShardLayoutError as e:
+        parser.exit(1, f"{e}\n")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,113 @@
+# app/services/scheduler.py
+"""
+排程器。
+
+- 排程工作存放在共用的 SQLAlchemy job store (與應用程式同一個 SQLite 檔的 apscheduler_jobs)，
+  所有 worker 看到同一份排程，下一次執行時間也一併保存。
+- 每個 worker 都會啟動排程器但處於暫停狀態，只有取得領導者租約 (見 leader.py) 的 worker 會恢復執行；
+  失去租約時立即暫停，新的領導者從 job store 接續原本的下一次執行時間。
+- 週期性工作只由領導者寫入 job store；設定未變時保留原本的下一次執行時間，不會因為重新啟動而重算。
+- 領導者在每次心跳時喚醒排程器，其他 worker 新增的提醒最晚在一次心跳內被看到。
+- 交接期間錯過的執行在 misfire_grace_time 內仍會補跑一次 (coalesce)。
+- 指標：每次送出工作時記錄與預定時間的延遲 (lag)，以及執行結果；job 標籤為週期性工作的 id，提醒一律為 reminder。
+
+config.ini 範例：
+    [SCHEDULER]
+    lease_seconds = 15
+    heartbeat_seconds = 5
+    misfire_grace_time = 300
+"""
+
+import logging
+from datetime import datetime, timedelta, timezone
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+
+from app.db.database import engine
+from app.services.leader import LeaderElector
+from app.services.metrics import registry
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+_settings = get_settings().scheduler
+
+scheduler = BackgroundScheduler(
+    jobstores={"default": SQLAlchemyJobStore(engine=engine, tablename="apscheduler_jobs")},
+    job_defaults={
+        "coalesce": True,
+        "misfire_grace_time": _settings.misfire_grace_time,
+    },
+)
+
+# job_id -> (func, minutes, args)，成為領導者時寫入 job store
+_interval_jobs = {}
+
+job_lag = registry.histogram(
+    "medimgmt_scheduler_job_lag_seconds", "排程工作實際送出執行與預定時間的差距", ["job"],
+    buckets=(0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900),
+)
+job_runs = registry.counter("medimgmt_scheduler_jobs_total", "排程工作的執行結果", ["job", "outcome"])
+
+def _job_label(job_id: str) -> str:
+    return job_id if job_id in _interval_jobs else "reminder"
 
-scheduler = BackgroundScheduler()
+def _on_job_event(event):
+    job = _job_label(event.job_id)
+    if event.code == EVENT_JOB_SUBMITTED:
+        now = datetime.now(timezone.utc)
+        for run_time in event.scheduled_run_times:
+            job_lag.observe(max((now - run_time).total_seconds(), 0.0), job)
+        return
+    outcome = {EVENT_JOB_EXECUTED: "ok", EVENT_JOB_ERROR: "error", EVENT_JOB_MISSED: "missed"}[event.code]
+    job_runs.inc(job, outcome)
+
+scheduler.add_listener(_on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+def _apply_interval_job(job_id):
+    func, minutes, args = _interval_jobs[job_id]
+    existing = scheduler.get_job(job_id)
+    if existing is not None and getattr(existing.trigger, "interval", None) == timedelta(minutes=minutes):
+        return existing  # 設定相同：保留原本的下一次執行時間
+    return scheduler.add_job(
+        func, 'interval', minutes=minutes, args=args, id=job_id,
+        replace_existing=True, coalesce=True, max_instances=1,
+    )
+
+def _on_elected():
+    for job_id in _interval_jobs:
+        _apply_interval_job(job_id)
+    scheduler.resume()
+
+def _on_demoted():
+    if scheduler.running:
+        scheduler.pause()
+
+def _on_renewed():
+    if scheduler.running:
+        scheduler.wakeup()
+
+leader = LeaderElector(
+    "scheduler",
+    lease_seconds=_settings.lease_seconds,
+    heartbeat_seconds=_settings.heartbeat_seconds,
+    on_elected=_on_elected,
+    on_demoted=_on_demoted,
+    on_renewed=_on_renewed,
+)
+
+registry.gauge(
+    "medimgmt_scheduler_leader", "本 worker 是否持有排程領導者租約 (1/0)",
+    callback=lambda: {(): 1 if leader.is_leader else 0},
+)
 
 def start_scheduler():
     if not scheduler.running:
-        scheduler.start()
+        scheduler.start(paused=True)
+    leader.start()
 
 def schedule_reminder(func, run_date, args=None, job_id=None):
     """新增一筆服藥提醒排程（run_date 必須為 UTC）"""
@@ -17,3 +119,26 @@ def remove_reminder(job_id):
         scheduler.remove_job(job_id)
     except JobLookupError:
         pass  # 任務不存在可忽略
+
+def schedule_interval_job(func, minutes, job_id, args=None):
+    """註冊一筆週期性排程（同 job_id 重複註冊時會取代舊的設定），由領導者寫入共用的 job store"""
+    _interval_jobs[job_id] = (func, minutes, args or [])
+    if leader.is_leader and scheduler.running:
+        return _apply_interval_job(job_id)
+    return None
+
+def scheduler_status() -> dict:
+    jobs = scheduler.get_jobs() if scheduler.running else []
+    return {
+        **leader.status(),
+        "running": scheduler.running,
+        "jobs": [
+            {"id": job.id, "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None}
+            for job in jobs
+        ],
+    }
+
+def shutdown_scheduler():
+    leader.stop()
+    if scheduler.running:
+        scheduler.shutdown(wait=False)
@@ -0,0 +1,127 @@
+# app/services/speculative.py
+"""
+預先進行的藥物交互作用分析。
+
+使用者儲存藥物 (或個人資料) 後幾乎都會接著打開交互作用分頁，
+寫入提交後就在背景開始分析，結果存進分析快取 (見 interaction_analysis.py)，打開分頁時即可直接取得。
+
+- 延遲 delay 秒才開始：連續寫入 (例如逐筆修改) 時，每次寫入都會取消前一次尚未完成的預先分析，只分析最後的狀態。
+- AI 隔艙已有請求在排隊時不進行預先分析；進行時以 PRIORITY_SPECULATIVE 排隊，永遠排在使用者請求之後。
+- 使用者請求遇到仍在排隊的預先分析時會取消它並直接以較高的優先權分析 (見 interaction_analysis.analyze)。
+- 額度：全體每 global_window 秒最多 global_limit 次、每位使用者每 user_window 秒最多 user_limit 次，
+  只有真的需要呼叫 Gemini 時才計入 (快取命中或加入進行中的分析不計)。
+- 只在進行寫入的 worker 內分析；使用者請求落在其他 worker 時仍可從資料庫中的分析快取取得結果。
+
+config.ini 範例：
+    [SPECULATIVE]
+    enabled = true
+    delay = 2
+    global_limit = 60
+    global_window = 3600
+    user_limit = 10
+    user_window = 86400
+"""
+
+import asyncio
+import logging
+from functools import partial
+from typing import Dict, Iterable
+
+from app.services.admission import SlidingWindowLimiter, PRIORITY_SPECULATIVE
+from app.services.bulkhead import ai_bulkhead, BulkheadFull
+from app.services.interaction_analysis import analyze, load_inputs
+from app.utils.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class SpeculationSkipped(Exception):
+    """預先分析的額度已用完"""
+
+class SpeculativeAnalyzer:
+    def __init__(self, enabled: bool, delay: float, global_limit: int, global_window: float,
+                 user_limit: int, user_window: float):
+        self.enabled = enabled
+        self.delay = delay
+        self._global = SlidingWindowLimiter(global_limit, global_window)
+        self._per_user = SlidingWindowLimiter(user_limit, user_window)
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._counts = {"scheduled": 0, "completed": 0, "cancelled": 0, "skipped": 0, "failed": 0}
+
+    def schedule(self, user_ids: Iterable[str]):
+        """在寫入提交後呼叫：為每位使用者排一次預先分析 (取代尚未完成的前一次)"""
+        if not self.enabled:
+            return
+        for user_id in set(user_ids):
+            if not user_id:
+                continue
+            self.cancel(user_id)
+            task = asyncio.create_task(self._speculate(user_id))
+            self._pending[user_id] = task
+            task.add_done_callback(partial(self._forget, user_id))
+            self._counts["scheduled"] += 1
+
+    def cancel(self, user_id: str) -> bool:
+        task = self._pending.pop(user_id, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        self._counts["cancelled"] += 1
+        return True
+
+    def _forget(self, user_id: str, task: asyncio.Task):
+        if self._pending.get(user_id) is task:
+            del self._pending[user_id]
+
+    async def _admit(self, user_id: str) -> int:
+        """需要呼叫 Gemini 時才扣額度；全體額度先檢查，避免使用者額度被白白扣掉"""
+        if not self._global.hit("speculative")[0]:
+            raise SpeculationSkipped("global")
+        if not self._per_user.hit(user_id)[0]:
+            raise SpeculationSkipped(user_id)
+        return PRIORITY_SPECULATIVE
+
+    async def _speculate(self, user_id: str):
+        await asyncio.sleep(self.delay)
+        if ai_bulkhead.queued:
+            self._counts["skipped"] += 1
+            logger.info(f"AI 隔艙忙碌中，略過用户 {user_id} 的預先分析")
+            return
+        try:
+            medications, user_profile = await load_inputs(user_id)
+            if not medications:
+                return
+            await analyze(user_id, medications, user_profile, priority=PRIORITY_SPECULATIVE,
+                          speculative=True, admit=partial(self._admit, user_id))
+            self._counts["completed"] += 1
+        except (SpeculationSkipped, BulkheadFull) as e:
+            self._counts["skipped"] += 1
+            logger.info(f"略過用户 {user_id} 的預先分析: {e!r}")
+        except asyncio.CancelledError:
+            if self._pending.get(user_id) is asyncio.current_task():
+                # 不是由 cancel() 取消：等待的分析還在排隊就被使用者請求取代 (見 interaction_analysis.analyze)
+                self._counts["cancelled"] += 1
+            raise
+        except Exception as e:
+            self._counts["failed"] += 1
+            logger.warning(f"用户 {user_id} 的預先分析失敗: {e}")
+
+    async def shutdown(self):
+        tasks = list(self._pending.values())
+        self._pending.clear()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "pending": len(self._pending), **self._counts}
+
+_settings = get_settings().speculative
+speculative_analyzer = SpeculativeAnalyzer(
+    enabled=_settings.enabled,
+    delay=_settings.delay,
+    global_limit=_settings.global_limit,
+    global_window=_settings.global_window,
+    user_limit=_settings.user_limit,
+    user_window=_settings.user_window,
+)
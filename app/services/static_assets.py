@@ -0,0 +1,235 @@
+# app/services/static_assets.py
+"""
+LIFF 前端靜態檔的建置與提供。
+
+建置 (部署時執行一次，輸出到 build_dir)：
+- index.html 以外的檔案 (js / css ...) 以內容雜湊命名，例如 js/app.js -> js/app.3f9a1c0b7d2e.js，
+  index.html 中的引用改寫為雜湊後的檔名；內容不變時檔名也不變，內容改變就是新的網址。
+- 可壓縮的檔案另外輸出 .gz (以及安裝 brotli 時的 .br)，請求時直接送出，不在請求中壓縮。
+- 雜湊檔案只會新增不會覆寫；舊版本保留在目錄中，仍開著舊 index.html 的使用者不會取得 404。
+  index.html 最後才以 os.replace 原子替換。
+
+提供 (LiffStaticFiles)：
+- 依 Accept-Encoding 選擇 br > gzip > 原始檔，回應帶 Content-Encoding 與 Vary: Accept-Encoding。
+- 雜湊檔案：Cache-Control: public, max-age=31536000, immutable (再次開啟 LIFF 時完全不需連線)。
+- 其他檔案 (index.html)：依 html_max_age 短暫快取並要求重新驗證，過期後以 ETag 取得 304。
+- 尚未建置 (build_dir 沒有 index.html) 時直接提供 source_dir 的原始檔，全部以 ETag 重新驗證。
+
+    python -m app.services.static_assets build
+    python -m app.services.static_assets build --source app/liff --output app/liff_dist
+
+config.ini 範例：
+    [LIFF]
+    source_dir = ./app/liff
+    build_dir = ./app/liff_dist
+    html_max_age = 0
+"""
+
+import argparse
+import gzip
+import hashlib
+import importlib.util
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from functools import lru_cache
+from typing import Dict
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from app.utils.config import get_settings
+from app.utils.logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+HASH_LENGTH = 12
+_HASHED_NAME = re.compile(rf"\.[0-9a-f]{{{HASH_LENGTH}}}\.[A-Za-z0-9]+$")
+_REFERENCE = re.compile(r'(?P<attr>\b(?:src|href))="(?P<path>[^"#?:]+)(?P<suffix>[^"]*)"')
+COMPRESSIBLE = {".html", ".js", ".css", ".json", ".svg", ".txt", ".map", ".xml"}
+MIN_COMPRESS_SIZE = 256
+IMMUTABLE = "public, max-age=31536000, immutable"
+# 偏好順序：(Content-Encoding, 副檔名)
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+MANIFEST = "manifest.json"
+
+@lru_cache(maxsize=1)
+def _brotli():
+    """brotli 為選用套件，只在建置時載入；未安裝時只輸出 gzip"""
+    if importlib.util.find_spec("brotli") is None:
+        return None
+    import brotli
+    return brotli
+
+def is_hashed(path: str) -> bool:
+    return bool(_HASHED_NAME.search(os.path.basename(path)))
+
+def _hashed_name(rel_path: str, data: bytes) -> str:
+    root, ext = os.path.splitext(rel_path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+def _write_with_variants(path: str, data: bytes, skip_existing: bool) -> Dict[str, int]:
+    """寫入原始檔與壓縮版本 (壓縮後沒有變小就不輸出)，回傳各版本的大小"""
+    sizes = {"identity": len(data)}
+    if not (skip_existing and os.path.exists(path)):
+        _write_atomic(path, data)
+    if os.path.splitext(path)[1] not in COMPRESSIBLE or len(data) < MIN_COMPRESS_SIZE:
+        return sizes
+    variants = {"gzip": lambda: gzip.compress(data, compresslevel=9, mtime=0)}
+    if _brotli() is not None:
+        variants["br"] = lambda: _brotli().compress(data, quality=11)
+    for encoding, suffix in ENCODINGS:
+        if encoding not in variants:
+            continue
+        target = path + suffix
+        if skip_existing and os.path.exists(target):
+            sizes[encoding] = os.path.getsize(target)
+            continue
+        compressed = variants[encoding]()
+        if len(compressed) < len(data):
+            _write_atomic(target, compressed)
+            sizes[encoding] = len(compressed)
+    return sizes
+
+def build(source_dir: str, output_dir: str) -> Dict[str, dict]:
+    """建置 LIFF 靜態檔，回傳 {原始路徑: {"path": 輸出路徑, 各編碼大小...}}"""
+    manifest: Dict[str, str] = {}
+    report: Dict[str, dict] = {}
+    output_abs = os.path.abspath(output_dir)
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != output_abs)
+        for name in sorted(files):
+            rel_path = os.path.relpath(os.path.join(root, name), source_dir).replace(os.sep, "/")
+            if rel_path == "index.html" or name.startswith("."):
+                continue
+            with open(os.path.join(root, name), "rb") as f:
+                data = f.read()
+            hashed = _hashed_name(rel_path, data)
+            manifest[rel_path] = hashed
+            # 相同雜湊的檔案內容必定相同，已存在就不再寫入
+            sizes = _write_with_variants(os.path.join(output_dir, hashed), data, skip_existing=True)
+            report[rel_path] = {"path": hashed, **sizes}
+
+    with open(os.path.join(source_dir, "index.html"), encoding="utf-8") as f:
+        html = f.read()
+
+    def rewrite(match):
+        path = match.group("path")
+        hashed = manifest.get(path[2:] if path.startswith("./") else path)
+        if hashed is None:
+            return match.group(0)
+        return f'{match.group("attr")}="{hashed}{match.group("suffix")}"'
+
+    html = _REFERENCE.sub(rewrite, html)
+    _write_atomic(os.path.join(output_dir, MANIFEST),
+                  json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode("utf-8"))
+    # 先寫壓縮版本，最後才替換 index.html
+    sizes = _write_with_variants(os.path.join(output_dir, "index.html"), html.encode("utf-8"), skip_existing=False)
+    report["index.html"] = {"path": "index.html", **sizes}
+    if _brotli() is None:
+        logger.info("未安裝 brotli，只輸出 gzip 壓縮版本")
+    return report
+
+def _accepted_encodings(header: str) -> set:
+    """解析 Accept-Encoding (忽略 q=0 的項目)"""
+    accepted = set()
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name == "*":
+            accepted.update(encoding for encoding, _ in ENCODINGS)
+        elif name:
+            accepted.add(name)
+    return accepted
+
+class LiffStaticFiles(StaticFiles):
+    """提供預先壓縮的檔案並設定快取標頭的 StaticFiles"""
+
+    def __init__(self, *args, html_max_age: int = 0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.html_max_age = html_max_age
+
+    def _cache_control(self, full_path: str) -> str:
+        if is_hashed(full_path):
+            return IMMUTABLE
+        if self.html_max_age > 0:
+            return f"public, max-age={self.html_max_age}, must-revalidate"
+        return "no-cache"
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        full_path = os.fspath(full_path)
+        headers = {"Cache-Control": self._cache_control(full_path)}
+        path = full_path
+        if os.path.splitext(full_path)[1] in COMPRESSIBLE:
+            headers["Vary"] = "Accept-Encoding"
+            accepted = _accepted_encodings(request_headers.get("accept-encoding", ""))
+            for candidate, suffix in ENCODINGS:
+                if candidate not in accepted:
+                    continue
+                # 本機檔案的 stat 只需數微秒，直接在事件迴圈中執行
+                try:
+                    stat_result = os.stat(full_path + suffix)
+                except OSError:
+                    continue
+                path = full_path + suffix
+                headers["Content-Encoding"] = candidate
+                break
+
+        # media_type 依原始檔名判斷；ETag 由實際送出的檔案計算，不同編碼的 ETag 不同
+        response = FileResponse(path, status_code=status_code, stat_result=stat_result, headers=headers,
+                                media_type=mimetypes.guess_type(full_path)[0] or "text/plain")
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+def liff_static_app() -> LiffStaticFiles:
+    """已建置時提供 build_dir，否則提供原始檔"""
+    settings = get_settings().liff
+    directory = settings.source_dir
+    if settings.build_dir and os.path.isfile(os.path.join(settings.build_dir, "index.html")):
+        directory = settings.build_dir
+    else:
+        logger.warning("尚未建置 LIFF 靜態檔，直接提供原始檔 (python -m app.services.static_assets build)")
+    return LiffStaticFiles(directory=directory, html=True, html_max_age=settings.html_max_age)
+
+def main(argv=None):
+    settings = get_settings().liff
+    parser = argparse.ArgumentParser(description="建置 LIFF 靜態檔 (內容雜湊檔名 + 預先壓縮)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build_cmd = sub.add_parser("build", help="輸出雜湊檔名與 gzip / brotli 版本")
+    build_cmd.add_argument("--source", default=settings.source_dir)
+    build_cmd.add_argument("--output", default=settings.build_dir)
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    report = build(args.source, args.output)
+    for rel_path, info in report.items():
+        sizes = "  ".join(f"{k} {v:,}" for k, v in info.items() if k != "path")
+        print(f"{rel_path:<20} -> {info['path']:<32} {sizes}")
+    print(f"已建置 {len(report)} 個檔案 -> {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,21 +1,194 @@
+# app/services/timezone.py
+"""
+時區處理。
+
+- 時區物件 (pytz) 只建立一次並快取；時區名稱可能來自用戶端參數，快取有上限，且不快取無效的時區。
+- 每個時區預先建立 UTC 轉換點表 (DST transition table)，
+  大量時間轉換時以 bisect 查表，不需每筆都呼叫 pytz。
+- 批次轉換會先依時區分組，每個時區只查一次表。
+- 當地時間換算 UTC 時明確處理：
+    不存在的時間 (夏令時間開始時跳過的時段) -> 依跳過的長度往後順延，例如 02:30 -> 03:30
+    重複的時間 (夏令時間結束時重複的時段) -> 取較早的那一次，避免提醒重複觸發
+"""
+
+import bisect
+import logging
+from datetime import datetime, date, time, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
 import pytz
-from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 使用者未設定時區時的預設值
+DEFAULT_TIMEZONE = "Asia/Taipei"
+
+_EPOCH = datetime(1970, 1, 1)
+# 轉換點之間至少相隔數週，前後各看兩天即可涵蓋某一當地時間可能的 UTC 偏移量
+_OFFSET_PROBE = timedelta(days=2)
+
+# 有效的 IANA 時區約 600 個 (名稱不分大小寫，同一時區可能有多種寫法)
+_ZONE_CACHE_SIZE = 1024
+
+@lru_cache(maxsize=_ZONE_CACHE_SIZE)
+def _lookup_zone(user_timezone: str):
+    # 無效的時區直接拋出例外，lru_cache 不會快取
+    return pytz.timezone(user_timezone)
+
+def get_zone(user_timezone: str):
+    """取得 (快取的) 時區物件，無效時區會拋出 pytz.UnknownTimeZoneError"""
+    try:
+        return _lookup_zone(user_timezone)
+    except pytz.UnknownTimeZoneError:
+        raise
+    except Exception as e:
+        # 非字串等無法查詢的值
+        raise pytz.UnknownTimeZoneError(user_timezone) from e
+
+def is_valid_timezone(user_timezone: str) -> bool:
+    try:
+        get_zone(user_timezone)
+    except pytz.UnknownTimeZoneError:
+        return False
+    return True
+
+class ZoneTable:
+    """單一時區的 UTC 轉換點表：transition_secs[i] 之後使用 offsets[i] / tzinfos[i]"""
+
+    __slots__ = ("zone", "transition_secs", "offsets", "tzinfos")
+
+    def __init__(self, zone):
+        self.zone = zone
+        utc_transitions = getattr(zone, "_utc_transition_times", None)
+        if utc_transitions:
+            infos = zone._transition_info
+            self.transition_secs = [(t - _EPOCH).total_seconds() if t.year > 1 else float("-inf")
+                                    for t in utc_transitions]
+            self.offsets = [info[0] for info in infos]
+            self.tzinfos = [zone._tzinfos.get(info, zone) for info in infos]
+        else:
+            # 固定偏移量的時區 (例如 UTC)
+            self.transition_secs = [float("-inf")]
+            self.offsets = [zone.utcoffset(_EPOCH) or timedelta(0)]
+            self.tzinfos = [zone]
+
+    def _index(self, utc_dt: datetime) -> int:
+        secs = (utc_dt - _EPOCH).total_seconds()
+        return max(bisect.bisect_right(self.transition_secs, secs) - 1, 0)
+
+    def offset_at(self, utc_dt: datetime) -> timedelta:
+        return self.offsets[self._index(utc_dt)]
+
+    def to_local(self, utc_dt: datetime) -> datetime:
+        """naive UTC -> 帶時區的當地時間"""
+        i = self._index(utc_dt)
+        return (utc_dt + self.offsets[i]).replace(tzinfo=self.tzinfos[i])
+
+    def to_utc(self, local_dt: datetime) -> datetime:
+        """
+        naive 當地時間 -> naive UTC。
+        重複的時間取較早的一次；不存在的時間依跳過的長度往後順延。
+        """
+        before = self.offset_at(local_dt - _OFFSET_PROBE)
+        after = self.offset_at(local_dt + _OFFSET_PROBE)
+        candidates = [local_dt - off for off in {before, after} if self.offset_at(local_dt - off) == off]
+        if candidates:
+            return min(candidates)
+        # 不存在的時間：以轉換前的偏移量換算，結果會落在轉換點之後
+        return local_dt - before
+
+@lru_cache(maxsize=_ZONE_CACHE_SIZE)
+def get_zone_table(user_timezone: str) -> ZoneTable:
+    return ZoneTable(get_zone(user_timezone))
 
 def convert_time_to_user_timezone(dt: datetime, user_timezone: str):
     """將UTC時間轉換為用戶時區時間字串"""
     try:
-        user_tz = pytz.timezone(user_timezone)
-        utc_dt = pytz.utc.localize(dt)
-        local_dt = utc_dt.astimezone(user_tz)
-        return local_dt
+        return get_zone_table(user_timezone).to_local(dt)
     except Exception as e:
-        print("時區轉換失敗:", e)
+        logger.warning(f"時區轉換失敗: {e}")
         return dt
 
+def convert_batch(dts: Sequence[datetime], user_timezone: str) -> List[datetime]:
+    """將同一時區的多筆 naive UTC 時間轉換為當地時間；無效時區時原樣回傳"""
+    try:
+        table = get_zone_table(user_timezone)
+    except Exception as e:
+        logger.warning(f"時區轉換失敗: {e}")
+        return list(dts)
+    # 單一時區內以區域變數直接查表，省去逐筆的方法呼叫
+    transitions, offsets, tzinfos = table.transition_secs, table.offsets, table.tzinfos
+    if len(transitions) == 1:
+        offset, tzinfo = offsets[0], tzinfos[0]
+        return [(dt + offset).replace(tzinfo=tzinfo) for dt in dts]
+    find = bisect.bisect_right
+    results = []
+    for dt in dts:
+        i = find(transitions, (dt - _EPOCH).total_seconds()) - 1
+        if i < 0:
+            i = 0
+        results.append((dt + offsets[i]).replace(tzinfo=tzinfos[i]))
+    return results
+
+def convert_many(pairs: Iterable[Tuple[datetime, str]]) -> List[datetime]:
+    """
+    批次轉換 (naive UTC 時間, 時區) 配對，先依時區分組再逐區轉換，
+    回傳結果依輸入順序排列。
+    """
+    pairs = list(pairs)
+    groups: Dict[str, List[int]] = {}
+    for i, (_, tz) in enumerate(pairs):
+        groups.setdefault(tz, []).append(i)
+
+    results: List[Optional[datetime]] = [None] * len(pairs)
+    for tz, indexes in groups.items():
+        converted = convert_batch([pairs[i][0] for i in indexes], tz)
+        for i, local_dt in zip(indexes, converted):
+            results[i] = local_dt
+    return results
+
+def to_naive_utc(dt: datetime) -> datetime:
+    """帶有時區的時間換算為資料庫使用的 naive UTC；naive 時間視為已是 UTC，原樣回傳"""
+    if dt.tzinfo is None or dt.utcoffset() is None:
+        return dt
+    return dt.astimezone(dt_timezone.utc).replace(tzinfo=None)
+
+def local_to_utc(local_dt: datetime, user_timezone: str) -> datetime:
+    """將 naive 當地時間換算為 naive UTC (處理不存在/重複的當地時間)"""
+    return get_zone_table(user_timezone).to_utc(local_dt)
+
+def next_local_occurrence(hour: int, minute: int, user_timezone: str, after_utc: Optional[datetime] = None) -> datetime:
+    """
+    回傳 after_utc (預設為現在) 之後，用戶當地時間第一次到達 hour:minute 的 UTC 時間 (naive)。
+    例如每日 09:00 服藥提醒的下一次觸發時間。
+    """
+    table = get_zone_table(user_timezone)
+    after_utc = after_utc or datetime.utcnow()
+    local_day = table.to_local(after_utc).date()
+    wall = time(hour, minute)
+    # 當天若已過 (或因不存在的時間被順延後仍早於 after_utc)，往後找隔天
+    for days in range(3):
+        candidate = table.to_utc(datetime.combine(local_day + timedelta(days=days), wall))
+        if candidate > after_utc:
+            return candidate
+    raise ValueError(f"無法計算 {user_timezone} 的下一次 {hour:02d}:{minute:02d}")
+
 def get_current_time_in_timezone(user_timezone: str):
     try:
-        user_tz = pytz.timezone(user_timezone)
-        return datetime.now(user_tz)
+        return datetime.now(get_zone(user_timezone))
     except Exception as e:
-        print("取得時區當地時間失敗:", e)
+        logger.warning(f"取得時區當地時間失敗: {e}")
         return datetime.utcnow()
+
+def get_local_day_bounds_utc(user_timezone: str, day: date = None):
+    """
+    回傳用戶時區某一天 (預設為今天) 的起訖時間，換算為 naive UTC：[start, end)。
+    無效時區拋出 pytz.UnknownTimeZoneError (不改用 UTC，以免查到錯的一天)。
+    """
+    table = get_zone_table(user_timezone)
+    if day is None:
+        day = table.to_local(datetime.utcnow()).date()
+    start = table.to_utc(datetime.combine(day, time.min))
+    end = table.to_utc(datetime.combine(day + timedelta(days=1), time.min))
+    return start, end
@@ -1,6 +1,315 @@
+# app/utils/config.py
+"""
+集中的設定 (settings)。
+
+- config.ini 只在第一次呼叫 get_settings() 時讀取一次並快取，各模組不再各自解析。
+- 每個設定都可用環境變數覆寫：MEDIMGMT_<SECTION>_<KEY>，例如
+      MEDIMGMT_DATABASE_SQLITE_PATH=/data/med.db
+      MEDIMGMT_BULKHEAD_AI_MAX_CONCURRENCY=8
+  設定檔位置可用 MEDIMGMT_CONFIG 指定 (預設 ./app/config/config.ini)。
+- 型別與預設值定義在下方各區段的 dataclass；讀取時轉型失敗或缺少必要設定會拋出 SettingsError，
+  應用程式啟動時再以 validate_settings() 檢查數值範圍，有問題就拒絕啟動。
+"""
+
+import logging
+import os
 from configparser import ConfigParser
+from dataclasses import dataclass, field, fields
+from functools import lru_cache
+from typing import List, Optional, get_type_hints
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG_PATH = "./app/config/config.ini"
+ENV_PREFIX = "MEDIMGMT_"
+
+class SettingsError(ValueError):
+    """設定缺漏或格式錯誤"""
+
+_REQUIRED = object()
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    sqlite_path: str = _REQUIRED
+    # 依使用者分片的 SQLite 檔案數 (1 = 不分片)，見 app/db/sharding.py
+    shards: int = 1
+    # 分片 1..N-1 的檔案路徑樣板 ({shard} 為分片編號)；未設定時為 sqlite_path 加上 .shard<k>
+    shard_path: Optional[str] = None
+
+@dataclass(frozen=True)
+class GeminiSettings:
+    api_key: Optional[str] = None
+    text_url: Optional[str] = None
+    vision_url: Optional[str] = None
+
+@dataclass(frozen=True)
+class LineSettings:
+    channel_secret: Optional[str] = None
+    channel_access_token: Optional[str] = None
+    api_endpoint: Optional[str] = None  # 預設為 LINE 官方 API；效能測試時指向 bench/fake_services.py
+    webhook_workers: int = 4
+    webhook_queue_size: int = 1000
+    dedupe_ttl: float = 86400
+    dedupe_maxsize: int = 100000
+    reply_timeout: float = 10
+
+@dataclass(frozen=True)
+class SecuritySettings:
+    allowed_origins: List[str] = field(default_factory=lambda: ["https://liff.line.me"])
+
+@dataclass(frozen=True)
+class SchedulerSettings:
+    expiry_sweep_minutes: int = 15
+    lease_seconds: float = 15
+    heartbeat_seconds: float = 5
+    misfire_grace_time: int = 300
+
+@dataclass(frozen=True)
+class BulkheadSettings:
+    ai_max_concurrency: int = 4
+    ai_max_queue: int = 16
+    ai_retry_after: int = 10
+    db_max_concurrency: int = 32
+    db_max_queue: int = 256
+    db_retry_after: int = 1
+
+@dataclass(frozen=True)
+class AdmissionSettings:
+    backend: str = "memory"
+    analyze_limit: int = 5
+    analyze_window: float = 60
+    recognize_limit: int = 10
+    recognize_window: float = 60
+
+@dataclass(frozen=True)
+class CacheSettings:
+    maxsize: int = 10000
+    ttl: float = 300
+    poll_interval: float = 1
+
+@dataclass(frozen=True)
+class AlertsSettings:
+    codec: str = "zlib"
+    min_size: int = 256
+    keep_latest: int = 20
+    monthly_months: int = 12
+    batch_size: int = 500
+    vacuum_pages: int = 1000
+    compaction_minutes: int = 1440
+
+@dataclass(frozen=True)
+class InteractionKBSettings:
+    path: str = "./app/data/interactions.kb"
+    source: str = "./app/data/interactions.csv"
+    check_interval: float = 5
+
+@dataclass(frozen=True)
+class AnalysisSettings:
+    max_age_hours: float = 24
+
+@dataclass(frozen=True)
+class SpeculativeSettings:
+    enabled: bool = True
+    delay: float = 2
+    global_limit: int = 60
+    global_window: float = 3600
+    user_limit: int = 10
+    user_window: float = 86400
+
+@dataclass(frozen=True)
+class QueryLogSettings:
+    slow_query_ms: float = 200
+    explain: bool = True
+    n_plus_one_threshold: int = 5
+    debug_headers: bool = False
+
+@dataclass(frozen=True)
+class LoggingSettings:
+    level: str = "INFO"
+    format: str = "json"
+    queue_size: int = 10000
+    payload_sample_rate: float = 0.1
+    payload_max_bytes: int = 2048
+
+@dataclass(frozen=True)
+class LiffSettings:
+    source_dir: str = "./app/liff"
+    build_dir: Optional[str] = "./app/liff_dist"
+    html_max_age: int = 0
+
+@dataclass(frozen=True)
+class PromptSettings:
+    analysis_version: str = "v2"
+    prescription_version: str = "v2"
+    analysis_max_input_tokens: int = 1500
+    prescription_max_input_tokens: int = 1200
+    analysis_max_output_tokens: int = 0  # 0 表示不限制
+    prescription_max_output_tokens: int = 0
+
+@dataclass(frozen=True)
+class ProfilingSettings:
+    token: Optional[str] = None  # 帶有 X-Profile-Token 的請求才剖析；未設定時只依 sample_rate
+    sample_rate: float = 0.0
+    interval_ms: float = 5
+    max_seconds: float = 60
+    max_concurrent: int = 2
+    output_dir: str = "./profiles"
+    max_profiles: int = 200
+
+# 屬性名稱 -> (config.ini 區段, 類別)
+_SECTIONS = {
+    "database": ("DATABASE", DatabaseSettings),
+    "gemini": ("GEMINI", GeminiSettings),
+    "line": ("LINE", LineSettings),
+    "security": ("SECURITY", SecuritySettings),
+    "scheduler": ("SCHEDULER", SchedulerSettings),
+    "bulkhead": ("BULKHEAD", BulkheadSettings),
+    "admission": ("ADMISSION", AdmissionSettings),
+    "cache": ("CACHE", CacheSettings),
+    "alerts": ("ALERTS", AlertsSettings),
+    "interaction_kb": ("INTERACTION_KB", InteractionKBSettings),
+    "analysis": ("ANALYSIS", AnalysisSettings),
+    "speculative": ("SPECULATIVE", SpeculativeSettings),
+    "query_log": ("QUERY_LOG", QueryLogSettings),
+    "logging": ("LOGGING", LoggingSettings),
+    "liff": ("LIFF", LiffSettings),
+    "prompts": ("PROMPTS", PromptSettings),
+    "profiling": ("PROFILING", ProfilingSettings),
+}
+
+@dataclass(frozen=True)
+class Settings:
+    database: DatabaseSettings
+    gemini: GeminiSettings
+    line: LineSettings
+    security: SecuritySettings
+    scheduler: SchedulerSettings
+    bulkhead: BulkheadSettings
+    admission: AdmissionSettings
+    cache: CacheSettings
+    alerts: AlertsSettings
+    interaction_kb: InteractionKBSettings
+    analysis: AnalysisSettings
+    speculative: SpeculativeSettings
+    query_log: QueryLogSettings
+    logging: LoggingSettings
+    liff: LiffSettings
+    prompts: PromptSettings
+    profiling: ProfilingSettings
+    config_path: str = DEFAULT_CONFIG_PATH
+
+def _convert(raw: str, type_, name: str):
+    if type_ is Optional[str]:
+        return raw or None
+    if type_ is bool:
+        value = ConfigParser.BOOLEAN_STATES.get(raw.strip().lower())
+        if value is None:
+            raise SettingsError(f"{name} 必須是布林值 (true/false)，收到 {raw!r}")
+        return value
+    if type_ is List[str]:
+        return [item.strip() for item in raw.split(",") if item.strip()]
+    try:
+        return type_(raw.strip()) if type_ in (int, float) else raw
+    except ValueError:
+        raise SettingsError(f"{name} 必須是 {type_.__name__}，收到 {raw!r}")
+
+def _load_section(parser: ConfigParser, section: str, cls):
+    values = {}
+    hints = get_type_hints(cls)
+    for f in fields(cls):
+        name = f"{section}.{f.name}"
+        raw = os.environ.get(f"{ENV_PREFIX}{section}_{f.name}".upper())
+        if raw is None and parser.has_option(section, f.name):
+            raw = parser.get(section, f.name)
+        if raw is not None:
+            values[f.name] = _convert(raw, hints[f.name], name)
+        elif f.default is _REQUIRED:
+            raise SettingsError(
+                f"缺少必要設定 {name} (config.ini 的 [{section}] {f.name}，或環境變數 {ENV_PREFIX}{section}_{f.name.upper()})"
+            )
+    return cls(**values)
+
+def load_settings(config_path: Optional[str] = None) -> Settings:
+    """讀取設定檔與環境變數 (不快取，一般請使用 get_settings())"""
+    config_path = config_path or os.environ.get(f"{ENV_PREFIX}CONFIG", DEFAULT_CONFIG_PATH)
+    parser = ConfigParser()
+    if not parser.read(config_path, encoding="utf-8"):
+        logger.warning(f"找不到設定檔 {config_path}，只使用環境變數與預設值")
+    sections = {attr: _load_section(parser, section, cls) for attr, (section, cls) in _SECTIONS.items()}
+    return Settings(config_path=config_path, **sections)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    return load_settings()
+
+def validate_settings(settings: Optional[Settings] = None) -> List[str]:
+    """
+    檢查設定值的範圍與組合；有錯誤時拋出 SettingsError，
+    只影響部分功能的問題 (例如未設定 Gemini 金鑰) 以警告回傳並記錄在日誌。
+    """
+    s = settings or get_settings()
+    errors, warnings = [], []
+
+    def positive(section, obj, *names):
+        for name in names:
+            if getattr(obj, name) <= 0:
+                errors.append(f"{section}.{name} 必須大於 0")
+
+    positive("DATABASE", s.database, "shards")
+    if s.database.shards > 1 and s.database.shard_path and "{shard}" not in s.database.shard_path:
+        errors.append("DATABASE.shard_path 必須包含 {shard}，否則各分片會使用同一個檔案")
+    positive("SCHEDULER", s.scheduler, "expiry_sweep_minutes", "lease_seconds", "heartbeat_seconds")
+    if s.scheduler.heartbeat_seconds >= s.scheduler.lease_seconds:
+        errors.append("SCHEDULER.heartbeat_seconds 必須小於 lease_seconds，否則租約會在續約前過期")
+    positive("BULKHEAD", s.bulkhead, "ai_max_concurrency", "db_max_concurrency")
+    positive("ADMISSION", s.admission, "analyze_limit", "analyze_window", "recognize_limit", "recognize_window")
+    if s.admission.backend not in ("memory", "sqlite"):
+        errors.append(f"ADMISSION.backend 只能是 memory 或 sqlite，收到 {s.admission.backend!r}")
+    positive("CACHE", s.cache, "maxsize", "ttl")
+    positive("LINE", s.line, "webhook_workers", "webhook_queue_size", "dedupe_ttl", "dedupe_maxsize", "reply_timeout")
+    if s.alerts.codec not in ("zlib", "zstd"):
+        errors.append(f"ALERTS.codec 只能是 zlib 或 zstd，收到 {s.alerts.codec!r}")
+    positive("ALERTS", s.alerts, "batch_size", "vacuum_pages", "compaction_minutes")
+    if s.query_log.n_plus_one_threshold < 2:
+        errors.append("QUERY_LOG.n_plus_one_threshold 必須至少為 2")
+    if s.logging.format not in ("json", "text"):
+        errors.append(f"LOGGING.format 只能是 json 或 text，收到 {s.logging.format!r}")
+    if not isinstance(logging.getLevelName(s.logging.level.upper()), int):
+        errors.append(f"LOGGING.level 不是有效的日誌等級：{s.logging.level!r}")
+    positive("LOGGING", s.logging, "queue_size", "payload_max_bytes")
+    if not 0 <= s.logging.payload_sample_rate <= 1:
+        errors.append("LOGGING.payload_sample_rate 必須介於 0 與 1 之間")
+    if s.liff.html_max_age < 0:
+        errors.append("LIFF.html_max_age 不可為負數")
+    if min(s.prompts.analysis_max_input_tokens, s.prompts.prescription_max_input_tokens,
+           s.prompts.analysis_max_output_tokens, s.prompts.prescription_max_output_tokens) < 0:
+        errors.append("PROMPTS 的 token 預算不可為負數 (0 表示不限制)")
+    if s.alerts.keep_latest < 0 or s.alerts.monthly_months < 0:
+        errors.append("ALERTS.keep_latest 與 monthly_months 不可為負數")
+    positive("PROFILING", s.profiling, "interval_ms", "max_seconds", "max_concurrent", "max_profiles")
+    if not 0 <= s.profiling.sample_rate <= 1:
+        errors.append("PROFILING.sample_rate 必須介於 0 與 1 之間")
+
+    if not s.gemini.api_key or not s.gemini.text_url or not s.gemini.vision_url:
+        warnings.append("未完整設定 [GEMINI]，藥物交互作用分析與處方箋辨識將無法使用")
+    if not s.line.channel_secret or not s.line.channel_access_token:
+        warnings.append("未設定 [LINE] channel_secret / channel_access_token，LINE webhook 將無法使用")
+
+    for message in warnings:
+        logger.warning(message)
+    if errors:
+        raise SettingsError("設定錯誤：\n" + "\n".join(f"- {e}" for e in errors))
+    return warnings
+
+def get_config(section, key, config_path=None):
+    """相容舊的呼叫方式：讀取單一設定值 (同樣支援環境變數覆寫，設定檔只解析一次)"""
+    env = os.environ.get(f"{ENV_PREFIX}{section}_{key}".upper())
+    if env is not None:
+        return env
+    return _parser(config_path or get_settings().config_path).get(section, key)
 
-def get_config(section, key, config_path="./app/config/config.ini"):
+@lru_cache(maxsize=4)
+def _parser(config_path: str) -> ConfigParser:
     parser = ConfigParser()
-    parser.read(config_path)
-    return parser.get(section, key)
+    parser.read(config_path, encoding="utf-8")
+    return parser
@@ -0,0 +1,152 @@
+# app/utils/logging_config.py
+"""
+日誌設定：非同步輸出的結構化 (JSON) 日誌。
+
+- configure_logging() 在 root logger 上只掛一個 QueueHandler，請求處理中的 logger 呼叫只把紀錄放進佇列；
+  格式化與寫入 stderr 由背景的 QueueListener 執行緒負責，不佔用事件迴圈。
+- 佇列有容量上限，滿了就丟棄並計數 (medimgmt_log_records_dropped_total)，不阻塞請求。
+- format = json 時每筆紀錄輸出一行 JSON：ts / level / logger / message，以及 extra= 傳入的欄位與例外堆疊。
+- uvicorn 的 logger 改為往 root 傳遞，存取紀錄也走同一條管線。
+- 請求內文、AI 回應等大型資料請用 log_payload()：依 payload_sample_rate 抽樣，並截斷為 payload_max_bytes。
+  錯誤路徑可傳 sample=False，一定記錄但仍會截斷。
+
+各模組只需要 logger = logging.getLogger(__name__)，不要自行呼叫 logging.basicConfig()。
+
+config.ini 範例：
+    [LOGGING]
+    level = INFO
+    format = json
+    queue_size = 10000
+    payload_sample_rate = 0.1
+    payload_max_bytes = 2048
+"""
+
+import atexit
+import logging
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional, Union
+
+import orjson
+
+from app.services.metrics import registry
+from app.utils.config import LoggingSettings, get_settings
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - [%(name)s] - %(message)s"
+
+# LogRecord 本身的屬性；其他屬性是呼叫端以 extra= 附加的欄位
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+_listener: Optional[QueueListener] = None
+_handler: Optional["_NonBlockingQueueHandler"] = None
+_lock = threading.Lock()
+
+class JsonFormatter(logging.Formatter):
+    """每筆紀錄輸出為一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        return orjson.dumps(entry, default=str, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """佇列已滿時丟棄紀錄並計數，不阻塞呼叫端"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只在呼叫端組出訊息文字 (參數可能在之後被修改) 與例外堆疊，其餘格式化交給背景執行緒
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def configure_logging(settings: Optional[LoggingSettings] = None, force: bool = False):
+    """設定 root logger (同一個行程只會設定一次；force=True 時重新設定)"""
+    global _listener, _handler
+    settings = settings or get_settings().logging
+    with _lock:
+        if _listener is not None and not force:
+            return
+        if _listener is not None:
+            _listener.stop()
+
+        output = logging.StreamHandler()
+        output.setFormatter(JsonFormatter() if settings.format == "json" else logging.Formatter(TEXT_FORMAT))
+        _handler = _NonBlockingQueueHandler(queue.Queue(maxsize=settings.queue_size))
+        _listener = QueueListener(_handler.queue, output, respect_handler_level=True)
+
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(settings.level.upper())
+        for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+            uvicorn_logger = logging.getLogger(name)
+            uvicorn_logger.handlers.clear()
+            uvicorn_logger.propagate = True
+        _listener.start()
+
+def stop_logging():
+    """停止背景執行緒並輸出佇列中剩下的紀錄 (行程結束時自動呼叫)"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+atexit.register(stop_logging)
+
+registry.callback_counter(
+    "medimgmt_log_records_dropped_total", "日誌佇列已滿而丟棄的紀錄數", [],
+    callback=lambda: {(): dropped_records()},
+)
+
+def truncate(data: Union[str, bytes], max_bytes: int) -> str:
+    """截斷為最多 max_bytes 個 UTF-8 位元組，並註明原始長度"""
+    raw = data.encode("utf-8") if isinstance(data, str) else bytes(data)
+    if len(raw) <= max_bytes:
+        return data if isinstance(data, str) else raw.decode("utf-8", errors="replace")
+    return raw[:max_bytes].decode("utf-8", errors="ignore") + f"…(截斷，共 {len(raw)} bytes)"
+
+def log_payload(logger: logging.Logger, label: str, payload, level: int = logging.INFO, sample: bool = True) -> bool:
+    """
+    記錄大型資料 (請求內文、AI 回應等)：先判斷等級與抽樣，再以精簡的 JSON 序列化並截斷。
+    回傳是否有記錄。
+    """
+    if not logger.isEnabledFor(level):
+        return False
+    settings = get_settings().logging
+    if sample and random.random() >= settings.payload_sample_rate:
+        return False
+    if not isinstance(payload, (str, bytes, bytearray)):
+        payload = orjson.dumps(payload, default=str, option=orjson.OPT_NON_STR_KEYS)
+    logger.log(level, f"{label}: {truncate(payload, settings.payload_max_bytes)}")
+    return True
@@ -0,0 +1,291 @@
+# bench/e2e_bench.py
+"""
+端對端效能測試：以 uvicorn 啟動應用程式 (獨立行程)，連到本機的 Gemini / LINE 替身，
+以多個虛擬使用者執行 scenarios.py 的操作流程，回報各步驟的 p50 / p99、吞吐量與伺服器記憶體 (RSS)，
+並與儲存的基準 (baseline) 比較，退步超過容許範圍時以結束碼 1 結束 (可放進 CI)。
+
+    # 第一次：產生資料 (10k / 100k / 1m) 並儲存基準
+    python -m bench.e2e_bench --scale 10k --duration 30 --save-baseline
+    # 之後每次修改：與基準比較
+    python -m bench.e2e_bench --scale 10k --duration 30
+
+基準與結果為 JSON，只在同一台機器、相同參數下比較才有意義。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench import seed_data
+from bench.fake_services import gemini_urls, start_fake_gemini, start_fake_line
+from bench.scenarios import SCENARIOS, weighted_picker
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """最近排名法 (nearest rank)"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def read_rss(pid: int) -> Dict[str, Optional[int]]:
+    """目前與最高的 RSS (KB)，讀取 /proc (Linux)；其他平台回傳 None"""
+    values = {"rss_kb": None, "rss_peak_kb": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    values["rss_kb"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    values["rss_peak_kb"] = int(line.split()[1])
+    except OSError:
+        pass
+    return values
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.recording = False
+
+    async def __call__(self, step: str, request, ok=(200,)):
+        started = time.perf_counter()
+        try:
+            response = await request
+            status = str(response.status_code)
+            success = response.status_code in ok
+        except httpx.HTTPError as e:
+            response, status, success = None, type(e).__name__, False
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.latencies.setdefault(step, []).append(elapsed)
+            if not success:
+                step_errors = self.errors.setdefault(step, {})
+                step_errors[status] = step_errors.get(status, 0) + 1
+        return response
+
+async def _virtual_user(client, recorder: Recorder, users: List[str], pick, rng: random.Random, deadline: float):
+    while time.perf_counter() < deadline:
+        name = pick()
+        await SCENARIOS[name][0](client, recorder, rng.choice(users), rng)
+
+async def run_load(base_url: str, users: List[str], scenarios: List[str], concurrency: int,
+                   duration: float, warmup: float, seed: int) -> dict:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        deadline = start + warmup + duration
+        tasks = [
+            asyncio.create_task(_virtual_user(client, recorder, users, weighted_picker(scenarios, random.Random(seed + i)),
+                                              random.Random(seed * 1000 + i), deadline))
+            for i in range(concurrency)
+        ]
+        await asyncio.sleep(warmup)
+        recorder.recording = True
+        measured_from = time.perf_counter()
+        await asyncio.gather(*tasks)
+        measured = time.perf_counter() - measured_from
+
+    steps = {}
+    for step, values in sorted(recorder.latencies.items()):
+        values.sort()
+        steps[step] = {
+            "count": len(values),
+            "errors": sum(recorder.errors.get(step, {}).values()),
+            "error_statuses": recorder.errors.get(step, {}),
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+    total = sum(s["count"] for s in steps.values())
+    return {"steps": steps, "requests": total, "throughput_rps": round(total / measured, 2) if measured else 0.0}
+
+def _start_server(port: int, env: dict, workers: int) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+           "--log-level", "warning", "--workers", str(workers)]
+    return subprocess.Popen(cmd, env=env)
+
+def _wait_ready(base_url: str, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"應用程式啟動失敗 (結束碼 {proc.returncode})")
+        try:
+            if httpx.get(f"{base_url}/api/system/bulkheads", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("等待應用程式啟動逾時")
+
+def _load_users(db_path: str, count: int, seed: int) -> List[str]:
+    import sqlite3
+
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT line_user_id FROM users ORDER BY id").fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        raise RuntimeError(f"{db_path} 中沒有使用者，請先以 --scale 產生資料")
+    ids = [row[0] for row in rows]
+    return random.Random(seed).sample(ids, min(count, len(ids)))
+
+def compare(result: dict, baseline: dict, tolerance: float, p99_tolerance: float, slack_ms: float) -> List[str]:
+    """
+    回傳退步的項目：p50 與記憶體超過 (1 + tolerance) 倍、p99 超過 (1 + p99_tolerance) 倍、
+    吞吐量低於 (1 - tolerance) 倍，或錯誤率比基準高出 1 個百分點以上。
+    """
+    regressions = []
+    for step, base in baseline.get("steps", {}).items():
+        current = result["steps"].get(step)
+        if current is None:
+            regressions.append(f"{step}: 本次沒有執行")
+            continue
+        for key, allowed in (("p50_ms", tolerance), ("p99_ms", p99_tolerance)):
+            limit = base[key] * (1 + allowed) + slack_ms
+            if current[key] > limit:
+                regressions.append(f"{step} {key}: {current[key]:.1f} > {limit:.1f} (基準 {base[key]:.1f})")
+        base_rate = base["errors"] / base["count"] if base["count"] else 0
+        rate = current["errors"] / current["count"] if current["count"] else 0
+        if rate > base_rate + 0.01:
+            regressions.append(f"{step} 錯誤率: {rate:.1%} > 基準 {base_rate:.1%}")
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"吞吐量: {result['throughput_rps']:.1f} < 基準 {baseline['throughput_rps']:.1f} rps")
+    base_rss, rss = baseline.get("server", {}).get("rss_peak_kb"), result.get("server", {}).get("rss_peak_kb")
+    if base_rss and rss and rss > base_rss * (1 + tolerance):
+        regressions.append(f"RSS 峰值: {rss / 1024:.1f} MB > 基準 {base_rss / 1024:.1f} MB")
+    return regressions
+
+def print_report(result: dict):
+    print(f"\n{'步驟':<24} {'次數':>7} {'錯誤':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    for step, s in result["steps"].items():
+        print(f"{step:<24} {s['count']:>7} {s['errors']:>6} {s['p50_ms']:>9.1f} {s['p99_ms']:>9.1f}"
+              + (f"  {s['error_statuses']}" if s["errors"] else ""))
+    server = result.get("server", {})
+    rss = f"{server['rss_kb'] / 1024:.1f} MB (峰值 {server['rss_peak_kb'] / 1024:.1f} MB)" if server.get("rss_kb") else "N/A"
+    print(f"\n吞吐量 {result['throughput_rps']:.1f} req/s，共 {result['requests']} 個請求；伺服器 RSS {rss}")
+    gemini = result.get("fakes", {}).get("gemini")
+    if gemini:
+        print(f"Gemini 替身收到: {gemini}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="端對端效能測試")
+    parser.add_argument("--db", default=seed_data.DEFAULT_DB, help="測試用的 SQLite 檔案")
+    parser.add_argument("--scale", type=seed_data.parse_scale, help="檔案不存在時先產生此規模的資料 (10k / 100k / 1m)")
+    parser.add_argument("--concurrency", type=int, default=20, help="虛擬使用者數")
+    parser.add_argument("--duration", type=float, default=30, help="量測秒數")
+    parser.add_argument("--warmup", type=float, default=3, help="不列入統計的暖機秒數")
+    parser.add_argument("--users", type=int, default=500, help="從資料庫中抽取的使用者數")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="要執行的情境 (逗號分隔)")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker 數 (RSS 只量測主行程)")
+    parser.add_argument("--gemini-latency-ms", type=float, default=800)
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--speculative", action="store_true", help="啟用預先分析 (預設關閉，結果較穩定)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="將結果寫入 JSON 檔")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準檔案")
+    parser.add_argument("--save-baseline", action="store_true", help="以本次結果作為新的基準")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="p50、吞吐量與記憶體容許的退步比例")
+    parser.add_argument("--p99-tolerance", type=float, default=0.5, help="p99 容許的退步比例 (尾端延遲的雜訊較大)")
+    parser.add_argument("--slack-ms", type=float, default=2.0, help="延遲比較時額外容許的毫秒數 (避免極短請求的雜訊)")
+    args = parser.parse_args(argv)
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知的情境: {', '.join(sorted(unknown))}")
+
+    env = dict(os.environ)
+    env["MEDIMGMT_DATABASE_SQLITE_PATH"] = args.db
+    if not os.path.exists(args.db):
+        if args.scale is None:
+            parser.error(f"{args.db} 不存在，請以 --scale 指定要產生的資料規模")
+        subprocess.run([sys.executable, "-m", "bench.seed_data", "--scale", str(args.scale), "--db", args.db,
+                        "--seed", str(args.seed)], env=env, check=True)
+
+    gemini = start_fake_gemini(0, args.gemini_latency_ms, args.gemini_jitter_ms, args.gemini_error_rate, seed=args.seed)
+    line = start_fake_line(0)
+    text_url, vision_url = gemini_urls(gemini)
+    env.update({
+        "MEDIMGMT_GEMINI_API_KEY": "bench",
+        "MEDIMGMT_GEMINI_TEXT_URL": text_url,
+        "MEDIMGMT_GEMINI_VISION_URL": vision_url,
+        "MEDIMGMT_LINE_CHANNEL_SECRET": env.get("MEDIMGMT_LINE_CHANNEL_SECRET", "bench"),
+        "MEDIMGMT_LINE_CHANNEL_ACCESS_TOKEN": env.get("MEDIMGMT_LINE_CHANNEL_ACCESS_TOKEN", "bench"),
+        "MEDIMGMT_LINE_API_ENDPOINT": f"http://127.0.0.1:{line.server_port}",
+        # 頻率限制是針對單一使用者的保護，測試時放寬，量測的是服務本身
+        "MEDIMGMT_ADMISSION_ANALYZE_LIMIT": "1000000",
+        "MEDIMGMT_ADMISSION_RECOGNIZE_LIMIT": "1000000",
+        "MEDIMGMT_SPECULATIVE_ENABLED": "true" if args.speculative else "false",
+    })
+
+    users = _load_users(args.db, args.users, args.seed)
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    proc = _start_server(port, env, args.workers)
+    try:
+        _wait_ready(base_url, proc)
+        print(f"應用程式已啟動 (pid {proc.pid})，{args.concurrency} 個虛擬使用者執行 {args.duration:.0f} 秒："
+              f"{', '.join(scenarios)}")
+        result = asyncio.run(run_load(base_url, users, scenarios, args.concurrency,
+                                      args.duration, args.warmup, args.seed))
+        result["server"] = read_rss(proc.pid)
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        gemini.shutdown()
+        line.shutdown()
+
+    result["fakes"] = {"gemini": dict(gemini.stats), "line": dict(line.stats)}
+    result["params"] = {key: getattr(args, key) for key in
+                        ("concurrency", "duration", "workers", "gemini_latency_ms", "gemini_error_rate",
+                         "speculative", "seed")}
+    result["params"]["scenarios"] = scenarios
+    print_report(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"已儲存基準: {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"沒有基準檔案 {args.baseline}，略過比較 (以 --save-baseline 建立)")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("params") != result["params"]:
+        print("警告：基準的測試參數與本次不同，比較結果僅供參考")
+    regressions = compare(result, baseline, args.tolerance, args.p99_tolerance, args.slack_ms)
+    if regressions:
+        print("\n效能退步：")
+        for line_text in regressions:
+            print(f"  - {line_text}")
+        sys.exit(1)
+    print("\n與基準相比沒有退步")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# bench/fake_services.py
+"""
+效能測試用的本機替身服務：Gemini API 與 LINE Messaging API。
+
+- FakeGemini：依請求內容判斷文字分析 (call_gemini_text) 或藥單辨識 (call_gemini_vision，含 inline_data)，
+  回傳與真實 API 相同結構的固定回應 (含 usageMetadata)；可設定延遲、抖動與錯誤比例。
+  回應只包含提示詞 (含 system_instruction 與 response_schema) 中有提到的標題或欄位，
+  提示詞漏掉輸出格式時回應結構也會跟著缺漏，供 bench/prompt_ab.py 檢查精簡的提示詞。
+  輸入 token 以 len(文字) / 2 計算；system_instruction 與之前的請求相同時回報 cachedContentTokenCount。
+- FakeLine：接受 reply / push 訊息與取得個人資料，只計數不送出。
+- 兩者都提供 GET /__stats 查看收到的請求數。
+
+單獨啟動 (另一個終端機啟動應用程式並以環境變數指向替身)：
+    python -m bench.fake_services --gemini-port 8701 --line-port 8702 --latency-ms 800 --error-rate 0.02
+    MEDIMGMT_GEMINI_API_KEY=bench \\
+    MEDIMGMT_GEMINI_TEXT_URL=http://127.0.0.1:8701/v1beta/models/fake:generateContent \\
+    MEDIMGMT_GEMINI_VISION_URL=http://127.0.0.1:8701/v1beta/models/fake-vision:generateContent \\
+    MEDIMGMT_LINE_API_ENDPOINT=http://127.0.0.1:8702 \\
+    uvicorn app.main:app
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_ANALYSIS = """### 🔍 分析結果
+目前用藥之間發現 1 項需要注意的交互作用。
+
+### ⚠️ 發現的交互作用
+* **Aspirin + Warfarin**：併用會增加出血風險，請留意牙齦出血、黑便等症狀。
+
+### 💊 用藥建議
+- 兩種藥物請勿自行停用或調整劑量，回診時告知醫師正在同時服用。
+- 避免額外服用含銀杏、魚油等可能增加出血風險的保健食品。
+
+### 📋 注意事項
+- 定期監測凝血功能 (INR)。
+
+### 🏥 就醫建議
+如出現不明瘀青或出血不止，請立即就醫。"""
+
+CANNED_MEDICATIONS = [
+    {"name": "脈優錠 Norvasc 5mg", "effect": "降血壓", "dose": "1顆", "frequency": "每日一次",
+     "remind_times": [{"hour": 9, "minute": 0}]},
+    {"name": "Metformin 500mg", "effect": "降血糖", "dose": "1顆", "frequency": "每日二次 (飯後)",
+     "remind_times": [{"hour": 9, "minute": 0}, {"hour": 21, "minute": 0}]},
+    {"name": "Aspirin 100mg", "effect": "抗血小板", "dose": "1顆", "frequency": "每日一次 (飯後)",
+     "remind_times": [{"hour": 9, "minute": 0}]},
+    {"name": "Omeprazole 20mg", "effect": "胃藥", "dose": "1顆", "frequency": "每日一次 (飯前)",
+     "remind_times": [{"hour": 8, "minute": 0}]},
+]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):  # 不輸出每筆請求
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw) if raw else {}
+        except ValueError:
+            return None
+
+    def _send_json(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count(self, key: str):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def do_GET(self):
+        if self.path == "/__stats":
+            with self.server.stats_lock:
+                return self._send_json(200, dict(self.server.stats))
+        return self._send_json(404, {"message": "not found"})
+
+class _GeminiHandler(_Handler):
+    def do_POST(self):
+        server = self.server
+        body = self._read_json()
+        if not self.headers.get("X-Goog-Api-Key"):
+            self._count("unauthorized")
+            return self._send_json(401, {"error": {"code": 401, "message": "API key not valid"}})
+        if body is None or "contents" not in body:
+            self._count("bad_request")
+            return self._send_json(400, {"error": {"code": 400, "message": "Invalid JSON payload"}})
+
+        parts = body["contents"][0].get("parts", [])
+        kind = "vision" if any("inline_data" in part for part in parts) else "text"
+        system = body.get("system_instruction") or body.get("systemInstruction") or {}
+        system_text = "".join(part.get("text", "") for part in system.get("parts", []))
+        prompt = "".join(part.get("text", "") for part in parts)
+        config = body.get("generationConfig") or {}
+        schema = json.dumps(config.get("response_schema") or config.get("responseSchema") or {})
+        prompt_tokens = max(1, len(system_text + prompt) // 2) + (258 if kind == "vision" else 0)
+        with server.stats_lock:
+            cached_tokens = len(system_text) // 2 if system_text in server.seen_prefixes else 0
+            if system_text:
+                server.seen_prefixes.add(system_text)
+
+        delay = max(0.0, server.rng_gauss(server.latency, server.jitter))
+        delay += server.latency_per_1k_tokens * prompt_tokens / 1000
+        time.sleep(delay)
+        if server.rng_random() < server.error_rate:
+            self._count(f"{kind}_error")
+            return self._send_json(server.error_status, {"error": {"code": server.error_status, "message": "injected"}})
+
+        request_text = system_text + prompt + schema
+        if kind == "vision":
+            meds = server.rng_sample(CANNED_MEDICATIONS, server.rng_randint(1, 3))
+            today = date.today().isoformat()
+            meds = [{k: v for k, v in {**m, "start_date": today, "end_date": ""}.items() if k in request_text}
+                    for m in meds]
+            text = json.dumps({"medications": meds} if "medications" in request_text else meds, ensure_ascii=False)
+        else:
+            # 只回傳提示詞中有提到標題的段落
+            sections = [s for s in CANNED_ANALYSIS.split("\n\n### ") if s.lstrip("# ").split("\n")[0] in request_text]
+            text = "### " + "\n\n### ".join(s.lstrip("# ") for s in sections) if sections else "請注意用藥安全。"
+        self._count(kind)
+        output_tokens = max(1, len(text) // 2)
+        usage = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+        if cached_tokens:
+            usage["cachedContentTokenCount"] = cached_tokens
+        self._send_json(200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP"}],
+            "usageMetadata": usage,
+        })
+
+class _LineHandler(_Handler):
+    def do_GET(self):
+        if self.path.startswith("/v2/bot/profile/"):
+            self._count("profile")
+            user_id = self.path.rsplit("/", 1)[-1]
+            return self._send_json(200, {"userId": user_id, "displayName": "測試使用者", "language": "zh-TW"})
+        return super().do_GET()
+
+    def do_POST(self):
+        body = self._read_json()
+        if not (self.headers.get("Authorization") or "").startswith("Bearer "):
+            self._count("unauthorized")
+            return self._send_json(401, {"message": "Authentication failed"})
+        if self.path in ("/v2/bot/message/reply", "/v2/bot/message/push"):
+            if body is None or not body.get("messages"):
+                self._count("bad_request")
+                return self._send_json(400, {"message": "The request body has 1 error(s)"})
+            self._count(self.path.rsplit("/", 1)[-1])
+            return self._send_json(200, {})
+        return self._send_json(404, {"message": "Not found"})
+
+def _make_server(handler, port: int, **options) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.stats = {}
+    server.seen_prefixes = set()
+    server.stats_lock = threading.Lock()
+    rng = random.Random(options.pop("seed", 42))
+    rng_lock = threading.Lock()
+
+    def locked(func):
+        def call(*args):
+            with rng_lock:
+                return func(*args)
+        return call
+
+    server.rng_gauss = locked(rng.gauss)
+    server.rng_random = locked(rng.random)
+    server.rng_sample = locked(rng.sample)
+    server.rng_randint = locked(rng.randint)
+    for key, value in options.items():
+        setattr(server, key, value)
+    return server
+
+def _serve(server: ThreadingHTTPServer) -> ThreadingHTTPServer:
+    threading.Thread(target=server.serve_forever, name=f"fake-{server.server_port}", daemon=True).start()
+    return server
+
+def start_fake_gemini(port: int = 0, latency_ms: float = 0, jitter_ms: float = 0,
+                      error_rate: float = 0, error_status: int = 503, seed: int = 42,
+                      ms_per_1k_tokens: float = 0) -> ThreadingHTTPServer:
+    """
+    在背景執行緒啟動 Gemini 替身，port=0 時自動選擇；回傳的 server.server_port 為實際埠號。
+    ms_per_1k_tokens：每 1000 個輸入 token 額外增加的延遲 (模擬較長的提示詞需要較久的處理時間)。
+    """
+    return _serve(_make_server(
+        _GeminiHandler, port, latency=latency_ms / 1000, jitter=jitter_ms / 1000,
+        error_rate=error_rate, error_status=error_status, seed=seed,
+        latency_per_1k_tokens=ms_per_1k_tokens / 1000,
+    ))
+
+def start_fake_line(port: int = 0) -> ThreadingHTTPServer:
+    return _serve(_make_server(_LineHandler, port))
+
+def gemini_urls(server: ThreadingHTTPServer):
+    base = f"http://127.0.0.1:{server.server_port}/v1beta/models"
+    return f"{base}/fake:generateContent", f"{base}/fake-vision:generateContent"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini / LINE API 替身服務")
+    parser.add_argument("--gemini-port", type=int, default=8701)
+    parser.add_argument("--line-port", type=int, default=8702)
+    parser.add_argument("--latency-ms", type=float, default=800, help="Gemini 平均回應時間")
+    parser.add_argument("--jitter-ms", type=float, default=200, help="Gemini 回應時間的標準差")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入錯誤的比例 (0~1)")
+    parser.add_argument("--error-status", type=int, default=503, help="注入錯誤時的 HTTP 狀態碼")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=0, help="每 1000 個輸入 token 增加的延遲")
+    args = parser.parse_args(argv)
+
+    gemini = start_fake_gemini(args.gemini_port, args.latency_ms, args.jitter_ms, args.error_rate, args.error_status,
+                               ms_per_1k_tokens=args.ms_per_1k_tokens)
+    line = start_fake_line(args.line_port)
+    text_url, vision_url = gemini_urls(gemini)
+    print(f"Gemini 替身: {text_url}\n           {vision_url}\nLINE 替身:   http://127.0.0.1:{line.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        gemini.shutdown()
+        line.shutdown()
+
+if __name__ == "__main__":
+    main()
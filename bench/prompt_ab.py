@@ -0,0 +1,137 @@
+# bench/prompt_ab.py
+"""
+提示詞範本的 A/B 比較 (對本機的 Gemini 替身執行，不需要 API 金鑰)。
+
+對同一組合成的用藥 / 個人資料，分別以兩個版本的範本 (預設 v1 vs v2) 呼叫 Gemini 替身，比較：
+    估計輸入 token、替身回報的輸入 token 與快取 token、請求大小、回應時間
+並檢查輸出結構：
+    analysis      回應依序包含 prompts.ANALYSIS_HEADINGS 的所有標題
+    prescription  回應為 {"medications": [...]}，每筆包含 prompts.PRESCRIPTION_FIELDS 的所有欄位
+替身只回傳提示詞中有提到的標題 / 欄位，精簡後漏掉輸出格式的範本會在這裡失敗。
+候選版本的結構檢查沒有全部通過時結束碼為 1。
+
+    python -m bench.prompt_ab
+    python -m bench.prompt_ab --endpoint analysis --samples 100 --ms-per-1k-tokens 400
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+from bench.fake_services import gemini_urls, start_fake_gemini
+from bench.scenarios import TINY_JPEG
+from bench.seed_data import DRUGS, FREQUENCIES
+
+TIMEZONES = ["Asia/Taipei", "Asia/Tokyo", "America/Los_Angeles"]
+
+def _samples(count: int, seed: int, profile_columns):
+    rng = random.Random(seed)
+    for _ in range(count):
+        medications = [
+            SimpleNamespace(name=name, effect=effect, dose=rng.choice(["1顆", "半顆", "10mg", None]),
+                            frequency=rng.choice(list(FREQUENCIES)))
+            for name, effect in rng.sample(DRUGS, rng.randint(1, 8))
+        ]
+        profile = None if rng.random() < 0.3 else SimpleNamespace(
+            **{column: rng.random() < 0.15 for column in profile_columns}
+        )
+        yield medications, profile, rng.choice(TIMEZONES)
+
+def _analysis_ok(text: str, headings) -> bool:
+    positions = [text.find(f"### {heading}") for heading in headings]
+    return all(p >= 0 for p in positions) and positions == sorted(positions)
+
+def _prescription_ok(response: dict, fields) -> bool:
+    try:
+        data = json.loads(response["candidates"][0]["content"]["parts"][0]["text"])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return False
+    meds = data.get("medications") if isinstance(data, dict) else None
+    return isinstance(meds, list) and all(isinstance(m, dict) and all(f in m for f in fields) for m in meds)
+
+def run_variant(endpoint: str, version: str, samples, prompts) -> dict:
+    from app.services.germini_service import call_gemini_text, call_gemini_vision
+    from app.services.interaction_analysis import extract_analysis_result
+
+    estimated, actual, cached, sizes, latencies, passed = [], [], [], [], [], 0
+    for medications, profile, timezone in samples:
+        if endpoint == prompts.ANALYSIS:
+            rendered = prompts.render_analysis(medications, profile, version)
+            body = rendered.request_body()
+            started = time.perf_counter()
+            response = call_gemini_text(rendered)
+            ok = _analysis_ok(extract_analysis_result(response), prompts.ANALYSIS_HEADINGS)
+        else:
+            rendered = prompts.render_prescription(timezone, "2026-01-01", version)
+            body = rendered.request_body()
+            started = time.perf_counter()
+            response = call_gemini_vision(TINY_JPEG, timezone, prompt_version=version)
+            ok = _prescription_ok(response, prompts.PRESCRIPTION_FIELDS)
+        latencies.append((time.perf_counter() - started) * 1000)
+        usage = response.get("usageMetadata", {})
+        estimated.append(rendered.estimated_tokens)
+        actual.append(usage.get("promptTokenCount", 0))
+        cached.append(usage.get("cachedContentTokenCount", 0))
+        sizes.append(len(json.dumps(body, ensure_ascii=False).encode("utf-8")))
+        passed += ok
+    return {
+        "version": version,
+        "estimated_tokens": statistics.mean(estimated),
+        "prompt_tokens": statistics.mean(actual),
+        "cached_tokens": statistics.mean(cached),
+        "request_bytes": statistics.mean(sizes),
+        "p50_ms": statistics.median(latencies),
+        "structure_ok": passed / len(samples),
+    }
+
+def _print(endpoint: str, baseline: dict, candidate: dict):
+    print(f"\n[{endpoint}]")
+    print(f"{'':<18}{baseline['version']:>12}{candidate['version']:>12}{'變化':>10}")
+    for key, fmt in (("estimated_tokens", "{:.0f}"), ("prompt_tokens", "{:.0f}"), ("cached_tokens", "{:.0f}"),
+                     ("request_bytes", "{:.0f}"), ("p50_ms", "{:.1f}"), ("structure_ok", "{:.0%}")):
+        a, b = baseline[key], candidate[key]
+        change = f"{(b - a) / a:+.0%}" if a and key != "structure_ok" else ""
+        print(f"{key:<18}{fmt.format(a):>12}{fmt.format(b):>12}{change:>10}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="提示詞範本 A/B 比較 (Gemini 替身)")
+    parser.add_argument("--endpoint", choices=["analysis", "prescription", "all"], default="all")
+    parser.add_argument("--baseline", default="v1")
+    parser.add_argument("--candidate", default="v2")
+    parser.add_argument("--samples", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50, help="替身的基本回應時間")
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=300, help="每 1000 個輸入 token 增加的回應時間")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    gemini = start_fake_gemini(0, latency_ms=args.latency_ms, ms_per_1k_tokens=args.ms_per_1k_tokens, seed=args.seed)
+    text_url, vision_url = gemini_urls(gemini)
+    # 必須在匯入 app 之前設定，Gemini 設定在匯入時讀取
+    os.environ.update({
+        "MEDIMGMT_GEMINI_API_KEY": "bench",
+        "MEDIMGMT_GEMINI_TEXT_URL": text_url,
+        "MEDIMGMT_GEMINI_VISION_URL": vision_url,
+    })
+    from app.services import prompts
+
+    profile_columns = [column for _, _, items in prompts.PROFILE_GROUPS for column, _ in items]
+    samples = list(_samples(args.samples, args.seed, profile_columns))
+    endpoints = [prompts.ANALYSIS, prompts.PRESCRIPTION] if args.endpoint == "all" else [args.endpoint]
+    failed = False
+    for endpoint in endpoints:
+        baseline = run_variant(endpoint, args.baseline, samples, prompts)
+        candidate = run_variant(endpoint, args.candidate, samples, prompts)
+        _print(endpoint, baseline, candidate)
+        if candidate["structure_ok"] < 1:
+            print(f"!! {endpoint} {args.candidate} 的輸出結構檢查未全部通過")
+            failed = True
+    gemini.shutdown()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# bench/scenarios.py
+"""
+模擬 LIFF 前端 (app/liff/js/app.js、reminder.js) 操作流程的負載情境。
+
+每個情境是一連串依序送出的請求，對應使用者在 App 中的一次操作：
+    open_app   開啟 App：用藥清單、今日提醒、個人資料
+    recognize  上傳藥單圖片辨識 (Gemini vision)
+    save       儲存辨識結果 (批次新增藥物) 後重新載入用藥清單
+    analyze    交互作用分頁：開啟個人資料並進行分析 (Gemini text，用藥未變時取得已存的分析)
+"""
+
+import random
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+# 只有檔頭的 JPEG：後端只檢查 content type，辨識結果由 Gemini 替身決定
+TINY_JPEG = b"\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xd9"
+
+NEW_MEDICATIONS = [
+    ("Aspirin 100mg", "抗血小板", "每日一次"),
+    ("Warfarin 5mg", "抗凝血", "每日一次"),
+    ("Omeprazole 20mg", "胃藥", "每日一次 (飯前)"),
+    ("Metformin 500mg", "降血糖", "每日二次"),
+]
+
+# record(step 名稱, 協程, 視為成功的狀態碼) -> 回應
+Record = Callable[..., Awaitable]
+
+async def open_app(client, record: Record, user_id: str, rng: random.Random):
+    await record("open.medications", client.get(f"/api/medications/user/{user_id}"))
+    await record("open.reminders_today",
+                 client.get(f"/api/reminder/user/{user_id}/today", params={"timezone": "Asia/Taipei"}))
+    # 沒有填寫個人資料的使用者回傳 404，前端視為正常
+    await record("open.profile", client.get(f"/api/user-profile/{user_id}"), ok=(200, 404))
+
+async def recognize(client, record: Record, user_id: str, rng: random.Random):
+    await record("recognize.upload", client.post(
+        "/api/prescription/recognize",
+        files={"file": ("prescription.jpg", TINY_JPEG, "image/jpeg")},
+        data={"user_id": user_id, "user_timezone": "Asia/Taipei"},
+    ))
+
+async def save(client, record: Record, user_id: str, rng: random.Random):
+    # 與 app.js 儲存表單送出的欄位相同
+    payload = [
+        {"user_id": user_id, "name": name, "effect": effect, "dose": "1顆", "frequency": frequency,
+         "start_date": None, "end_date": None, "status": "進行中"}
+        for name, effect, frequency in rng.sample(NEW_MEDICATIONS, rng.randint(1, 3))
+    ]
+    await record("save.create", client.post("/api/medications/", json=payload), ok=(201,))
+    await record("save.reload", client.get(f"/api/medications/user/{user_id}"))
+
+async def analyze(client, record: Record, user_id: str, rng: random.Random):
+    await record("analyze.profile", client.get(f"/api/user-profile/{user_id}"), ok=(200, 404))
+    await record("analyze.run", client.post("/api/alert/analyze", json={"user_id": user_id}))
+
+# 情境 -> (函式, 權重)
+SCENARIOS: Dict[str, Tuple[Callable, float]] = {
+    "open_app": (open_app, 0.5),
+    "recognize": (recognize, 0.1),
+    "save": (save, 0.2),
+    "analyze": (analyze, 0.2),
+}
+
+def weighted_picker(names: List[str], rng: random.Random) -> Callable[[], str]:
+    weights = [SCENARIOS[name][1] for name in names]
+    return lambda: rng.choices(names, weights)[0]
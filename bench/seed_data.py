@@ -0,0 +1,200 @@
+# bench/seed_data.py
+"""
+產生效能測試用的合成資料：使用者、藥物、個人資料、服藥提醒與交互作用分析紀錄。
+
+規模以藥物筆數表示 (10k / 100k / 1m)，其他資料依比例產生：
+    使用者     scale / 5      (平均每人 5 筆藥物)
+    個人資料   使用者的 70%
+    服藥提醒   約等於藥物筆數，分布在今天前後 3 天 (UTC)，「今日提醒」查詢有資料
+    分析紀錄   每位使用者 0~3 筆，內容為真實長度的分析報告 (經 CompressedJSON 壓縮)
+
+資料庫路徑以環境變數 MEDIMGMT_DATABASE_SQLITE_PATH 傳給應用程式的設定，預設寫入獨立的測試檔案而非 med.db：
+    python -m bench.seed_data --scale 100k --db /tmp/medimgmt_bench.db
+    python -m bench.seed_data --scale 10k --db ./med.db --append
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_DB = "/tmp/medimgmt_bench.db"
+
+DRUGS = [
+    ("Aspirin 100mg", "抗血小板"), ("Warfarin 5mg", "抗凝血"), ("Clopidogrel 75mg", "抗血小板"),
+    ("Omeprazole 20mg", "胃藥"), ("Metformin 500mg", "降血糖"), ("脈優錠 Norvasc 5mg", "降血壓"),
+    ("Atorvastatin 20mg", "降血脂"), ("Simvastatin 20mg", "降血脂"), ("Amoxicillin 500mg", "抗生素"),
+    ("Acetaminophen 500mg", "止痛退燒"), ("Ibuprofen 400mg", "止痛消炎"), ("Losartan 50mg", "降血壓"),
+    ("Levothyroxine 50mcg", "甲狀腺素"), ("Allopurinol 100mg", "降尿酸"), ("Sertraline 50mg", "抗憂鬱"),
+    ("Digoxin 0.25mg", "強心"), ("Furosemide 40mg", "利尿"), ("Prednisolone 5mg", "類固醇"),
+    ("Gliclazide 30mg", "降血糖"), ("Bisoprolol 5mg", "降血壓"),
+]
+# 頻率 -> 提醒時間 (與 Gemini 提示詞中的對照相同)，用來產生服藥提醒
+FREQUENCIES = {
+    "每日一次": [(9, 0)],
+    "每日二次": [(9, 0), (21, 0)],
+    "每日三次": [(9, 0), (14, 0), (19, 0)],
+    "睡前": [(22, 0)],
+    "每日一次 (飯後)": [(9, 0)],
+}
+TIMEZONES = ["Asia/Taipei"] * 8 + ["Asia/Tokyo", "America/Los_Angeles"]
+PROFILE_FLAGS = [
+    "diet_alcohol", "diet_caffeine", "diet_grapefruit", "diet_milk", "diet_high_vitamin_k",
+    "supp_ginkgo", "supp_fish_oil", "history_diabetes", "history_hypertension",
+    "history_gastric_ulcer", "condition_elderly", "condition_pregnancy",
+]
+ANALYSIS_TEMPLATE = """### 🔍 分析結果
+共分析 {count} 種藥物，發現 {found} 項需要注意的交互作用。
+
+### ⚠️ 發現的交互作用
+{items}
+
+### 💊 用藥建議
+- 請依醫師指示服用，不要自行停藥或調整劑量。
+- 如需服用保健食品，請先諮詢藥師。
+
+### 📋 注意事項
+- 服藥期間避免飲酒，並定期回診追蹤。
+
+### 🏥 就醫建議
+如出現不明出血、嚴重頭暈或過敏反應，請立即就醫。"""
+
+def parse_scale(value: str) -> int:
+    value = value.lower()
+    if value in SCALES:
+        return SCALES[value]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"規模必須是 {', '.join(SCALES)} 或整數")
+
+def user_ids(count: int, seed: int = 42):
+    """與 seed() 相同的使用者 ID 序列 (LINE User ID 格式：U + 32 位十六進位)"""
+    rng = random.Random(seed)
+    return [f"U{rng.getrandbits(128):032x}" for _ in range(count)]
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def seed(scale: int, batch_size: int = 5000, seed_value: int = 42, log=print) -> dict:
+    """依目前設定的資料庫 (MEDIMGMT_DATABASE_SQLITE_PATH) 寫入合成資料，回傳各資料表新增的筆數"""
+    from sqlalchemy import insert, select, func
+
+    from app.db.database import SHARD_COUNT, engine, init_db
+    from app.models.alert import Alert
+    from app.models.medication import Medication
+    from app.models.reminder import Reminder
+    from app.models.user import User
+    from app.models.user_profile import UserProfile
+
+    if SHARD_COUNT > 1:
+        # 資料直接寫入分片 0；要測試分片模式請以 shards = 1 產生後執行 python -m app.services.reshard --to N
+        raise RuntimeError("seed_data 只支援 [DATABASE] shards = 1")
+    init_db()
+    rng = random.Random(seed_value)
+    n_users = max(1, scale // 5)
+    ids = user_ids(n_users, seed_value)
+    today = date.today()
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    counts = {}
+
+    def write(model, rows):
+        started = time.perf_counter()
+        total = 0
+        with engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            for batch in _batches(rows, batch_size):
+                conn.execute(insert(model), batch)
+                total += len(batch)
+        counts[model.__tablename__] = total
+        log(f"{model.__tablename__:<16} {total:>10,} 筆  {time.perf_counter() - started:6.1f} s")
+
+    write(User, ({"line_user_id": uid, "name": f"測試使用者{i}", "timezone": rng.choice(TIMEZONES)}
+                 for i, uid in enumerate(ids)))
+    write(UserProfile, ({"user_id": uid, **{flag: rng.random() < 0.15 for flag in PROFILE_FLAGS}}
+                        for uid in ids if rng.random() < 0.7))
+
+    with engine.connect() as conn:
+        first_med_id = (conn.scalar(select(func.max(Medication.id))) or 0) + 1
+
+    med_owner = []  # 依 id 順序記錄每筆藥物的頻率，產生提醒時使用
+
+    def medications():
+        for i in range(scale):
+            uid = ids[i] if i < n_users else rng.choice(ids)  # 每人至少一筆
+            name, effect = rng.choice(DRUGS)
+            frequency = rng.choice(list(FREQUENCIES))
+            start = today - timedelta(days=rng.randint(0, 180))
+            med_owner.append(frequency)
+            yield {
+                "user_id": uid, "name": name, "effect": effect, "dose": rng.choice(["1顆", "半顆", "2顆", "10mg"]),
+                "frequency": frequency,
+                "remind_times": None,  # 前端儲存時不送出此欄位
+                "start_date": start,
+                "end_date": start + timedelta(days=rng.choice([7, 14, 28, 90, 365])) if rng.random() < 0.6 else None,
+                "status": "進行中" if rng.random() < 0.85 else "已停藥",
+                "version": 1,
+            }
+
+    write(Medication, medications())
+
+    def reminders():
+        for offset, frequency in enumerate(med_owner):
+            if rng.random() < 0.35:
+                continue
+            times = FREQUENCIES[frequency]
+            for _ in range(rng.randint(1, 2)):
+                hour, minute = rng.choice(times)
+                day = now.replace(hour=hour, minute=minute) + timedelta(days=rng.randint(-3, 3))
+                yield {"medication_id": first_med_id + offset, "remind_time": day, "taken": day < now and rng.random() < 0.8}
+
+    write(Reminder, reminders())
+
+    def alerts():
+        for uid in ids:
+            for _ in range(rng.choice([0, 0, 1, 1, 2, 3])):
+                names = rng.sample(DRUGS, rng.randint(2, 4))
+                items = "\n".join(f"* **{a[0]} + {b[0]}**：可能影響藥效，請諮詢藥師。" for a, b in zip(names, names[1:]))
+                yield {
+                    "user_id": uid,
+                    "alert_time": now - timedelta(days=rng.randint(0, 400), minutes=rng.randint(0, 1440)),
+                    "result": {
+                        "analysis": ANALYSIS_TEMPLATE.format(count=len(names), found=len(names) - 1, items=items),
+                        "medication_count": len(names),
+                        "has_profile": True,
+                        "speculative": False,
+                    },
+                }
+
+    write(Alert, alerts())
+    return counts
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="產生效能測試用的合成資料")
+    parser.add_argument("--scale", type=parse_scale, default="10k", help="藥物筆數：10k / 100k / 1m 或整數")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"SQLite 檔案路徑 (預設 {DEFAULT_DB})")
+    parser.add_argument("--append", action="store_true", help="檔案已存在時附加資料 (使用者 ID 由 --seed 決定，附加時請換一個 seed)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.db) and not args.append:
+        sys.exit(f"{args.db} 已存在；請指定新的路徑，或加上 --append 附加資料")
+    # 必須在匯入 app 之前設定，資料庫引擎在匯入時建立
+    os.environ["MEDIMGMT_DATABASE_SQLITE_PATH"] = args.db
+    started = time.perf_counter()
+    counts = seed(args.scale, batch_size=args.batch_size, seed_value=args.seed)
+    print(f"完成：{sum(counts.values()):,} 筆，{time.perf_counter() - started:.1f} s -> {args.db}")
+
+if __name__ == "__main__":
+    main()
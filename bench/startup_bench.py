@@ -0,0 +1,79 @@
+# bench/startup_bench.py
+"""
+應用程式冷啟動時間與匯入時間分析。
+
+每次都在新的子行程中量測 (不受本行程已載入模組的影響)：
+- import：`import app.main` 所需時間
+- startup：匯入後再執行 startup 事件 (init_db、排程器、知識庫等) 直到可以接收請求
+並以 python -X importtime 列出累計耗時最多的模組，方便找出應延遲載入的套件。
+
+    python -m bench.startup_bench --runs 5 --top 15
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+_IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import app.main
+print(f"{time.perf_counter() - start:.6f}")
+"""
+
+_STARTUP_SNIPPET = """
+import time
+start = time.perf_counter()
+import app.main
+from fastapi.testclient import TestClient
+with TestClient(app.main.app):
+    print(f"{time.perf_counter() - start:.6f}")
+"""
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def _run(snippet: str) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", snippet], capture_output=True, text=True, env=dict(os.environ), check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+def _measure(label: str, snippet: str, runs: int):
+    samples = [_run(snippet) for _ in range(runs)]
+    print(f"{label:<10} 中位數 {statistics.median(samples) * 1000:8.1f} ms   "
+          f"最小 {min(samples) * 1000:8.1f} ms   最大 {max(samples) * 1000:8.1f} ms   ({runs} 次)")
+
+def import_profile(top: int):
+    """回傳 -X importtime 中累計耗時最多的頂層與第一層模組 [(模組, 自身 µs, 累計 µs)]"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        capture_output=True, text=True, env=dict(os.environ), check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        # 縮排代表巢狀層級，只看直接被 app 匯入的模組才不會重複計算
+        if match and len(match.group(3)) <= 3:
+            rows.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷啟動與匯入時間量測")
+    parser.add_argument("--runs", type=int, default=5, help="每項量測的次數")
+    parser.add_argument("--top", type=int, default=15, help="列出耗時最多的模組數")
+    parser.add_argument("--skip-startup", action="store_true", help="只量測匯入時間 (不執行 startup 事件)")
+    args = parser.parse_args(argv)
+
+    _measure("import", _IMPORT_SNIPPET, args.runs)
+    if not args.skip_startup:
+        _measure("startup", _STARTUP_SNIPPET, args.runs)
+
+    print(f"\n{'模組':<48} {'自身 ms':>9} {'累計 ms':>9}")
+    for module, self_us, cumulative_us in import_profile(args.top):
+        print(f"{module:<48} {self_us / 1000:9.1f} {cumulative_us / 1000:9.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+# bench/timezone_bench.py
+"""
+時區轉換效能比較：原本每次呼叫 pytz.timezone() 的逐筆轉換 vs. 快取 + 轉換點表的批次轉換。
+
+    python -m bench.timezone_bench --count 200000 --zones 30
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from app.services.timezone import convert_many
+
+def legacy_convert(dt: datetime, user_timezone: str):
+    """舊版 convert_time_to_user_timezone 的做法：每次重新取得時區物件"""
+    user_tz = pytz.timezone(user_timezone)
+    return pytz.utc.localize(dt).astimezone(user_tz)
+
+def _timed(label: str, func, count: int):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {elapsed * 1000:9.1f} ms  ({count / elapsed:,.0f} 筆/秒)")
+    return result, elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="時區轉換效能比較")
+    parser.add_argument("--count", type=int, default=200_000, help="轉換筆數")
+    parser.add_argument("--zones", type=int, default=30, help="使用的時區數量")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    zones = rng.sample([z for z in pytz.common_timezones if "/" in z], args.zones)
+    base = datetime(2020, 1, 1)
+    pairs = [
+        (base + timedelta(seconds=rng.randint(0, 10 * 365 * 86400)), rng.choice(zones))
+        for _ in range(args.count)
+    ]
+
+    legacy, legacy_time = _timed("逐筆 pytz.timezone()", lambda: [legacy_convert(dt, tz) for dt, tz in pairs], args.count)
+    batched, batch_time = _timed("convert_many (批次)", lambda: convert_many(pairs), args.count)
+
+    mismatches = sum(1 for a, b in zip(legacy, batched) if a != b or a.utcoffset() != b.utcoffset())
+    print(f"加速倍數: {legacy_time / batch_time:.1f}x，結果不一致筆數: {mismatches}")
+
+if __name__ == "__main__":
+    main()